@@ -3,7 +3,8 @@
  * Character Texture Compositor API
  * 
  * Composites character skin + equipped armor textures into a single PNG.
- * Calls a Python backend script for the actual BLP decoding and compositing.
+ * Renders through the resident compositor (tools/texture_server.py) when it is
+ * running, otherwise calls the Python backend script for BLP decoding and compositing.
  *
  * Parameters:
  *   race    - Race name (e.g. "bloodelf")
@@ -14,6 +15,16 @@
  * Returns: PNG image
  *
  * Caching: Results are cached by parameter hash in /var/www/aowow/cache/chartex/
+ *
+ * Concurrent misses for the same key render once: the resident compositor
+ * coalesces them, and the one-off fallback serializes on a lock and then
+ * serves what the first request wrote. Locks are sharded by the first two hex
+ * digits of the key (cache/chartex/.locks/<xx>.lock), so at most 256 lock
+ * files exist next to the renders.
+ *
+ * Misses are answered with a fast, larger PNG ($encoder) and re-encoded in
+ * the background to the smallest PNG ($reencode), so the first visitor does
+ * not wait on PNG optimization and later ones get the small file.
  */
 
 header('Access-Control-Allow-Origin: *');
@@ -21,7 +32,17 @@ header('Access-Control-Allow-Origin: *');
 $race  = isset($_GET['race'])  ? preg_replace('/[^a-z]/i', '', $_GET['race']) : 'human';
 $sex   = isset($_GET['sex'])   ? (strtolower($_GET['sex']) === 'female' ? 'female' : 'male') : 'male';
 $skin  = isset($_GET['skin'])  ? intval($_GET['skin']) : 0;
-$items = isset($_GET['items']) ? preg_replace('/[^0-9,]/', '', $_GET['items']) : '';
+// Canonical display ID list (positive integers; empty slots dropped), as
+// composite_texture.cache_key() builds it, so batch pre-renders and requests share cache files
+$itemIds = isset($_GET['items'])
+         ? array_values(array_filter(array_map('intval', explode(',', $_GET['items'])),
+                                     function ($id) { return $id > 0; }))
+         : [];
+$items = implode(',', $itemIds);
+
+// Image encoders (tools/image_encoding.py); set $reencode to '' to keep the fast PNG
+$encoder  = 'png-fast';
+$reencode = 'png-optimize';
 
 // Build cache key
 $cacheKey = md5("{$race}_{$sex}_{$skin}_{$items}");
@@ -41,20 +62,93 @@ if (!is_dir($cacheDir)) {
     @mkdir($cacheDir, 0755, true);
 }
 
-// Call Python compositor
-$python = '/usr/bin/python3';
-$script = __DIR__ . '/../tools/composite_texture.py';
+// Hand the render to the resident compositor (tools/texture_server.py) if it
+// is running; it keeps MPQ data and decoded textures warm between requests.
+$output  = '';
+$socket  = __DIR__ . '/../cache/chartex.sock';
+$served  = false;
+$busy    = false;
+
+if (file_exists($socket)) {
+    $conn = @stream_socket_client('unix://' . $socket, $errno, $errstr, 1.0);
+    if ($conn) {
+        stream_set_timeout($conn, 30);
+        fwrite($conn, json_encode([
+            'race'   => $race,
+            'sex'    => $sex,
+            'skin'   => $skin,
+            'items'  => $itemIds,
+            'output'   => $cachePath,
+            'encoder'  => $encoder,
+            'reencode' => $reencode,
+        ]) . "\n");
+        $reply = json_decode((string)fgets($conn), true);
+        fclose($conn);
+
+        $served = is_array($reply) && !empty($reply['ok']);
+        $busy   = is_array($reply) && !empty($reply['busy']);
+        if (!$served) {
+            $output = is_array($reply) ? ($reply['error'] ?? '') : 'No reply from compositor server';
+        }
+    }
+}
+
+// The compositor is running but its queue is full: don't add a one-off render on top
+if ($busy) {
+    header('Content-Type: application/json');
+    header('Retry-After: 2');
+    http_response_code(503);
+    echo json_encode(['error' => 'Texture compositor busy']);
+    exit;
+}
+
+// Fall back to a one-off Python compositor process
+$fresh = function () use ($cachePath) {
+    clearstatcache(true, $cachePath);
+    return file_exists($cachePath) && (time() - filemtime($cachePath)) < 86400;
+};
+
+if (!$served) {
+    // One render per key: later requests wait here and serve the first one's result
+    $lockDir = "{$cacheDir}/.locks";
+    if (!is_dir($lockDir)) {
+        @mkdir($lockDir, 0755, true);
+    }
+    $lock = @fopen($lockDir . '/' . substr($cacheKey, 0, 2) . '.lock', 'c');
+    if ($lock) {
+        flock($lock, LOCK_EX);
+    }
+}
+
+if (!$served && !$fresh()) {
+    $python = '/usr/bin/python3';
+    $script = __DIR__ . '/../tools/composite_texture.py';
 
-$cmd = escapeshellcmd($python) . ' ' . escapeshellarg($script)
-     . ' --race ' . escapeshellarg($race)
-     . ' --sex ' . escapeshellarg($sex)
-     . ' --skin ' . escapeshellarg(strval($skin))
-     . ' --items ' . escapeshellarg($items)
-     . ' --output ' . escapeshellarg($cachePath)
-     . ' 2>&1';
+    $cmd = escapeshellcmd($python) . ' ' . escapeshellarg($script)
+         . ' --race ' . escapeshellarg($race)
+         . ' --sex ' . escapeshellarg($sex)
+         . ' --skin ' . escapeshellarg(strval($skin))
+         . ' --items ' . escapeshellarg($items)
+         . ' --output ' . escapeshellarg($cachePath)
+         . ' --encoder ' . escapeshellarg($encoder)
+         . ' --no-server'
+         . ' 2>&1';
 
-$output = shell_exec($cmd);
-$exitCode = 0;
+    $output .= shell_exec($cmd);
+
+    // Shrink the cached file after this response without holding it up
+    if ($reencode !== '' && $reencode !== $encoder && file_exists($cachePath)) {
+        exec(escapeshellcmd($python) . ' ' . escapeshellarg($script)
+             . ' --recompress ' . escapeshellarg($cachePath)
+             . ' --encoder ' . escapeshellarg($reencode)
+             . ' > /dev/null 2>&1 &');
+    }
+}
+
+if (!empty($lock)) {
+    flock($lock, LOCK_UN);
+    fclose($lock);
+}
 
 if (file_exists($cachePath) && filesize($cachePath) > 0) {
     header('Content-Type: image/png');
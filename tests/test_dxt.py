@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+DXT block helper tests.
+
+Checks that encode_bc3() round-trips smooth content within a stated error
+bound when decoded by texture2ddecoder (both through decode_blocks() and as a
+whole image), and that to_bc3() only marks BC1 blocks exact when their BC3
+copy decodes to the same texels: 4-color blocks, and 3-color blocks that
+never use the midpoint or the punch-through (index 3) entry. texture2ddecoder
+applies the BC1 3-color rule to BC3 color blocks too, so the GPU behaviour
+(BC3 color is always 4-color) is checked with a small reference decoder.
+
+Usage: python3 -m pytest tests/test_dxt.py
+"""
+
+import os
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tools'))
+
+from dxt import (DXTLevel, bc3_to_rgba, block_alpha_range, decode_blocks, encode_bc3, rgba_to_bc3,
+                 texture2ddecoder, to_bc3)
+
+# Round-trip bounds for linear ramps: RGB565 endpoints are 8 (red/blue) or
+# 4 (green) levels apart, plus palette interpolation rounding; alpha has 8
+# interpolated levels per block.
+MAX_COLOR_ERROR = 12
+MEAN_COLOR_ERROR = 3.0
+MAX_ALPHA_ERROR = 2
+
+
+def ramp_image(size=64):
+    """RGBA image of linear ramps (every 4x4 block is close to a line in color space)."""
+    y, x = np.mgrid[0:size, 0:size]
+    return np.stack([x * 4, y * 4, (x + y) * 2, 255 - x * 2], axis=-1).astype(np.uint8)
+
+
+def to_texels(image):
+    """HxWx4 image -> (N, 16, 4) texels, blocks in row-major order."""
+    height, width = image.shape[:2]
+    blocks = image.reshape(height // 4, 4, width // 4, 4, 4).transpose(0, 2, 1, 3, 4)
+    return blocks.reshape(-1, 16, 4)
+
+
+def bc1_block(c0, c1, indices):
+    """8-byte BC1 block from RGB565 endpoints and 16 2-bit indices."""
+    packed = sum(int(index) << (2 * i) for i, index in enumerate(indices))
+    return np.frombuffer(np.array([c0, c1], dtype='<u2').tobytes() +
+                         np.array([packed], dtype='<u4').tobytes(), dtype=np.uint8)
+
+
+def bc3_colors_four_color(blocks):
+    """RGB texels of (N, 16) BC3 blocks with the color half always decoded as 4-color."""
+    c0 = blocks[:, 8].astype(np.int32) | (blocks[:, 9].astype(np.int32) << 8)
+    c1 = blocks[:, 10].astype(np.int32) | (blocks[:, 11].astype(np.int32) << 8)
+
+    def expand(c):
+        r, g, b = (c >> 11) & 31, (c >> 5) & 63, c & 31
+        return np.stack([(r << 3) | (r >> 2), (g << 2) | (g >> 4), (b << 3) | (b >> 2)], axis=-1)
+
+    e0, e1 = expand(c0), expand(c1)
+    palette = np.stack([e0, e1, (2 * e0 + e1) // 3, (e0 + 2 * e1) // 3], axis=1)
+    packed = blocks[:, 12:16].copy().view('<u4')[:, 0]
+    indices = (packed[:, None] >> (2 * np.arange(16, dtype=np.uint32))) & 3
+    return np.take_along_axis(palette, indices[..., None].astype(np.intp), axis=1)
+
+
+@unittest.skipIf(texture2ddecoder is None, 'texture2ddecoder not installed')
+class EncodeBC3Test(unittest.TestCase):
+
+    def test_round_trip_within_bound(self):
+        image = ramp_image()
+        texels = to_texels(image)
+        decoded = decode_blocks('bc3', encode_bc3(texels)).astype(np.int32)
+        error = np.abs(decoded - texels.astype(np.int32))
+        self.assertLessEqual(error[..., :3].max(), MAX_COLOR_ERROR)
+        self.assertLessEqual(error[..., :3].mean(), MEAN_COLOR_ERROR)
+        self.assertLessEqual(error[..., 3].max(), MAX_ALPHA_ERROR)
+
+    def test_block_and_image_decodes_agree(self):
+        image = ramp_image()
+        blocks = rgba_to_bc3(image)
+        texels = decode_blocks('bc3', blocks.reshape(-1, 16))
+        np.testing.assert_array_equal(to_texels(bc3_to_rgba(blocks)), texels)
+
+    def test_flat_alpha_is_exact(self):
+        texels = np.tile(np.array([[[10, 200, 30, 255]], [[10, 200, 30, 0]], [[0, 0, 0, 77]]],
+                                  dtype=np.uint8), (1, 16, 1))
+        decoded = decode_blocks('bc3', encode_bc3(texels))
+        np.testing.assert_array_equal(decoded[..., 3], texels[..., 3])
+
+
+@unittest.skipIf(texture2ddecoder is None, 'texture2ddecoder not installed')
+class ToBC3Test(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(5)
+        blocks = []
+        self.expected_exact = []
+        for mode in ('four', 'three_01', 'three_mid', 'three_punch') * 8:
+            low, high = sorted(rng.choice(0x10000, 2, replace=False).tolist())
+            if mode == 'four':
+                c0, c1, choices = high, low, [0, 1, 2, 3]
+            elif mode == 'three_01':
+                c0, c1, choices = low, high, [0, 1]
+            elif mode == 'three_mid':
+                c0, c1, choices = low, high, [0, 1, 2]
+            else:
+                c0, c1, choices = low, high, [0, 1, 3]
+            indices = rng.choice(choices, 16)
+            # Make sure the block uses the entry under test
+            indices[0] = choices[-1]
+            blocks.append(bc1_block(c0, c1, indices))
+            self.expected_exact.append(mode in ('four', 'three_01'))
+        self.level = DXTLevel('bc1', np.array(blocks).reshape(4, 8, 8))
+        self.expected_exact = np.array(self.expected_exact).reshape(4, 8)
+
+    def test_exact_only_where_texels_match(self):
+        opaque = block_alpha_range(self.level)[0] == 255
+        self.assertTrue(opaque.all())
+        out, exact = to_bc3(self.level, opaque)
+        np.testing.assert_array_equal(exact, self.expected_exact)
+
+        source = decode_blocks('bc1', self.level.blocks.reshape(-1, 8)).astype(np.int32)
+        converted = decode_blocks('bc3', out.reshape(-1, 16))
+        flat_exact = exact.reshape(-1)
+        np.testing.assert_array_equal(converted[flat_exact], source[flat_exact])
+        self.assertTrue((converted[..., 3] == 255).all())
+
+        # As a GPU samples them (rounding of the thirds may differ by one)
+        gpu = bc3_colors_four_color(out.reshape(-1, 16))
+        difference = np.abs(gpu - source[..., :3]).max(axis=(1, 2))
+        self.assertTrue((difference[flat_exact] <= 1).all())
+        # The blocks left to re-encode really change once read as 4-color
+        self.assertTrue((difference[~flat_exact] > 1).all())
+
+    def test_transparent_blocks_are_not_exact(self):
+        opaque = np.ones(self.level.blocks.shape[:2], dtype=bool)
+        opaque[0, :4] = False
+        _, exact = to_bc3(self.level, opaque)
+        self.assertFalse(exact[0, :4].any())
+        np.testing.assert_array_equal(exact[1:], self.expected_exact[1:])
+
+
+if __name__ == '__main__':
+    unittest.main()
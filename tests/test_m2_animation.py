@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Skeleton export tests.
+
+Checks decimate_keys() (endpoints kept, dropped keys reproduced within the
+tolerance, constant tracks reduced to one key) and that add_skeleton() writes
+joints whose bind pose world transforms cancel their inverse bind matrices,
+for a synthetic two-bone skeleton read back from the finished GLB.
+
+Usage: python3 -m pytest tests/test_m2_animation.py
+"""
+
+import json
+import os
+import struct
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tools'))
+
+from glb_writer import GLBWriter
+from m2_animation import Animation, Bone, Channel, Skeleton, add_skeleton, decimate_keys
+
+
+def read_glb(glb):
+    """(glTF JSON, BIN chunk) of GLB bytes."""
+    json_length = struct.unpack_from('<I', glb, 12)[0]
+    gltf = json.loads(bytes(glb[20:20 + json_length]))
+    bin_start = 20 + json_length
+    bin_length = struct.unpack_from('<I', glb, bin_start)[0]
+    return gltf, bytes(glb[bin_start + 8:bin_start + 8 + bin_length])
+
+
+def accessor_data(gltf, binary, index):
+    """Float accessor contents as an (count, components) array."""
+    accessor = gltf['accessors'][index]
+    view = gltf['bufferViews'][accessor['bufferView']]
+    components = {'SCALAR': 1, 'VEC3': 3, 'VEC4': 4, 'MAT4': 16}[accessor['type']]
+    offset = view.get('byteOffset', 0) + accessor.get('byteOffset', 0)
+    return np.frombuffer(binary, dtype='<f4', count=accessor['count'] * components,
+                         offset=offset).reshape(accessor['count'], components)
+
+
+def node_matrix(node):
+    """Local TRS matrix of a glTF node."""
+    x, y, z, w = node.get('rotation', [0, 0, 0, 1])
+    rotation = np.array([
+        [1 - 2 * (y * y + z * z), 2 * (x * y - z * w), 2 * (x * z + y * w)],
+        [2 * (x * y + z * w), 1 - 2 * (x * x + z * z), 2 * (y * z - x * w)],
+        [2 * (x * z - y * w), 2 * (y * z + x * w), 1 - 2 * (x * x + y * y)],
+    ])
+    matrix = np.eye(4)
+    matrix[:3, :3] = rotation * np.array(node.get('scale', [1, 1, 1]))
+    matrix[:3, 3] = node.get('translation', [0, 0, 0])
+    return matrix
+
+
+class DecimateKeysTest(unittest.TestCase):
+
+    def test_endpoints_kept_and_within_tolerance(self):
+        times = np.linspace(0.0, 2.0, 61, dtype=np.float32)
+        values = np.stack([np.sin(times * 3), np.minimum(times, 1.0), times * 0.5], axis=1)
+        tolerance = 1e-3
+        kept_times, kept_values = decimate_keys(times, values, tolerance)
+
+        self.assertLess(len(kept_times), len(times))
+        self.assertEqual(kept_times[0], times[0])
+        self.assertEqual(kept_times[-1], times[-1])
+        np.testing.assert_array_equal(kept_values[0], values[0])
+        np.testing.assert_array_equal(kept_values[-1], values[-1])
+        for component in range(values.shape[1]):
+            interpolated = np.interp(times, kept_times, kept_values[:, component])
+            self.assertLessEqual(np.abs(interpolated - values[:, component]).max(), tolerance + 1e-6)
+
+    def test_linear_and_constant_tracks(self):
+        times = np.arange(10, dtype=np.float32)
+        linear = np.stack([times * 2, -times, times * 0], axis=1)
+        kept_times, _ = decimate_keys(times, linear, 1e-3)
+        np.testing.assert_array_equal(kept_times, [0, 9])
+
+        constant = np.tile([[0.0, 0.0, 0.0, 1.0]], (10, 1))
+        kept_times, kept_values = decimate_keys(times, constant, 1e-3)
+        np.testing.assert_array_equal(kept_times, [0])
+        np.testing.assert_array_equal(kept_values, constant[:1])
+
+
+class AddSkeletonTest(unittest.TestCase):
+
+    def setUp(self):
+        # Root at (1, 2, 3), child one unit further along Z
+        bones = [Bone(-1, (1.0, 2.0, 3.0)), Bone(0, (1.0, 2.0, 4.0))]
+        times = np.array([0.0, 1.0], dtype=np.float32)
+        rest = Animation('Stand', 1000, [
+            Channel(1, 'translation', 'LINEAR', times, np.zeros((2, 3), dtype=np.float32)),
+            Channel(1, 'rotation', 'LINEAR', times,
+                    np.tile(np.array([[0, 0, 0, 1]], dtype=np.float32), (2, 1))),
+        ])
+        writer = GLBWriter()
+        gltf = {'nodes': [], 'scenes': [{'nodes': []}],
+                'bufferViews': writer.buffer_views, 'accessors': writer.accessors}
+        add_skeleton(writer, gltf, Skeleton(bones, [rest]))
+        self.gltf, self.binary = read_glb(writer.finish(gltf))
+
+    def world_matrices(self, nodes):
+        parents = {child: i for i, node in enumerate(nodes) for child in node.get('children', [])}
+        matrices = []
+        for i in range(len(nodes)):
+            matrix = node_matrix(nodes[i])
+            parent = parents.get(i)
+            while parent is not None:
+                matrix = node_matrix(nodes[parent]) @ matrix
+                parent = parents.get(parent)
+            matrices.append(matrix)
+        return matrices
+
+    def test_bind_pose_cancels_inverse_bind_matrices(self):
+        skin = self.gltf['skins'][0]
+        self.assertEqual(skin['joints'], [0, 1])
+        self.assertEqual(self.gltf['scenes'][0]['nodes'], [0])
+        inverse_bind = accessor_data(self.gltf, self.binary, skin['inverseBindMatrices'])
+        for joint, world in zip(skin['joints'], self.world_matrices(self.gltf['nodes'])):
+            ibm = inverse_bind[joint].reshape(4, 4).T  # column-major
+            np.testing.assert_allclose(world @ ibm, np.eye(4), atol=1e-6)
+
+    def test_rest_keys_reproduce_the_bind_pose(self):
+        # Animated values replace the node TRS, so zero keys must land on the joint offsets
+        nodes = [dict(node) for node in self.gltf['nodes']]
+        animation = self.gltf['animations'][0]
+        for channel in animation['channels']:
+            sampler = animation['samplers'][channel['sampler']]
+            values = accessor_data(self.gltf, self.binary, sampler['output'])
+            node = self.gltf['nodes'][channel['target']['node']]
+            default = {'translation': [0, 0, 0], 'rotation': [0, 0, 0, 1]}[channel['target']['path']]
+            for value in values:
+                np.testing.assert_allclose(value, node.get(channel['target']['path'], default),
+                                           atol=1e-6)
+            nodes[channel['target']['node']][channel['target']['path']] = values[0].tolist()
+
+        inverse_bind = accessor_data(self.gltf, self.binary,
+                                     self.gltf['skins'][0]['inverseBindMatrices'])
+        for joint, world in enumerate(self.world_matrices(nodes)):
+            np.testing.assert_allclose(world @ inverse_bind[joint].reshape(4, 4).T, np.eye(4),
+                                       atol=1e-6)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Mesh optimization tests.
+
+Checks that optimize_vertex_cache() and optimize_vertex_fetch() only reorder
+(every triangle survives with its winding, and remapping through the fetch
+order gives back the same mesh), and that the cache reorder does not raise
+the average cache miss ratio (ACMR) of a regular grid.
+
+Usage: python3 -m pytest tests/test_mesh_optimize.py
+"""
+
+import os
+import random
+import sys
+import unittest
+from collections import Counter
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tools'))
+
+from mesh_optimize import VERTEX_CACHE_SIZE, optimize_vertex_cache, optimize_vertex_fetch
+
+
+def grid_indices(columns, rows):
+    """Row-by-row triangle list of a columns x rows quad grid."""
+    indices = []
+    for y in range(rows):
+        for x in range(columns):
+            v = y * (columns + 1) + x
+            below = v + columns + 1
+            indices += [v, below, v + 1, v + 1, below, below + 1]
+    return np.array(indices, dtype=np.uint16), (columns + 1) * (rows + 1)
+
+
+def triangle_set(indices):
+    """Triangles as a multiset, each rotated to start at its smallest index (keeps winding)."""
+    triangles = Counter()
+    for a, b, c in np.asarray(indices).reshape(-1, 3).tolist():
+        while a != min(a, b, c):
+            a, b, c = b, c, a
+        triangles[(a, b, c)] += 1
+    return triangles
+
+
+def acmr(indices, cache_size=VERTEX_CACHE_SIZE):
+    """Vertex shader invocations per triangle with a FIFO post-transform cache."""
+    cache = []
+    misses = 0
+    for v in np.asarray(indices).tolist():
+        if v not in cache:
+            misses += 1
+            cache.append(v)
+            if len(cache) > cache_size:
+                cache.pop(0)
+    return misses / (len(indices) // 3)
+
+
+class MeshOptimizeTest(unittest.TestCase):
+
+    def test_cache_and_fetch_keep_the_triangles(self):
+        indices, n_vertices = grid_indices(12, 9)
+        # Shuffled triangles and an unused vertex at the end
+        triangles = indices.reshape(-1, 3).tolist()
+        random.Random(1).shuffle(triangles)
+        indices = np.array(triangles, dtype=np.uint16).reshape(-1)
+        n_vertices += 1
+
+        reordered = optimize_vertex_cache(indices, n_vertices)
+        self.assertEqual(reordered.dtype, indices.dtype)
+        self.assertEqual(triangle_set(reordered), triangle_set(indices))
+
+        remapped, order = optimize_vertex_fetch(reordered, n_vertices)
+        self.assertEqual(remapped.dtype, indices.dtype)
+        self.assertEqual(sorted(order.tolist()), list(range(n_vertices)))
+        self.assertEqual(order[-1], n_vertices - 1)
+        np.testing.assert_array_equal(order[remapped], reordered)
+        self.assertEqual(triangle_set(order[remapped]), triangle_set(indices))
+        # Vertices are numbered in order of first use
+        first_use = list(dict.fromkeys(remapped.tolist()))
+        self.assertEqual(first_use, list(range(len(first_use))))
+
+    def test_acmr_does_not_get_worse_on_a_grid(self):
+        indices, n_vertices = grid_indices(32, 32)
+        before = acmr(indices)
+        after = acmr(optimize_vertex_cache(indices, n_vertices))
+        self.assertLessEqual(after, before)
+
+        triangles = indices.reshape(-1, 3).tolist()
+        random.Random(2).shuffle(triangles)
+        shuffled = np.array(triangles, dtype=np.uint16).reshape(-1)
+        self.assertLess(acmr(optimize_vertex_cache(shuffled, n_vertices)), acmr(shuffled))
+
+    def test_short_and_partial_index_lists_are_unchanged(self):
+        for indices in ([0, 1, 2], [0, 1, 2, 2, 1]):
+            with self.subTest(indices=indices):
+                np.testing.assert_array_equal(optimize_vertex_cache(indices, 3), indices)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+MPQ index reader tests.
+
+Builds small MPQ v1 archives covering the block layouts the reader handles:
+multi-sector and single-unit files, compressed and incompressible sectors,
+encrypted files (with and without MPQ_FILE_FIX_KEY), and a patch archive
+overriding a base archive through MPQFileSystem.
+
+Usage: python3 -m pytest tests/test_mpq_index.py
+"""
+
+import os
+import random
+import struct
+import sys
+import tempfile
+import unittest
+import zlib
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tools'))
+
+import mpq_index
+import mpq_vfs
+from mpq_index import (MPQ_FILE_COMPRESS, MPQ_FILE_ENCRYPTED, MPQ_FILE_EXISTS, MPQ_FILE_FIX_KEY,
+                       MPQ_FILE_SINGLE_UNIT, MPQIndex, _CRYPT_TABLE, _hash_string)
+
+SECTOR_SHIFT = 0            # 512-byte sectors, so small files span several
+SECTOR_SIZE = 512 << SECTOR_SHIFT
+HEADER_SIZE = 32
+HASH_SLOTS = 64
+
+
+def _encrypt(data, key):
+    """Inverse of mpq_index._decrypt; trailing bytes are left as they are."""
+    words = len(data) // 4
+    seed1, seed2 = key, 0xEEEEEEEE
+    out = bytearray()
+    for value in struct.unpack_from(f'<{words}I', data):
+        seed2 = (seed2 + _CRYPT_TABLE[0x400 + (seed1 & 0xFF)]) & 0xFFFFFFFF
+        out += struct.pack('<I', (value ^ (seed1 + seed2)) & 0xFFFFFFFF)
+        seed1 = (((~seed1 << 0x15) + 0x11111111) | (seed1 >> 0x0B)) & 0xFFFFFFFF
+        seed2 = (value + seed2 + (seed2 << 5) + 3) & 0xFFFFFFFF
+    return bytes(out) + bytes(data[words * 4:])
+
+
+def _compress(data):
+    """MPQ zlib sector, or the raw data when compression does not shrink it."""
+    packed = b'\x02' + zlib.compress(data)
+    return packed if len(packed) < len(data) else data
+
+
+def write_mpq(path, files):
+    """Write an MPQ v1 archive; files maps name -> (data, flags).
+
+    flags may combine MPQ_FILE_SINGLE_UNIT, MPQ_FILE_ENCRYPTED and
+    MPQ_FILE_FIX_KEY; every file is stored with MPQ_FILE_COMPRESS. A
+    (listfile) is added.
+    """
+    files = dict(files)
+    files['(listfile)'] = ('\r\n'.join(files).encode(), 0)
+    body = bytearray()
+    blocks = []
+    for name, (data, flags) in files.items():
+        flags |= MPQ_FILE_EXISTS | MPQ_FILE_COMPRESS
+        offset = HEADER_SIZE + len(body)
+        key = None
+        if flags & MPQ_FILE_ENCRYPTED:
+            key = _hash_string(name.rsplit('\\', 1)[-1].upper().encode(), 3)
+            if flags & MPQ_FILE_FIX_KEY:
+                key = ((key + offset) ^ len(data)) & 0xFFFFFFFF
+
+        if flags & MPQ_FILE_SINGLE_UNIT:
+            blob = _compress(data)
+            if key is not None:
+                blob = _encrypt(blob, key)
+        else:
+            sectors = [_compress(data[i:i + SECTOR_SIZE]) for i in range(0, len(data), SECTOR_SIZE)]
+            if key is not None:
+                sectors = [_encrypt(sector, (key + i) & 0xFFFFFFFF) for i, sector in enumerate(sectors)]
+            positions = [4 * (len(sectors) + 1)]
+            for sector in sectors:
+                positions.append(positions[-1] + len(sector))
+            table = struct.pack(f'<{len(positions)}I', *positions)
+            if key is not None:
+                table = _encrypt(table, (key - 1) & 0xFFFFFFFF)
+            blob = table + b''.join(sectors)
+        body += blob
+        blocks.append((offset, len(blob), len(data), flags))
+
+    hash_table = [(0xFFFFFFFF, 0xFFFFFFFF, 0xFFFFFFFF, 0xFFFFFFFF)] * HASH_SLOTS
+    for block_idx, name in enumerate(files):
+        upper = name.upper().encode()
+        slot = _hash_string(upper, 0) & (HASH_SLOTS - 1)
+        while hash_table[slot][3] != 0xFFFFFFFF:
+            slot = (slot + 1) & (HASH_SLOTS - 1)
+        hash_table[slot] = (_hash_string(upper, 1), _hash_string(upper, 2), 0, block_idx)
+
+    hash_bytes = _encrypt(b''.join(struct.pack('<4I', *e) for e in hash_table),
+                          _hash_string(b'(HASH TABLE)', 3))
+    block_bytes = _encrypt(b''.join(struct.pack('<4I', *b) for b in blocks),
+                           _hash_string(b'(BLOCK TABLE)', 3))
+    hash_offset = HEADER_SIZE + len(body)
+    block_offset = hash_offset + len(hash_bytes)
+    header = struct.pack(mpq_index.MPQ_HEADER_FORMAT, b'MPQ\x1a', HEADER_SIZE,
+                         block_offset + len(block_bytes), 0, SECTOR_SHIFT,
+                         hash_offset, block_offset, HASH_SLOTS, len(blocks))
+    with open(path, 'wb') as f:
+        f.write(header + body + hash_bytes + block_bytes)
+
+
+def _sample_data(seed, size):
+    """Compressible text followed by random (incompressible) bytes."""
+    rng = random.Random(seed)
+    text = b'Character\\Human\\Male\\HumanMaleSkin00_00.blp\n' * (size // 90 + 1)
+    noise = bytes(rng.randrange(256) for _ in range(size // 2))
+    return text[:size - len(noise)] + noise
+
+
+class MPQIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = self.tmp.name
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _index(self, files):
+        path = os.path.join(self.dir, 'test.MPQ')
+        write_mpq(path, files)
+        index = MPQIndex.load_or_build([path], os.path.join(self.dir, 'test.idx'))
+        self.addCleanup(index.close)
+        return index
+
+    def test_block_layouts(self):
+        cases = {
+            'Dir\\Plain.blp': (_sample_data(1, 2000), 0),
+            'Dir\\Single.blp': (_sample_data(2, 1500), MPQ_FILE_SINGLE_UNIT),
+            'Dir\\Encrypted.blp': (_sample_data(3, 2003), MPQ_FILE_ENCRYPTED),
+            'Dir\\FixKey.blp': (_sample_data(4, 1801), MPQ_FILE_ENCRYPTED | MPQ_FILE_FIX_KEY),
+            'Dir\\EncryptedSingle.blp': (_sample_data(5, 997), MPQ_FILE_ENCRYPTED | MPQ_FILE_SINGLE_UNIT),
+            'Dir\\FixKeySingle.blp': (_sample_data(6, 1203),
+                                      MPQ_FILE_ENCRYPTED | MPQ_FILE_FIX_KEY | MPQ_FILE_SINGLE_UNIT),
+            'Noise.bin': (bytes(random.Random(7).randrange(256) for _ in range(1100)), 0),
+            'Tiny.txt': (b'abc', MPQ_FILE_ENCRYPTED),
+        }
+        index = self._index(cases)
+        self.assertEqual(len(index), len(cases))
+        for name, (data, _) in cases.items():
+            with self.subTest(name=name):
+                self.assertEqual(index.read_file(name), data)
+                self.assertEqual(index.read_file(name.lower().replace('\\', '/')), data)
+        self.assertIsNone(index.read_file('Dir\\Missing.blp'))
+
+    def test_incompressible_sectors_are_stored_raw(self):
+        data = _sample_data(8, 3000)
+        sectors = [_compress(data[i:i + SECTOR_SIZE]) for i in range(0, len(data), SECTOR_SIZE)]
+        # The fixture must mix compressed and raw sectors to cover both branches
+        self.assertTrue(any(len(s) < SECTOR_SIZE for s in sectors[:-1]))
+        self.assertTrue(any(len(s) == SECTOR_SIZE for s in sectors[:-1]))
+        index = self._index({'Mixed.bin': (data, 0), 'MixedEnc.bin': (data, MPQ_FILE_ENCRYPTED)})
+        self.assertEqual(index.read_file('Mixed.bin'), data)
+        self.assertEqual(index.read_file('MixedEnc.bin'), data)
+
+    def test_patch_archive_overrides_base(self):
+        write_mpq(os.path.join(self.dir, 'common.MPQ'), {
+            'Item\\Sword.blp': (b'base sword' * 20, 0),
+            'Item\\Shield.blp': (b'base shield' * 20, MPQ_FILE_ENCRYPTED),
+        })
+        write_mpq(os.path.join(self.dir, 'patch.MPQ'), {
+            'ITEM\\SWORD.BLP': (b'patched sword' * 20, MPQ_FILE_ENCRYPTED | MPQ_FILE_FIX_KEY),
+            'Item\\New.blp': (b'new' * 20, MPQ_FILE_SINGLE_UNIT),
+        })
+        with mock.patch.object(mpq_index, 'INDEX_DIR', self.dir), \
+                mock.patch.object(mpq_vfs, 'ARCHIVES', ['common.MPQ', 'patch.MPQ']):
+            vfs = mpq_vfs.MPQFileSystem(self.dir)
+            self.addCleanup(vfs.index.close)
+            self.assertEqual(vfs.read_file('item\\sword.blp'), b'patched sword' * 20)
+            self.assertEqual(vfs.archive_of('Item\\Sword.blp'), 'patch.MPQ')
+            self.assertEqual(vfs.read_file('Item\\Shield.blp'), b'base shield' * 20)
+            self.assertEqual(vfs.archive_of('Item\\Shield.blp'), 'common.MPQ')
+            self.assertEqual(vfs.read_file('Item/New.blp'), b'new' * 20)
+            self.assertEqual(len(vfs), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
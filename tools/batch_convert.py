@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+Parallel batch conversion of M2 models to GLB.
+
+Shared by convert_items.py and convert_spells_objects.py. A mapping of
+output name -> M2 path is converted in sorted order, optionally across a pool
+of worker processes. Workers are forked from the parent after the MPQ index
+is loaded, so they share its mmap instead of each re-opening the archives.
+Per-model log output is captured in the worker and printed by the parent in
+mapping order, so the log reads the same for any --jobs value.
+
+Runs are incremental: outputs whose M2/skin/texture inputs and converter
+version match the output directory's build manifest are skipped.
+
+Each process keeps its own decoded-texture cache and shares the on-disk
+encoded texture cache; the per-worker counters are summed and printed at the
+end of the run.
+"""
+
+import contextlib
+import io
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+
+from build_manifest import BuildManifest
+from image_encoding import DEFAULT_ENCODER, encoder_argument
+from m2_animation import DEFAULT_ANIMATIONS
+from m2_to_glb import CONVERTER_VERSION, MPQManager, convert_model
+from png_cache import format_encoded_stats
+from texture_cache import format_stats
+
+# State used by convert tasks in this process (inherited across fork)
+_mpq_mgr = None
+_manifest = None
+
+
+def _init_worker(data_path, output_dir):
+    """Pool initializer: only needed when workers are spawned, not forked."""
+    global _mpq_mgr, _manifest
+    if _mpq_mgr is None:
+        _mpq_mgr = MPQManager(data_path)
+        _manifest = BuildManifest(output_dir)
+
+
+def _convert_task(task):
+    """Convert one mapping entry.
+
+    Returns (name, status, captured log, inputs, outputs, cache stats) where
+    status is 'ok', 'failed' or 'skipped', inputs maps each MPQ file read to
+    its hash, outputs lists the other files written (LODs) and cache stats is
+    (pid, this process's texture cache counters by cache).
+    """
+    name, m2_path, output_path, model_type, capture, force, options = task
+    log = io.StringIO()
+    redirect = contextlib.redirect_stdout(log) if capture else contextlib.nullcontext()
+    inputs = {}
+    outputs = []
+    with redirect:
+        try:
+            if not force and _manifest.is_up_to_date(_mpq_mgr, output_path, m2_path, model_type,
+                                                     CONVERTER_VERSION, options):
+                return name, 'skipped', '', None, None, _cache_stats()
+            ok = convert_model(_mpq_mgr, m2_path, output_path, model_type=model_type,
+                               inputs=inputs, outputs=outputs, **options)
+        except Exception as e:
+            print(f"    ERROR: {name}: {e}")
+            traceback.print_exc(file=sys.stdout)
+            ok = False
+    return name, 'ok' if ok else 'failed', log.getvalue(), inputs, outputs, _cache_stats()
+
+
+def _cache_stats():
+    return os.getpid(), {'decoded': _mpq_mgr.texture_cache.stats(),
+                         'encoded': _mpq_mgr.png_cache.stats()}
+
+
+def add_conversion_arguments(parser):
+    """Add the convert_model output options shared by the batch CLIs."""
+    parser.add_argument('--lods', action='store_true',
+                        help='Also export reduced LOD meshes (<name>.lod<N>.glb + <name>.lod.json)')
+    parser.add_argument('--atlas', action='store_true',
+                        help='Pack the textures of all submeshes into one atlas image per model')
+    parser.add_argument('--ktx2', action='store_true',
+                        help='Also write DXT textures and atlases as BCn KTX2 files '
+                             '(<name>.tex<N>.ktx2, not referenced from the GLB)')
+    parser.add_argument('--quantize', action='store_true',
+                        help='Quantize vertex attributes (KHR_mesh_quantization) and reorder '
+                             'indices for vertex cache locality')
+    parser.add_argument('--animations', nargs='?', const=','.join(DEFAULT_ANIMATIONS),
+                        metavar='NAMES',
+                        help='Export the skeleton with these comma-separated animations '
+                             f"(default when given without names: {','.join(DEFAULT_ANIMATIONS)})")
+    parser.add_argument('--image-encoder', type=encoder_argument, default=DEFAULT_ENCODER,
+                        metavar='SPEC',
+                        help='Texture encoder: png-optimize (default), png-level0..9 / png-fast, '
+                             'webp-lossless, webp-q1..100 / webp')
+
+
+def conversion_options(args):
+    """convert_model keyword arguments from parsed add_conversion_arguments() flags."""
+    animations = [name for name in (args.animations or '').split(',') if name]
+    # The default encoder is left out so it is not recorded in build manifests
+    image_encoder = args.image_encoder if args.image_encoder != DEFAULT_ENCODER else None
+    return {'lods': args.lods, 'atlas': args.atlas, 'ktx2': args.ktx2,
+            'quantize': args.quantize, 'animations': animations, 'image_encoder': image_encoder}
+
+
+def run_batch(mpq_mgr, mapping, output_dir, model_type, jobs=1, progress_every=200, force=False,
+              options=None):
+    """Convert every (name -> M2 path) entry of mapping into output_dir/<name>.glb.
+
+    options are extra convert_model keyword arguments (e.g. {'lods': True});
+    they are recorded in the build manifest so changing them reconverts.
+
+    Returns (success, failed, skipped); skipped outputs were already up to date.
+    """
+    global _mpq_mgr, _manifest
+    os.makedirs(output_dir, exist_ok=True)
+    _mpq_mgr = mpq_mgr
+    _manifest = BuildManifest(output_dir)
+
+    options = dict(options or {})
+    jobs = max(1, jobs or 1)
+    capture = jobs > 1
+
+    tasks = []
+    outputs = {}
+    for name, m2_path in sorted(mapping.items()):
+        output_path = os.path.join(output_dir, f"{name}.glb")
+        # Convert with backslashes
+        m2_path = m2_path.replace('/', '\\')
+        tasks.append((name, m2_path, output_path, model_type, capture, force, options))
+        outputs[name] = (output_path, m2_path)
+
+    success = 0
+    failed = 0
+    skipped = 0
+    worker_cache_stats = {}
+    total = len(tasks)
+    start_time = time.time()
+
+    if jobs == 1:
+        results = map(_convert_task, tasks)
+        pool = None
+    else:
+        methods = multiprocessing.get_all_start_methods()
+        ctx = multiprocessing.get_context('fork' if 'fork' in methods else None)
+        pool = ctx.Pool(jobs, initializer=_init_worker, initargs=(mpq_mgr.data_path, output_dir))
+        # imap keeps results in mapping order regardless of which worker finishes first
+        results = pool.imap(_convert_task, tasks, chunksize=4)
+
+    try:
+        for name, status, log, inputs, written, (pid, cache_stats) in results:
+            worker_cache_stats[pid] = cache_stats
+            if log:
+                sys.stdout.write(log)
+            output_path, m2_path = outputs[name]
+            if status == 'skipped':
+                _manifest.mark_verified(output_path, mpq_mgr.vfs.state)
+                skipped += 1
+                continue
+            if status == 'ok':
+                _manifest.record(output_path, m2_path, model_type, CONVERTER_VERSION, inputs, options,
+                                 written, mpq_mgr.vfs.state)
+                success += 1
+            else:
+                _manifest.forget(output_path)
+                failed += 1
+
+            done = success + failed
+            if progress_every and done % progress_every == 0:
+                elapsed = time.time() - start_time
+                rate = done / elapsed if elapsed > 0 else 0
+                eta = (total - skipped - done) / rate if rate > 0 else 0
+                print(f"\n--- Progress: {done}/{total - skipped} ({success} ok, {failed} fail, "
+                      f"{skipped} up to date) [{rate:.1f}/s, ETA: {eta/60:.1f}min] ---\n")
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        # Saved even on interruption so finished conversions are not redone
+        _manifest.save()
+
+    if worker_cache_stats:
+        totals = {'decoded': {}, 'encoded': {}}
+        for cache_stats in worker_cache_stats.values():
+            for cache, counters in cache_stats.items():
+                for key, value in counters.items():
+                    totals[cache][key] = totals[cache].get(key, 0) + value
+        print(format_stats(totals['decoded']))
+        print(format_encoded_stats(totals['encoded']))
+
+    return success, failed, skipped
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+BLP2 texture decoding shared by the AoWoW model and texture tools.
+
+BLP2 header (148 bytes, followed by a 256-entry BGRA palette):
+  Offset | Size | Field
+  =======|======|==========================================
+  0      | 4    | magic 'BLP2'
+  4      | 4    | type (1 = BLP color)
+  8      | 1    | encoding (1 = palette, 2 = DXT, 3 = ARGB)
+  9      | 1    | alpha depth (0, 1, 4 or 8 bits)
+  10     | 1    | alpha encoding (0 = DXT1, 1 = DXT3, 7 = DXT5)
+  11     | 1    | has mips
+  12     | 8    | width, height
+  20     | 64   | mip offsets[16]
+  84     | 64   | mip sizes[16]
+
+Palette textures are decoded with a single NumPy fancy-index into the palette,
+and 1/4/8-bit alpha planes are unpacked with vectorized bit operations.
+"""
+
+import struct
+import sys
+from collections import namedtuple
+
+import numpy as np
+from PIL import Image
+
+try:
+    import texture2ddecoder
+except ImportError:
+    texture2ddecoder = None
+
+BLP_HEADER_SIZE = 148
+
+BLPHeader = namedtuple('BLPHeader', [
+    'encoding', 'alpha_depth', 'alpha_encoding', 'has_mips',
+    'width', 'height', 'mip_offsets', 'mip_sizes',
+])
+
+
+def read_blp_header(data):
+    """Parse a BLP2 header, or return None if data is not a usable BLP2."""
+    if not data or len(data) < BLP_HEADER_SIZE:
+        return None
+
+    magic = data[:4]
+    if magic != b'BLP2':
+        print(f"    Warning: Not a BLP2 file (magic={magic})", file=sys.stderr)
+        return None
+
+    encoding, alpha_depth, alpha_encoding, has_mips = data[8], data[9], data[10], data[11]
+    width, height = struct.unpack_from('<II', data, 12)
+
+    if width == 0 or height == 0 or width > 4096 or height > 4096:
+        print(f"    Warning: Invalid BLP dimensions {width}x{height}", file=sys.stderr)
+        return None
+
+    mip_offsets = struct.unpack_from('<16I', data, 20)
+    mip_sizes = struct.unpack_from('<16I', data, 84)
+    return BLPHeader(encoding, alpha_depth, alpha_encoding, has_mips,
+                     width, height, mip_offsets, mip_sizes)
+
+
+def _unpack_alpha(alpha_bytes, alpha_depth, pixel_count):
+    """Expand a 1/4/8-bit alpha plane to one byte per pixel (missing -> 255)."""
+    raw = np.frombuffer(alpha_bytes, dtype=np.uint8)
+    if alpha_depth == 8:
+        alpha = raw
+    elif alpha_depth == 4:
+        # Low nibble first; 0..15 -> 0..255
+        alpha = np.empty(raw.size * 2, dtype=np.uint8)
+        alpha[0::2] = raw & 0x0F
+        alpha[1::2] = raw >> 4
+        alpha *= 17
+    elif alpha_depth == 1:
+        alpha = np.unpackbits(raw, bitorder='little') * np.uint8(255)
+    else:
+        return None
+
+    out = np.full(pixel_count, 255, dtype=np.uint8)
+    n = min(pixel_count, alpha.size)
+    out[:n] = alpha[:n]
+    return out
+
+
+def decode_palette(data, header, mip_data):
+    """Decode palette (encoding 1) mip data to a width*height*4 RGBA array."""
+    width, height = header.width, header.height
+    pixel_count = width * height
+
+    # Palette entries are BGRA; reorder once to RGBA
+    palette = np.frombuffer(data, dtype=np.uint8, count=256 * 4,
+                            offset=BLP_HEADER_SIZE).reshape(256, 4)[:, [2, 1, 0, 3]]
+
+    indices = np.frombuffer(mip_data, dtype=np.uint8, count=min(pixel_count, len(mip_data)))
+    rgba = np.zeros((pixel_count, 4), dtype=np.uint8)
+    rgba[:indices.size] = palette[indices]
+
+    alpha = _unpack_alpha(mip_data[pixel_count:], header.alpha_depth, pixel_count)
+    rgba[:, 3] = 255 if alpha is None else alpha
+    return rgba.reshape(height, width, 4)
+
+
+def _decode_bc2(mip_data, width, height):
+    """Decode DXT3 to BGRA bytes (texture2ddecoder has no BC2 decoder).
+
+    Each 16-byte block is 8 bytes of explicit 4-bit alpha followed by a BC1
+    color block; the color halves are decoded as BC1 in one call and the
+    alpha nibbles are scattered into the alpha channel.
+    """
+    bw, bh = (width + 3) // 4, (height + 3) // 4
+    blocks = np.frombuffer(mip_data, dtype=np.uint8, count=bw * bh * 16).reshape(bh, bw, 16)
+
+    color = texture2ddecoder.decode_bc1(blocks[:, :, 8:].tobytes(), width, height)
+    bgra = np.frombuffer(color, dtype=np.uint8).reshape(height, width, 4).copy()
+
+    alpha_bytes = blocks[:, :, :8]
+    alpha = np.empty((bh, bw, 16), dtype=np.uint8)
+    alpha[:, :, 0::2] = alpha_bytes & 0x0F
+    alpha[:, :, 1::2] = alpha_bytes >> 4
+    alpha = (alpha * 17).reshape(bh, bw, 4, 4).transpose(0, 2, 1, 3).reshape(bh * 4, bw * 4)
+    bgra[:, :, 3] = alpha[:height, :width]
+    return bgra.tobytes()
+
+
+def decode_dxt(header, mip_data):
+    """Decode DXT1/3/5 (encoding 2) mip data to a PIL RGBA image."""
+    if texture2ddecoder is None:
+        print("    Warning: texture2ddecoder not installed, cannot decode DXT", file=sys.stderr)
+        return None
+
+    width, height = header.width, header.height
+    if header.alpha_encoding == 1:
+        decoded = _decode_bc2(mip_data, width, height)
+    elif header.alpha_encoding == 7:
+        decoded = texture2ddecoder.decode_bc3(mip_data, width, height)
+    else:
+        # DXT1, also used as fallback for unknown alpha encodings
+        decoded = texture2ddecoder.decode_bc1(mip_data, width, height)
+
+    # texture2ddecoder outputs BGRA
+    return Image.frombytes('RGBA', (width, height), decoded, 'raw', 'BGRA')
+
+
+def decode_blp(blp_data):
+    """Decode a BLP2 texture file (mip level 0) to a PIL RGBA Image."""
+    header = read_blp_header(blp_data)
+    if header is None:
+        return None
+
+    mip_offset, mip_size = header.mip_offsets[0], header.mip_sizes[0]
+    if mip_offset == 0 or mip_size == 0:
+        return None
+
+    mip_data = blp_data[mip_offset:mip_offset + mip_size]
+
+    if header.encoding == 2:
+        # DXT compressed
+        try:
+            return decode_dxt(header, mip_data)
+        except Exception as e:
+            print(f"    Warning: DXT decode failed: {e}", file=sys.stderr)
+            return None
+
+    elif header.encoding == 1:
+        # Palette-based (uncompressed)
+        try:
+            return Image.fromarray(decode_palette(blp_data, header, mip_data))
+        except Exception as e:
+            print(f"    Warning: Palette decode failed: {e}", file=sys.stderr)
+            return None
+
+    elif header.encoding == 3:
+        # Uncompressed ARGB
+        try:
+            return Image.frombytes('RGBA', (header.width, header.height), mip_data)
+        except Exception as e:
+            print(f"    Warning: ARGB decode failed: {e}", file=sys.stderr)
+            return None
+
+    return None
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+Content-addressed build manifest for the GLB export pipeline.
+
+Each output directory keeps a .build-manifest.json recording, per output
+GLB, the converter version, the source model/type and the SHA-1 of every MPQ
+file the conversion read (M2, .skin and textures). A rerun only reconverts
+outputs whose inputs changed, e.g. after a new patch MPQ is dropped in.
+
+Lookups that found nothing are inputs too: a patch can add a texture at a
+higher-priority candidate path, or one for a model exported untextured.
+Paths probed and missed are recorded as null and must still be missing, and
+directory searches are recorded as "<dir>\\<prefix>*<extension>" with a hash
+of the names they listed (see InputRecorder).
+
+Verifying every input rehashes it, so each entry also stores the MPQ
+filesystem state it was last checked against (a hash of every archive's
+path, size and mtime, see MPQFileSystem.state). While no archive changed,
+is_up_to_date trusts the recorded inputs without reading them.
+
+Format:
+  {"version": 2,
+   "outputs": {"1234.glb": {"converter": 1, "source": "Item\\...\\Foo",
+                            "type": "item", "inputs": {"Item\\...\\Foo.M2": "<sha1>",
+                                                       "Item\\...\\Foo.blp": null,
+                                                       "Item\\...\\Foo*.blp": "<sha1>", ...},
+                            "options": {"lods": true}, "archives": "<sha1>",
+                            "outputs": ["1234.lod.json", "1234.lod1.glb"]}}}
+
+"options" holds non-default conversion options and "outputs" the other files
+the conversion wrote next to the GLB; both are omitted when empty. Entries
+without "archives" are verified input by input.
+"""
+
+import hashlib
+import json
+import os
+import sys
+
+MANIFEST_NAME = '.build-manifest.json'
+MANIFEST_VERSION = 2
+
+
+def content_hash(data):
+    """Hash of an input file's bytes as stored in the manifest."""
+    return hashlib.sha1(data).hexdigest()
+
+
+def listing_hash(names):
+    """Hash of a directory search result as stored in the manifest."""
+    return content_hash('\n'.join(names).encode('utf-8'))
+
+
+def _listing_key(directory, prefix, extension, recursive):
+    return f"{directory}\\{prefix}{'**' if recursive else '*'}{extension or ''}"
+
+
+def _parse_listing_key(key):
+    """(directory, prefix, extension, recursive) of a _listing_key, or None for file paths."""
+    if '*' not in key:
+        return None
+    directory, _, pattern = key.rpartition('\\')
+    recursive = '**' in pattern
+    prefix, _, extension = pattern.partition('**' if recursive else '*')
+    return directory, prefix, extension or None, recursive
+
+
+class InputRecorder:
+    """MPQManager wrapper that adds the lookups a conversion makes to its inputs.
+
+    Textures found are recorded by content hash, files and textures probed
+    but missing as None, and find_files() results by listing_hash. Files that
+    were read are still recorded by the converter itself.
+    """
+
+    def __init__(self, mpq_mgr, inputs):
+        self._mpq_mgr = mpq_mgr
+        self._inputs = inputs
+
+    def __getattr__(self, name):
+        return getattr(self._mpq_mgr, name)
+
+    def read_file(self, path):
+        data = self._mpq_mgr.read_file(path)
+        if not data:
+            self._inputs.setdefault(path, None)
+        return data
+
+    def load_texture(self, path):
+        texture = self._mpq_mgr.load_texture(path)
+        if texture:
+            self._inputs[path] = texture.digest
+        else:
+            self._inputs.setdefault(path, None)
+        return texture
+
+    def find_files(self, directory, prefix='', extension=None, recursive=False):
+        names = self._mpq_mgr.find_files(directory, prefix, extension, recursive)
+        key = _listing_key(directory.rstrip('\\'), prefix, extension, recursive)
+        self._inputs[key] = listing_hash(names)
+        return names
+
+
+def _active_options(options):
+    """Conversion options that differ from the defaults (falsy values dropped)."""
+    return {key: value for key, value in sorted((options or {}).items()) if value}
+
+
+class BuildManifest:
+    """Per-output input hashes for one output directory."""
+
+    def __init__(self, output_dir):
+        self.path = os.path.join(output_dir, MANIFEST_NAME)
+        self.outputs = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r') as f:
+                    data = json.load(f)
+                if data.get('version') == MANIFEST_VERSION:
+                    self.outputs = data.get('outputs', {})
+            except (OSError, ValueError) as e:
+                print(f"  Warning: Ignoring build manifest {self.path}: {e}", file=sys.stderr)
+
+    def is_up_to_date(self, mpq_mgr, output_path, source, model_type, converter_version,
+                      options=None):
+        """True if output_path exists and none of its recorded inputs or options changed.
+
+        Inputs recorded as missing must still be missing, recorded
+        directory searches must list the same files and the other recorded
+        outputs (LOD files) must still exist. Inputs are only read back when
+        the archives changed since the entry was recorded or last verified
+        (see mark_verified).
+        """
+        entry = self.outputs.get(os.path.basename(output_path))
+        if not entry or not os.path.exists(output_path):
+            return False
+        output_dir = os.path.dirname(output_path)
+        if not all(os.path.exists(os.path.join(output_dir, name))
+                   for name in entry.get('outputs', [])):
+            return False
+        if (entry.get('converter') != converter_version or entry.get('source') != source
+                or entry.get('type') != model_type or not entry.get('inputs')
+                or entry.get('options', {}) != _active_options(options)):
+            return False
+        if entry.get('archives') == mpq_mgr.vfs.state:
+            return True
+
+        for path, digest in entry['inputs'].items():
+            listing = _parse_listing_key(path)
+            if listing is not None:
+                if listing_hash(mpq_mgr.find_files(*listing)) != digest:
+                    return False
+                continue
+            data = mpq_mgr.read_file(path)
+            if digest is None:
+                if data:
+                    return False
+            elif not data or content_hash(data) != digest:
+                return False
+        return True
+
+    def record(self, output_path, source, model_type, converter_version, inputs, options=None,
+               outputs=None, archives=None):
+        """Remember the inputs a successful conversion of output_path used.
+
+        outputs are the names of other files it wrote next to output_path;
+        archives is the MPQFileSystem.state the inputs were read from.
+        """
+        entry = {
+            'converter': converter_version,
+            'source': source,
+            'type': model_type,
+            'inputs': dict(sorted(inputs.items())),
+        }
+        options = _active_options(options)
+        if options:
+            entry['options'] = options
+        if outputs:
+            entry['outputs'] = sorted(outputs)
+        if archives:
+            entry['archives'] = archives
+        self.outputs[os.path.basename(output_path)] = entry
+
+    def mark_verified(self, output_path, archives):
+        """Note that is_up_to_date verified output_path's inputs against these archives."""
+        entry = self.outputs.get(os.path.basename(output_path))
+        if entry:
+            entry['archives'] = archives
+
+    def forget(self, output_path):
+        self.outputs.pop(os.path.basename(output_path), None)
+
+    def save(self):
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'version': MANIFEST_VERSION, 'outputs': self.outputs}, f,
+                      separators=(',', ':'), sort_keys=True)
+        os.replace(tmp_path, self.path)
@@ -5,6 +5,21 @@ Character Texture Compositor for AoWoW WebGL Viewer
 Composites a base character skin texture with armor texture components
 from equipped items. Uses BLP textures from WoW MPQ archives.
 
+The atlas is composited as one float32 RGBA array in premultiplied alpha:
+each component is resized to its region and premultiplied once (cached),
+then blended into a view of the atlas in place (dst = src + dst * (1 - src_a)).
+
+With --dxt, textures whose DXT mips already match their atlas size (the
+512x512 atlas, or the native 256x256 layout that client textures are made
+for, upscaled afterwards) are composited on compressed blocks instead (see
+render_composite_dxt()), and --dds also writes the atlas as a DXT5 .dds next
+to the PNG (at the scale it was composited).
+
+--encoder picks the image encoder (see image_encoding; default png-optimize).
+api/character-texture.php renders with png-fast for a quick first response
+and has the cached file re-encoded with png-optimize in the background
+(--recompress, or the resident server's "reencode" request field).
+
 WoW Character Texture Atlas Layout (512x512, 2x standard):
   Region          | X   | Y   | W   | H
   ================|=====|=====|=====|====
@@ -20,14 +35,31 @@ WoW Character Texture Atlas Layout (512x512, 2x standard):
 
 Usage:
   python3 composite_texture.py --race bloodelf --sex female --skin 0 --items 220,229 --output /path/to/output.png
+  python3 composite_texture.py --batch combinations.jsonl --jobs 8     # Pre-render into cache/chartex
+  python3 composite_texture.py ... --dxt --dds                         # Block compositing + .dds copy
+  python3 composite_texture.py ... --encoder png-fast                   # Fast single-pass PNG
+  python3 composite_texture.py --recompress /path/to/output.png         # Re-encode (png-optimize)
+
+Batch files hold one combination per line; race, sex and skin may be lists
+and are expanded to every combination, items keep the order the viewer sends:
+  {"race": ["human", "orc"], "sex": ["male", "female"], "skin": 0, "items": [220, 229]}
 """
 
 import argparse
+import contextlib
+import hashlib
+import io
+import itertools
 import json
+import multiprocessing
 import os
-import struct
+import re
+import socket
 import sys
-from io import BytesIO
+import threading
+import time
+
+import numpy as np
 
 try:
     from PIL import Image
@@ -35,28 +67,38 @@ except ImportError:
     print("ERROR: Pillow not installed", file=sys.stderr)
     sys.exit(1)
 
-try:
-    import mpyq
-except ImportError:
-    print("ERROR: mpyq not installed", file=sys.stderr)
-    sys.exit(1)
-
-try:
-    import texture2ddecoder
-except ImportError:
-    texture2ddecoder = None
+from display_info import DisplayInfoIndex
+from image_encoding import (DEFAULT_ENCODER, encode_image, encoder_argument,
+                            encoder_extension)
+from dxt import (bc3_to_rgba, blp_dxt_level, block_alpha_range, dds_bytes, decode_blocks,
+                 encode_bc3, rgba_to_bc3, texture2ddecoder, to_bc3)
+from mpq_vfs import CLIENT_DATA, get_vfs
+from texture_cache import DecodedTextureCache, ImageCache, format_stats
 
 # ============================================================================
 # Configuration
 # ============================================================================
 
-MPQ_DATA_PATH = '/var/www/clientdata/Data'
+MPQ_DATA_PATH = CLIENT_DATA
 DISPLAY_INFO_PATH = '/var/www/aowow/static/data/item-display-info.json'
+# Indexed binary copy written alongside the JSON by export_item_display.py
+DISPLAY_INFO_BIN_PATH = '/var/www/aowow/static/data/item-display-info.bin'
+
+# Unix socket of the resident compositor (texture_server.py); the CLI hands
+# requests to it when it is running and only renders in-process as a fallback
+SOCKET_PATH = '/var/www/aowow/cache/chartex.sock'
+
+# Render cache read by api/character-texture.php (<md5 key>.png, served for CACHE_TTL seconds)
+CACHE_DIR = '/var/www/aowow/cache/chartex'
+CACHE_TTL = 86400
 
 # Atlas size (we work at 512x512 for quality, matching character GLB textures)
 ATLAS_W = 512
 ATLAS_H = 512
 
+# Memory budget for base skins, resized components and partially composited regions
+COMPOSITE_CACHE_MB = 128
+
 # Body region positions in the 512x512 texture atlas (2x the standard 256x256 layout)
 # Format: (x, y, width, height)
 REGION_LAYOUT = {
@@ -70,6 +112,10 @@ REGION_LAYOUT = {
     'foot':        (256, 256, 256, 64),
 }
 
+# Atlas scales the DXT block path tries, as divisors of the atlas: the atlas
+# itself, then the native 256x256 layout WotLK skins and components are made for
+DXT_SCALES = (1, 2)
+
 # Texture component directories in MPQ
 REGION_DIRS = {
     'armUpper':    'ITEM\\TEXTURECOMPONENTS\\ArmUpperTexture',
@@ -103,175 +149,121 @@ SEX_DIRS = {
 }
 
 # ============================================================================
-# MPQ Manager (simplified for this tool)
+# MPQ texture reader
 # ============================================================================
 
 class MPQTextureReader:
-    """Read BLP textures from WoW MPQ archives."""
+    """Read BLP textures through the shared MPQ filesystem."""
 
-    def __init__(self, data_path):
+    def __init__(self, data_path, texture_cache=None, composite_cache=None):
         self.data_path = data_path
-        self.mpqs = []
-        self._file_index = {}
-
-        # Load MPQs in priority order (patches override base)
-        mpq_order = [
-            'patch-3.MPQ', 'patch-2.MPQ', 'patch.MPQ',
-            'lichking.MPQ', 'expansion.MPQ',
-            'common-2.MPQ', 'common.MPQ',
-        ]
-
-        for mpq_name in mpq_order:
-            path = os.path.join(data_path, mpq_name)
-            if os.path.exists(path):
-                try:
-                    archive = mpyq.MPQArchive(path)
-                    self.mpqs.append((mpq_name, archive))
-                    # Index files
-                    for f in archive.files:
-                        name = f.decode('utf-8', 'ignore') if isinstance(f, bytes) else f
-                        key = name.lower().replace('/', '\\')
-                        if key not in self._file_index:
-                            self._file_index[key] = (mpq_name, archive, name)
-                except Exception as e:
-                    print(f"  Warning: Could not load {mpq_name}: {e}", file=sys.stderr)
-
-        print(f"  Indexed {len(self._file_index)} files from {len(self.mpqs)} MPQs", file=sys.stderr)
+        self.texture_cache = texture_cache or DecodedTextureCache()
+        self.composite_cache = composite_cache or ImageCache(COMPOSITE_CACHE_MB * 1024 * 1024)
+
+        self.vfs = get_vfs(data_path)
+        print(f"  Indexed {len(self.vfs)} files from {len(self.vfs.archives)} MPQs", file=sys.stderr)
 
     def read_file(self, path):
         """Read a file from the MPQ archives."""
-        key = path.lower().replace('/', '\\')
-        if key in self._file_index:
-            _, archive, original_name = self._file_index[key]
-            try:
-                return archive.read_file(original_name)
-            except:
-                pass
+        try:
+            return self.vfs.read_file(path)
+        except:
+            pass
         return None
 
-    def find_files(self, pattern):
-        """Find files matching a pattern (case-insensitive substring match)."""
-        pattern_lower = pattern.lower().replace('/', '\\')
-        matches = []
-        for key, (_, _, original_name) in self._file_index.items():
-            if pattern_lower in key:
-                matches.append(original_name)
-        return matches
+    def load_blp(self, path):
+        """Read and decode a BLP texture, or None if missing/undecodable.
+
+        Decoded images are shared through the texture cache; callers must
+        resize/copy rather than modify them in place.
+        """
+        texture = self.texture_cache.get(self, path)
+        return texture.image if texture else None
+
+    def load_resized(self, path, size):
+        """A BLP resized (LANCZOS) to size as a premultiplied array, or None if missing.
+
+        Kept in the composite cache by BLP content hash and size, so a
+        texture stored under several paths is only resized once.
+        """
+        texture = self.texture_cache.get(self, path)
+        if not texture or not texture.image:
+            return None
+        key = ('resized', texture.digest, size)
+        return self.composite_cache.get_or_create(
+            key, lambda: premultiply(texture.image.resize(size, Image.LANCZOS)))
+
+    def load_component(self, tex_dir, tex_name, sex_suffix, size):
+        """A TextureComponents piece resized for its region, as (image, suffix) or None.
+
+        The image is a premultiplied float32 array (see premultiply()). Tries
+        the sex-specific texture first, then universal, then no suffix.
+        Results, including textures that were not found, are kept in the
+        composite cache.
+        """
+        def load():
+            for suffix in (sex_suffix, '_U', ''):
+                array = self.load_resized(f"{tex_dir}\\{tex_name}{suffix}.blp", size)
+                if array is not None:
+                    return array, suffix
+            return None
+
+        key = ('component', tex_dir.lower(), tex_name.lower(), sex_suffix, size)
+        return self.composite_cache.get_or_create(key, load)
+
+    def find_files(self, directory, prefix='', extension=None, recursive=False):
+        """Files in directory whose name starts with prefix (case-insensitive)."""
+        return self.vfs.list_dir(directory, prefix, extension, recursive)
 
 
 # ============================================================================
-# BLP Texture Decoder
+# Premultiplied alpha blending
 # ============================================================================
 
-def decode_blp(data):
-    """Decode a BLP2 texture file to a PIL Image."""
-    if not data or len(data) < 20:
-        return None
+def premultiply(image):
+    """HxWx4 float32 array in [0, 1] with color premultiplied by alpha.
 
-    magic = data[:4]
-    if magic != b'BLP2':
-        return None
+    Images without alpha become opaque, so blending them replaces what is
+    below (as pasting a non-RGBA component always did).
+    """
+    return _premultiply_array(np.asarray(image.convert('RGBA')))
 
-    encoding = struct.unpack('<I', data[4:8])[0]
-    alpha_depth = data[8]
-    alpha_encoding = data[9]
-    has_mips = data[10]
-    width, height = struct.unpack('<II', data[12:20])
 
-    # Mipmap offsets and sizes (up to 16 levels)
-    mip_offsets = struct.unpack('<16I', data[20:84])
-    mip_sizes = struct.unpack('<16I', data[84:148])
+def unpremultiply(array):
+    """RGBA PIL image from a premultiplied float32 array."""
+    return Image.fromarray(_unpremultiply_array(array), 'RGBA')
 
-    mip_offset = mip_offsets[0]
-    mip_size = mip_sizes[0]
 
-    if mip_size == 0 or mip_offset == 0:
-        return None
+def _premultiply_array(rgba):
+    array = rgba.astype(np.float32)
+    array *= 1.0 / 255.0
+    array[..., :3] *= array[..., 3:4]
+    return array
 
-    mip_data = data[mip_offset:mip_offset + mip_size]
-
-    if encoding == 1:
-        # Palette-based (uncompressed)
-        palette_data = data[148:148 + 256 * 4]
-        palette = []
-        for i in range(256):
-            b_val = palette_data[i * 4]
-            g_val = palette_data[i * 4 + 1]
-            r_val = palette_data[i * 4 + 2]
-            a_val = palette_data[i * 4 + 3]
-            palette.append((r_val, g_val, b_val, a_val))
-
-        img = Image.new('RGBA', (width, height))
-        pixels = []
-        for i in range(width * height):
-            if i < len(mip_data):
-                idx = mip_data[i]
-                pixels.append(palette[idx])
-            else:
-                pixels.append((0, 0, 0, 255))
-
-        # Handle alpha channel
-        if alpha_depth > 0:
-            alpha_start = width * height
-            alpha_data = mip_data[alpha_start:]
-            for i in range(width * height):
-                r, g, b, _ = pixels[i]
-                if alpha_depth == 8 and i < len(alpha_data):
-                    a = alpha_data[i]
-                elif alpha_depth == 4 and i // 2 < len(alpha_data):
-                    byte = alpha_data[i // 2]
-                    a = ((byte >> ((i % 2) * 4)) & 0xF) * 17
-                elif alpha_depth == 1 and i // 8 < len(alpha_data):
-                    byte = alpha_data[i // 8]
-                    a = 255 if (byte >> (i % 8)) & 1 else 0
-                else:
-                    a = 255
-                pixels[i] = (r, g, b, a)
-
-        img.putdata(pixels)
-        return img
-
-    elif encoding == 2:
-        # DXT compressed
-        if texture2ddecoder is None:
-            return None
 
-        try:
-            if alpha_encoding == 0:
-                # DXT1
-                decoded = texture2ddecoder.decode_bc1(mip_data, width, height)
-            elif alpha_encoding == 1:
-                # DXT3 (BC2)
-                decoded = texture2ddecoder.decode_bc2(mip_data, width, height)
-            elif alpha_encoding == 7:
-                # DXT5 (BC3)
-                decoded = texture2ddecoder.decode_bc3(mip_data, width, height)
-            else:
-                decoded = texture2ddecoder.decode_bc1(mip_data, width, height)
+def _unpremultiply_array(array):
+    alpha = array[..., 3:4]
+    rgba = np.zeros(array.shape, dtype=np.float32)
+    np.divide(array[..., :3], alpha, out=rgba[..., :3], where=alpha > 0)
+    rgba[..., 3:4] = alpha
+    rgba *= 255.0
+    rgba += 0.5
+    np.clip(rgba, 0.0, 255.0, out=rgba)
+    return rgba.astype(np.uint8)
 
-            # texture2ddecoder outputs BGRA
-            img = Image.frombytes('RGBA', (width, height), decoded)
-            r, g, b, a = img.split()
-            img = Image.merge('RGBA', (b, g, r, a))  # BGRA -> RGBA
-            return img
-        except Exception as e:
-            print(f"    DXT decode error: {e}", file=sys.stderr)
-            return None
 
-    return None
+def blend_over(dst, src):
+    """Composite premultiplied src over premultiplied dst, in place."""
+    dst *= 1.0 - src[..., 3:4]
+    dst += src
 
 
 # ============================================================================
 # Character Skin Texture Builder
 # ============================================================================
 
-def build_base_skin(mpq_reader, race, sex, skin_color=0):
-    """Build the base character skin texture atlas from the full skin BLP.
-    
-    Character skin textures are stored as single BLP files, e.g.:
-      Character\\Human\\Male\\HumanMaleSkin00_00.blp
-    The first number is the face/extra, the second is the skin color index.
-    """
+def _base_skin_candidates(race, sex, skin_color):
+    """(model_dir, model_name, skin BLP paths to try in order) for race/sex/skin."""
     race_dir = RACE_DIRS.get(race.lower(), 'Human')
     sex_dir = SEX_DIRS.get(sex.lower(), 'Male')
     
@@ -285,27 +277,32 @@ def build_base_skin(mpq_reader, race, sex, skin_color=0):
         f"{model_dir}\\{model_name}_skin.blp",
         f"{model_dir}\\{model_name}.blp",
     ]
+    return model_dir, model_name, patterns
+
+
+def build_base_skin(mpq_reader, race, sex, skin_color=0):
+    """Build the base character skin texture atlas from the full skin BLP.
+    
+    Character skin textures are stored as single BLP files, e.g.:
+      Character\\Human\\Male\\HumanMaleSkin00_00.blp
+    The first number is the face/extra, the second is the skin color index.
+    """
+    model_dir, model_name, patterns = _base_skin_candidates(race, sex, skin_color)
     
     skin_img = None
     for pattern in patterns:
-        blp_data = mpq_reader.read_file(pattern)
-        if blp_data:
-            skin_img = decode_blp(blp_data)
-            if skin_img:
-                print(f"  Base skin: {pattern} ({skin_img.size[0]}x{skin_img.size[1]})", file=sys.stderr)
-                break
+        skin_img = mpq_reader.load_blp(pattern)
+        if skin_img:
+            print(f"  Base skin: {pattern} ({skin_img.size[0]}x{skin_img.size[1]})", file=sys.stderr)
+            break
     
     if not skin_img:
         # Search for any matching skin texture
-        search_term = (model_dir + '\\' + model_name + 'skin').lower()
-        matches = mpq_reader.find_files(search_term)
-        blp_matches = [m for m in matches if m.lower().endswith('.blp')]
+        blp_matches = mpq_reader.find_files(model_dir, prefix=model_name + 'Skin', extension='.blp')
         if blp_matches:
-            blp_data = mpq_reader.read_file(sorted(blp_matches)[0])
-            if blp_data:
-                skin_img = decode_blp(blp_data)
-                if skin_img:
-                    print(f"  Base skin (search): {sorted(blp_matches)[0]}", file=sys.stderr)
+            skin_img = mpq_reader.load_blp(sorted(blp_matches)[0])
+            if skin_img:
+                print(f"  Base skin (search): {sorted(blp_matches)[0]}", file=sys.stderr)
     
     if skin_img:
         # Resize to atlas dimensions (256×256 is standard for WoW character textures)
@@ -366,18 +363,60 @@ def _suffix_to_region_dir(tex_name):
     return None, None
 
 
-def overlay_armor_textures(atlas, mpq_reader, display_ids, sex):
-    """Overlay armor texture components onto the character skin atlas."""
+def load_display_info():
+    """Load the exported ItemDisplayInfo data, or None if it is missing.
+
+    Returns the memory-mapped binary index when it is at least as new as the
+    JSON export, otherwise the parsed JSON; both map str(display id) to entries.
+    """
+    try:
+        bin_mtime = os.path.getmtime(DISPLAY_INFO_BIN_PATH)
+    except OSError:
+        bin_mtime = None
+    json_mtime = os.path.getmtime(DISPLAY_INFO_PATH) if os.path.exists(DISPLAY_INFO_PATH) else None
+
+    if bin_mtime is not None and (json_mtime is None or bin_mtime >= json_mtime):
+        try:
+            return DisplayInfoIndex(DISPLAY_INFO_BIN_PATH)
+        except (OSError, ValueError) as e:
+            print(f"  Warning: Ignoring {DISPLAY_INFO_BIN_PATH}: {e}", file=sys.stderr)
+
+    if json_mtime is None:
+        print(f"  Warning: {DISPLAY_INFO_PATH} not found", file=sys.stderr)
+        return None
+    
+    with open(DISPLAY_INFO_PATH, 'r') as f:
+        return json.load(f)
+
+
+def overlay_armor_textures(atlas, mpq_reader, display_ids, sex, display_info=None, base_key=None):
+    """Overlay armor texture components onto the character skin atlas.
+    
+    atlas is a premultiplied float32 array (see premultiply()) and is
+    blended into in place. display_info may be passed in by long-lived
+    callers that keep it parsed; otherwise it is loaded from
+    DISPLAY_INFO_PATH. base_key identifies the base skin atlas (race, sex,
+    skin); when given, composited regions are cached so an unchanged region
+    is reused as-is (see _composite_region).
+    """
     sex_suffix = '_F' if sex.lower() == 'female' else '_M'
     
     # Load item display info
-    if not os.path.exists(DISPLAY_INFO_PATH):
-        print(f"  Warning: {DISPLAY_INFO_PATH} not found", file=sys.stderr)
-        return atlas
+    if display_info is None:
+        display_info = load_display_info()
+        if display_info is None:
+            return atlas
     
-    with open(DISPLAY_INFO_PATH, 'r') as f:
-        display_info = json.load(f)
+    layers = _region_layers(display_ids, display_info)
+    for region_name, stack in layers.items():
+        _composite_region(atlas, mpq_reader, region_name, stack, sex_suffix, base_key)
     
+    return atlas
+
+
+def _region_layers(display_ids, display_info):
+    """Component layers per body region, bottom to top: {region: [(tex_dir, tex_name)]}."""
+    layers = {}
     for display_id in display_ids:
         did_str = str(display_id)
         if did_str not in display_info:
@@ -401,51 +440,462 @@ def overlay_armor_textures(atlas, mpq_reader, display_ids, sex):
                     print(f"    Warning: Unknown region for texture {tex_name}", file=sys.stderr)
                     continue
             
-            x, y, w, h = REGION_LAYOUT[region_name]
-            
-            # Try sex-specific texture first, then universal, then no suffix
-            suffixes = [sex_suffix, '_U', '']
-            
-            blp_found = False
-            for suffix in suffixes:
-                blp_path = f"{tex_dir}\\{tex_name}{suffix}.blp"
-                blp_data = mpq_reader.read_file(blp_path)
+            layers.setdefault(region_name, []).append((tex_dir, tex_name))
+    
+    return layers
+
+
+def _composite_region(atlas, mpq_reader, region_name, stack, sex_suffix, base_key=None):
+    """Blend the stack of (tex_dir, tex_name) layers into one atlas region in place.
+
+    With a base_key every prefix of the stack is cached, so a request whose
+    stack for this region is unchanged (the try-on flow changes one slot at
+    a time) costs one copy, and one that adds a layer starts from the
+    cached layers below it.
+    """
+    x, y, w, h = REGION_LAYOUT[region_name]
+    region = atlas[y:y + h, x:x + w]
+    cache = mpq_reader.composite_cache
+    
+    start = 0
+    if base_key is not None:
+        for i in range(len(stack), 0, -1):
+            cached = cache.get(('region', base_key, region_name, tuple(stack[:i])))
+            if cached is not None:
+                region[...] = cached
+                start = i
+                print(f"    Cached: {region_name} ({i} of {len(stack)} layers)", file=sys.stderr)
+                break
+    
+    for i in range(start, len(stack)):
+        tex_dir, tex_name = stack[i]
+        component = mpq_reader.load_component(tex_dir, tex_name, sex_suffix, (w, h))
+        if component is None:
+            print(f"    Warning: Texture not found: {tex_name} (tried {tex_dir})", file=sys.stderr)
+        else:
+            layer, suffix = component
+            blend_over(region, layer)
+            print(f"    Applied: {tex_name} -> {region_name} ({suffix or 'bare'})", file=sys.stderr)
+        if base_key is not None:
+            cache.put(('region', base_key, region_name, tuple(stack[:i + 1])), region.copy(),
+                      count_miss=True)
+
+
+# ============================================================================
+# Main
+# ============================================================================
+
+def render_composite(mpq_reader, race, sex, skin, display_ids, display_info=None):
+    """Build the base skin for race/sex/skin and overlay the given display IDs.
+
+    Returns an RGBA PIL image.
+    """
+    # Build base skin texture (cached premultiplied; the copy is what gets blended into)
+    base_key = (race.lower(), sex.lower(), skin)
+    atlas = mpq_reader.composite_cache.get_or_create(
+        ('base',) + base_key, lambda: premultiply(build_base_skin(mpq_reader, race, sex, skin))).copy()
+    
+    # Overlay armor textures
+    if display_ids:
+        overlay_armor_textures(atlas, mpq_reader, display_ids, sex, display_info, base_key)
+    
+    return unpremultiply(atlas)
+
+
+def render_composite_dxt(mpq_reader, race, sex, skin, display_ids, display_info=None):
+    """Composite on DXT blocks; returns the atlas as a BC3 block array, or None.
+
+    Uses the BLP mips whose size already equals the atlas (base skin) or the
+    region (components), so nothing is resized. The largest scale of
+    DXT_SCALES that every texture has mips for is used: the 512x512 atlas or
+    the native 256x256 layout (REGION_LAYOUT halved), which is what WotLK
+    client textures provide; the caller upscales the decoded result. Fully
+    opaque component blocks are copied into the atlas as-is and fully
+    transparent ones are skipped; only the remaining blocks are decoded,
+    blended and re-encoded. Returns None, for the caller to fall back to
+    render_composite(), when texture2ddecoder is missing or a texture has no
+    DXT mip at either scale.
+    """
+    if texture2ddecoder is None:
+        return None
+    
+    model_dir, model_name, patterns = _base_skin_candidates(race, sex, skin)
+    base_path = next((p for p in patterns if mpq_reader.read_file(p)), None)
+    if base_path is None:
+        blp_matches = mpq_reader.find_files(model_dir, prefix=model_name + 'Skin', extension='.blp')
+        base_path = sorted(blp_matches)[0] if blp_matches else None
+    base_data = mpq_reader.read_file(base_path) if base_path else None
+    if not base_data:
+        print(f"  DXT: no base skin, decoding instead", file=sys.stderr)
+        return None
+    
+    if display_info is None and display_ids:
+        display_info = load_display_info()
+    layers = []
+    if display_ids and display_info is not None:
+        sex_suffix = '_F' if sex.lower() == 'female' else '_M'
+        layers = _component_blps(mpq_reader, _region_layers(display_ids, display_info), sex_suffix)
+    
+    for divisor in DXT_SCALES:
+        base = blp_dxt_level(base_data, (ATLAS_W // divisor, ATLAS_H // divisor))
+        levels = [blp_dxt_level(data, (w // divisor, h // divisor))
+                  for _, (x, y, w, h), data, _ in layers] if base is not None else None
+        if base is not None and all(level is not None for level in levels):
+            break
+    else:
+        print(f"  DXT: base skin or a component has no DXT mip at atlas scale, decoding instead",
+              file=sys.stderr)
+        return None
+    print(f"  Base skin (DXT {base.format}, {ATLAS_W // divisor}x{ATLAS_H // divisor}): "
+          f"{base_path}", file=sys.stderr)
+    
+    alpha_min, _ = block_alpha_range(base)
+    atlas, exact = to_bc3(base, alpha_min == 255)
+    atlas = atlas.copy()
+    if not exact.all():
+        atlas[~exact] = encode_bc3(decode_blocks(base.format, base.blocks[~exact]))
+    
+    for (region_name, (x, y, w, h), _, label), level in zip(layers, levels):
+        x, y, w, h = x // divisor, y // divisor, w // divisor, h // divisor
+        _blend_blocks(atlas[y // 4:(y + h) // 4, x // 4:(x + w) // 4], level)
+        print(f"    Applied (DXT): {label} -> {region_name}", file=sys.stderr)
+    
+    return atlas
+
+
+def _component_blps(mpq_reader, region_layers, sex_suffix):
+    """BLP data of every layer as (region, REGION_LAYOUT rect, data, label), bottom layer first.
+
+    Layers whose texture is missing are left out, as on the decode path.
+    """
+    found = []
+    for region_name, stack in region_layers.items():
+        for tex_dir, tex_name in stack:
+            for suffix in (sex_suffix, '_U', ''):
+                blp_data = mpq_reader.read_file(f"{tex_dir}\\{tex_name}{suffix}.blp")
                 if blp_data:
-                    img = decode_blp(blp_data)
-                    if img:
-                        # Resize to fit the atlas region
-                        img_resized = img.resize((w, h), Image.LANCZOS)
-                        # Alpha composite on top
-                        region_img = atlas.crop((x, y, x + w, y + h))
-                        if img_resized.mode == 'RGBA':
-                            region_img = Image.alpha_composite(region_img, img_resized)
-                        else:
-                            region_img = img_resized.convert('RGBA')
-                        atlas.paste(region_img, (x, y))
-                        blp_found = True
-                        print(f"    Applied: {tex_name} -> {region_name} ({suffix or 'bare'})", file=sys.stderr)
-                        break
-            
-            if not blp_found:
+                    found.append((region_name, REGION_LAYOUT[region_name], blp_data,
+                                  f"{tex_name} ({suffix or 'bare'})"))
+                    break
+            else:
                 print(f"    Warning: Texture not found: {tex_name} (tried {tex_dir})", file=sys.stderr)
+    return found
+
+
+def _blend_blocks(region, level):
+    """Composite a component DXTLevel over a BC3 region block array in place."""
+    alpha_min, alpha_max = block_alpha_range(level)
+    blocks, exact = to_bc3(level, alpha_min == 255)
+    copy = (alpha_min == 255) & exact
+    region[copy] = blocks[copy]
     
-    return atlas
+    blend = ~copy & (alpha_max > 0)
+    if blend.any():
+        dst = _premultiply_array(decode_blocks('bc3', region[blend]))
+        blend_over(dst, _premultiply_array(decode_blocks(level.format, level.blocks[blend])))
+        region[blend] = encode_bc3(_unpremultiply_array(dst))
+
+
+def composite_to_file(mpq_reader, race, sex, skin, display_ids, output, display_info=None,
+                      dxt=False, dds=False, encoder=DEFAULT_ENCODER):
+    """Render one combination and save it to output with encoder.
+
+    dxt composites on DXT blocks when every texture allows it (see
+    render_composite_dxt()); dds also writes the atlas as DXT5 next to the image.
+    A block composite at the native 256x256 scale is upscaled for the image
+    only; its .dds keeps the composited blocks, which hold all the detail.
+    """
+    blocks = render_composite_dxt(mpq_reader, race, sex, skin, display_ids, display_info) if dxt else None
+    if blocks is not None:
+        atlas = Image.fromarray(bc3_to_rgba(blocks), 'RGBA')
+        if atlas.size != (ATLAS_W, ATLAS_H):
+            atlas = atlas.resize((ATLAS_W, ATLAS_H), Image.LANCZOS)
+    else:
+        atlas = render_composite(mpq_reader, race, sex, skin, display_ids, display_info)
+        if dds:
+            blocks = rgba_to_bc3(np.asarray(atlas))
+    save_composite(atlas, output, dds_bytes(blocks) if dds else None, encoder)
+
+
+def _replace_atomically(output, write):
+    """Call write(tmp) for a temporary path next to output, then rename it over output."""
+    tmp = f"{output}.{os.getpid()}-{threading.get_ident()}.tmp"
+    try:
+        write(tmp)
+        os.replace(tmp, output)
+    finally:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+
+
+def _write_bytes(path, data):
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def save_composite(atlas, output, dds=None, encoder=DEFAULT_ENCODER):
+    """Save a composited atlas (already at 512x512) encoded with encoder.
+
+    The image is written to a temporary file next to output and renamed over
+    it, so readers of the cache never see a partially written image. dds,
+    if given, is written the same way to output with a .dds extension
+    (before the image, so an image in the cache always has its DDS next to it).
+    """
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    if dds is not None:
+        _replace_atomically(os.path.splitext(output)[0] + '.dds', lambda tmp: _write_bytes(tmp, dds))
+    data = encode_image(atlas, encoder)
+    _replace_atomically(output, lambda tmp: _write_bytes(tmp, data))
+    print(f"  Saved composite texture: {output} ({len(data)} bytes, {encoder})", file=sys.stderr)
+
+
+def reencode_file(path, encoder=DEFAULT_ENCODER):
+    """Re-encode a saved composite in place, keeping the result only if smaller.
+
+    Used to replace a quickly encoded response with an optimized one; the
+    encoder must produce the file's current format. Returns the new size, or
+    None if the file was left as it was.
+    """
+    if encoder_extension(encoder) != os.path.splitext(path)[1].lstrip('.').lower():
+        raise ValueError(f"{encoder} does not match the format of {path}")
+    with Image.open(path) as image:
+        image.load()
+        data = encode_image(image, encoder)
+    stat = os.stat(path)
+    old_size = stat.st_size
+    if len(data) >= old_size:
+        return None
+    _replace_atomically(path, lambda tmp: _write_bytes(tmp, data))
+    # Keep the render time so the endpoint's cache TTL is unchanged
+    os.utime(path, (stat.st_atime, stat.st_mtime))
+    print(f"  Re-encoded {path}: {old_size} -> {len(data)} bytes ({encoder})", file=sys.stderr)
+    return len(data)
+
+
+def request_composite(socket_path, race, sex, skin, display_ids, output, timeout=60,
+                      encoder=None):
+    """Hand a render to the resident compositor.
+    
+    Returns True once the server has written output, False if no server is
+    listening (the caller should then render in-process).
+    """
+    if not os.path.exists(socket_path):
+        return False
+    
+    request = {
+        'race': race,
+        'sex': sex,
+        'skin': skin,
+        'items': display_ids,
+        'output': os.path.abspath(output),
+    }
+    if encoder:
+        request['encoder'] = encoder
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout)
+            sock.connect(socket_path)
+            sock.sendall(json.dumps(request).encode('utf-8') + b'\n')
+            reply = json.loads(sock.makefile('rb').readline() or b'{}')
+    except (OSError, ValueError) as e:
+        print(f"  Warning: Compositor server unavailable ({e}), rendering locally", file=sys.stderr)
+        return False
+    
+    if not reply.get('ok'):
+        print(f"  Warning: Compositor server failed: {reply.get('error')}", file=sys.stderr)
+        return False
+    print(f"  Saved composite texture (server): {output}", file=sys.stderr)
+    return True
 
 
 # ============================================================================
-# Main
+# Batch pre-rendering
 # ============================================================================
 
+# State used by batch tasks in this process (inherited across fork)
+_batch_reader = None
+_batch_display_info = None
+
+
+def cache_key(race, sex, skin, display_ids):
+    """File name stem api/character-texture.php uses for these parameters.
+
+    Display IDs are canonicalized as the endpoint does: integers, with zeros
+    (empty slots) and negative values dropped, joined with ','.
+    """
+    race = re.sub(r'[^a-z]', '', str(race), flags=re.IGNORECASE)
+    sex = 'female' if str(sex).lower() == 'female' else 'male'
+    items = ','.join(str(int(d)) for d in display_ids if int(d) > 0)
+    return hashlib.md5(f"{race}_{sex}_{int(skin)}_{items}".encode('utf-8')).hexdigest()
+
+
+def read_combinations(path):
+    """Expand a JSONL batch file into (race, sex, skin, display_ids) tuples.
+
+    Duplicates are dropped and the result is sorted by race/sex/skin, so each
+    pool worker gets runs of renders sharing the same base skin.
+    """
+    def as_list(value):
+        return value if isinstance(value, list) else [value]
+
+    combinations = set()
+    with open(path) as f:
+        for line_no, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                entry = json.loads(line)
+                items = entry.get('items', [])
+                if isinstance(items, str):
+                    items = [part for part in items.split(',') if part.strip()]
+                display_ids = tuple(int(d) for d in items if int(d) > 0)
+                for race, sex, skin in itertools.product(as_list(entry.get('race', 'human')),
+                                                         as_list(entry.get('sex', 'male')),
+                                                         as_list(entry.get('skin', 0))):
+                    race = re.sub(r'[^a-z]', '', str(race), flags=re.IGNORECASE)
+                    sex = 'female' if str(sex).lower() == 'female' else 'male'
+                    combinations.add((race, sex, int(skin), display_ids))
+            except (ValueError, TypeError, AttributeError) as e:
+                print(f"  Warning: {path}:{line_no}: skipping invalid line ({e})", file=sys.stderr)
+    return sorted(combinations)
+
+
+def _batch_task(task):
+    """Render one combination; returns (output, ok, captured log, cache stats)."""
+    race, sex, skin, display_ids, output, verbose, dxt, dds, encoder = task
+    log = io.StringIO()
+    redirect = contextlib.nullcontext() if verbose else contextlib.redirect_stderr(log)
+    with redirect:
+        try:
+            composite_to_file(_batch_reader, race, sex, skin, list(display_ids), output,
+                              _batch_display_info, dxt, dds, encoder)
+            ok = True
+        except Exception as e:
+            print(f"  ERROR: {race}/{sex}/{skin}/{display_ids}: {e}", file=sys.stderr)
+            ok = False
+    return output, ok, log.getvalue(), (os.getpid(), {'decoded': _batch_reader.texture_cache.stats(),
+                                                     'composite': _batch_reader.composite_cache.stats()})
+
+
+def render_batch(mpq_reader, combinations, output_dir=CACHE_DIR, jobs=1, force=False,
+                 verbose=False, dxt=False, dds=False, encoder=DEFAULT_ENCODER):
+    """Pre-render combinations into output_dir/<cache_key>.png.
+
+    encoder must be a PNG encoder, since the PHP endpoint only serves
+    <cache_key>.png (raises ValueError otherwise).
+
+    Outputs the PHP endpoint would still serve (younger than CACHE_TTL) are
+    skipped unless force is set. Workers are forked after the MPQ index and
+    display info are loaded, and each keeps its own decoded texture cache.
+
+    Returns (rendered, failed, skipped).
+    """
+    global _batch_reader, _batch_display_info
+    if encoder_extension(encoder) != 'png':
+        raise ValueError(f"batch renders must be PNG (the endpoint serves <key>.png), not {encoder}")
+    _batch_reader = mpq_reader
+    _batch_display_info = load_display_info()
+    os.makedirs(output_dir, exist_ok=True)
+
+    tasks = []
+    skipped = 0
+    now = time.time()
+    for race, sex, skin, display_ids in combinations:
+        output = os.path.join(output_dir, f"{cache_key(race, sex, skin, display_ids)}.png")
+        if not force and os.path.exists(output) and now - os.path.getmtime(output) < CACHE_TTL:
+            skipped += 1
+            continue
+        tasks.append((race, sex, skin, display_ids, output, verbose, dxt, dds, encoder))
+
+    rendered = 0
+    failed = 0
+    worker_stats = {}
+    start_time = time.time()
+    jobs = max(1, jobs or 1)
+    if jobs == 1:
+        results = map(_batch_task, tasks)
+        pool = None
+    else:
+        methods = multiprocessing.get_all_start_methods()
+        pool = multiprocessing.get_context('fork' if 'fork' in methods else None).Pool(jobs)
+        # Sorted input + chunks keep combinations sharing a base skin on one worker
+        results = pool.imap(_batch_task, tasks, chunksize=16)
+
+    try:
+        for done, (output, ok, log, (pid, stats)) in enumerate(results, 1):
+            worker_stats[pid] = stats
+            if ok:
+                rendered += 1
+            else:
+                failed += 1
+                sys.stderr.write(log)
+            if done % 100 == 0:
+                rate = done / (time.time() - start_time)
+                print(f"  {done}/{len(tasks)} rendered ({failed} failed) [{rate:.1f}/s]",
+                      file=sys.stderr)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    if worker_stats:
+        totals = {'decoded': {}, 'composite': {}}
+        for cache_stats in worker_stats.values():
+            for cache, counters in cache_stats.items():
+                for key, value in counters.items():
+                    totals[cache][key] = totals[cache].get(key, 0) + value
+        print(format_stats(totals['decoded']), file=sys.stderr)
+        print(format_stats(totals['composite'], 'Composite cache'), file=sys.stderr)
+    return rendered, failed, skipped
+
+
 def main():
     parser = argparse.ArgumentParser(description='Character Texture Compositor')
     parser.add_argument('--race', default='human', help='Race name')
     parser.add_argument('--sex', default='male', help='male or female')
     parser.add_argument('--skin', type=int, default=0, help='Skin color index')
     parser.add_argument('--items', default='', help='Comma-separated display IDs')
-    parser.add_argument('--output', required=True, help='Output PNG path')
+    parser.add_argument('--output', help='Output PNG path')
+    parser.add_argument('--socket', default=SOCKET_PATH, help='Resident compositor socket')
+    parser.add_argument('--no-server', action='store_true', help='Always render in this process')
+    parser.add_argument('--batch', metavar='JSONL',
+                        help='Pre-render every combination listed in this file into --output-dir')
+    parser.add_argument('--output-dir', default=CACHE_DIR,
+                        help='Batch output directory (default: the PHP endpoint cache)')
+    parser.add_argument('--jobs', '-j', type=int, default=1, help='Batch worker processes (default: 1)')
+    parser.add_argument('--force', action='store_true',
+                        help='Batch: re-render outputs that are still fresh in the cache')
+    parser.add_argument('--verbose', action='store_true', help='Batch: log every render')
+    parser.add_argument('--dxt', action='store_true',
+                        help='Composite DXT blocks directly when the BLP mips match the atlas')
+    parser.add_argument('--dds', action='store_true', help='Also write the atlas as DXT5 <output>.dds')
+    parser.add_argument('--encoder', type=encoder_argument, default=DEFAULT_ENCODER, metavar='SPEC',
+                        help='Image encoder: png-optimize (default), png-level0..9 / png-fast, '
+                             'webp-lossless, webp-q1..100 / webp')
+    parser.add_argument('--recompress', metavar='PATH',
+                        help='Re-encode an existing composite with --encoder (kept if smaller)')
     
     args = parser.parse_args()
     
+    if args.recompress:
+        reencode_file(args.recompress, args.encoder)
+        return
+    if args.batch:
+        if encoder_extension(args.encoder) != 'png':
+            parser.error('--batch needs a PNG --encoder (the PHP endpoint serves <key>.png)')
+        combinations = read_combinations(args.batch)
+        print(f"  Batch: {len(combinations)} combinations from {args.batch}", file=sys.stderr)
+        mpq_reader = MPQTextureReader(MPQ_DATA_PATH)
+        start = time.time()
+        rendered, failed, skipped = render_batch(mpq_reader, combinations, args.output_dir,
+                                                 args.jobs, args.force, args.verbose,
+                                                 args.dxt, args.dds, args.encoder)
+        print(f"  Batch: {rendered} rendered, {failed} failed, {skipped} up to date "
+              f"in {time.time() - start:.0f}s", file=sys.stderr)
+        sys.exit(1 if failed else 0)
+    if not args.output:
+        parser.error('--output is required unless --batch is given')
+    
     # Parse display IDs
     display_ids = []
     if args.items:
@@ -456,20 +906,15 @@ def main():
     
     print(f"  Compositing: race={args.race}, sex={args.sex}, skin={args.skin}, items={display_ids}", file=sys.stderr)
     
+    if not args.no_server and request_composite(args.socket, args.race, args.sex, args.skin,
+                                                 display_ids, args.output, encoder=args.encoder):
+        return
+    
     # Initialize MPQ reader
     mpq_reader = MPQTextureReader(MPQ_DATA_PATH)
     
-    # Build base skin texture
-    atlas = build_base_skin(mpq_reader, args.race, args.sex, args.skin)
-    
-    # Overlay armor textures
-    if display_ids:
-        atlas = overlay_armor_textures(atlas, mpq_reader, display_ids, args.sex)
-    
-    # Save (already at 512x512)
-    os.makedirs(os.path.dirname(args.output), exist_ok=True)
-    atlas.save(args.output, format='PNG', optimize=True)
-    print(f"  Saved composite texture: {args.output} ({os.path.getsize(args.output)} bytes)", file=sys.stderr)
+    composite_to_file(mpq_reader, args.race, args.sex, args.skin, display_ids, args.output,
+                      dxt=args.dxt, dds=args.dds, encoder=args.encoder)
 
 
 if __name__ == '__main__':
@@ -3,20 +3,40 @@
 Batch convert item models using pre-built mapping.
 Reads /tmp/item-m2-mapping.json (model_name -> M2_path).
 Outputs GLBs to /var/www/aowow/static/models/item/
+
+Usage:
+    python3 convert_items.py              # Convert on a single core
+    python3 convert_items.py --jobs 16    # Convert across 16 worker processes
+    python3 convert_items.py --force      # Reconvert models whose inputs are unchanged too
+    python3 convert_items.py --lods       # Also export the reduced .skin LOD meshes
+    python3 convert_items.py --atlas      # Pack submesh textures into one atlas image
+    python3 convert_items.py --ktx2       # Also write DXT textures as KTX2 files
+    python3 convert_items.py --quantize   # Quantize and cache-optimize meshes
+    python3 convert_items.py --animations # Skeleton + Stand/Walk/Run animations
+    python3 convert_items.py --image-encoder png-fast # Faster, larger PNG textures
 """
 
+import argparse
 import json
-import os
 import sys
 import time
 
 sys.path.insert(0, '/var/www/aowow/tools')
-from m2_to_glb import MPQManager, convert_model
+from m2_to_glb import MPQManager
+from batch_convert import add_conversion_arguments, conversion_options, run_batch
 
 CLIENT_DATA = '/var/www/clientdata/Data'
 OUTPUT_DIR = '/var/www/aowow/static/models/item'
 
 def main():
+    parser = argparse.ArgumentParser(description='Batch convert item models to GLB')
+    parser.add_argument('--jobs', '-j', type=int, default=1,
+                        help='Worker processes (default: 1)')
+    parser.add_argument('--force', action='store_true',
+                        help='Reconvert models even if their inputs are unchanged')
+    add_conversion_arguments(parser)
+    args = parser.parse_args()
+
     # Load mapping
     with open('/tmp/item-m2-mapping.json') as f:
         mapping = json.load(f)
@@ -24,38 +44,17 @@ def main():
     print(f"Items to convert: {len(mapping)}")
     print("Loading MPQ archives...")
     mpq_mgr = MPQManager(CLIENT_DATA)
-    print(f"Indexed {len(mpq_mgr.file_index)} files\n")
-
-    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    print(f"Indexed {len(mpq_mgr.vfs)} files\n")
 
-    success = 0
-    failed = 0
-    skipped = 0
     start_time = time.time()
 
-    total = len(mapping)
-    for i, (name, m2_path) in enumerate(sorted(mapping.items())):
-        output_path = os.path.join(OUTPUT_DIR, f"{name}.glb")
-
-        # Convert with backslashes
-        m2_path = m2_path.replace('/', '\\')
-
-        if convert_model(mpq_mgr, m2_path, output_path, model_type='item'):
-            success += 1
-        else:
-            failed += 1
-
-        # Progress every 200 items
-        done = success + failed
-        if done % 200 == 0:
-            elapsed = time.time() - start_time
-            rate = done / elapsed if elapsed > 0 else 0
-            eta = (total - done) / rate if rate > 0 else 0
-            print(f"\n--- Progress: {done}/{total} ({success} ok, {failed} fail) "
-                  f"[{rate:.1f}/s, ETA: {eta/60:.1f}min] ---\n")
+    # Progress every 200 items
+    success, failed, skipped = run_batch(mpq_mgr, mapping, OUTPUT_DIR, 'item',
+                                         jobs=args.jobs, progress_every=200, force=args.force,
+                                         options=conversion_options(args))
 
     elapsed = time.time() - start_time
-    print(f"\n=== DONE: {success} success, {failed} failed in {elapsed:.0f}s ===")
+    print(f"\n=== DONE: {success} success, {failed} failed, {skipped} up to date in {elapsed:.0f}s ===")
 
 if __name__ == '__main__':
     main()
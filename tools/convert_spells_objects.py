@@ -1,53 +1,66 @@
 #!/usr/bin/env python3
 """
 Batch convert spell and object models using pre-built mappings.
+
+Usage:
+    python3 convert_spells_objects.py              # Convert on a single core
+    python3 convert_spells_objects.py --jobs 16    # Convert across 16 worker processes
+    python3 convert_spells_objects.py --force      # Reconvert models whose inputs are unchanged too
+    python3 convert_spells_objects.py --lods       # Also export the reduced .skin LOD meshes
+    python3 convert_spells_objects.py --atlas      # Pack submesh textures into one atlas image
+    python3 convert_spells_objects.py --ktx2       # Also write DXT textures as KTX2 files
+    python3 convert_spells_objects.py --quantize   # Quantize and cache-optimize meshes
+    python3 convert_spells_objects.py --animations # Skeleton + Stand/Walk/Run animations
+    python3 convert_spells_objects.py --image-encoder png-fast # Faster, larger PNG textures
 """
 
+import argparse
 import json
-import os
 import sys
 import time
 
 sys.path.insert(0, '/var/www/aowow/tools')
-from m2_to_glb import MPQManager, convert_model
+from m2_to_glb import MPQManager
+from batch_convert import add_conversion_arguments, conversion_options, run_batch
 
 CLIENT_DATA = '/var/www/clientdata/Data'
 
-def convert_batch(mpq_mgr, mapping_file, output_dir, model_type):
+def convert_batch(mpq_mgr, mapping_file, output_dir, model_type, jobs=1, force=False, options=None):
     with open(mapping_file) as f:
         mapping = json.load(f)
 
     print(f"\n=== Converting {model_type} models: {len(mapping)} ===\n")
-    os.makedirs(output_dir, exist_ok=True)
 
-    success = 0
-    failed = 0
     start_time = time.time()
 
-    for name, m2_path in sorted(mapping.items()):
-        output_path = os.path.join(output_dir, f"{name}.glb")
-        m2_path = m2_path.replace('/', '\\')
-
-        if convert_model(mpq_mgr, m2_path, output_path, model_type=model_type):
-            success += 1
-        else:
-            failed += 1
+    success, failed, skipped = run_batch(mpq_mgr, mapping, output_dir, model_type,
+                                         jobs=jobs, progress_every=0, force=force, options=options)
 
     elapsed = time.time() - start_time
-    print(f"\n=== {model_type}: {success} success, {failed} failed in {elapsed:.0f}s ===")
+    print(f"\n=== {model_type}: {success} success, {failed} failed, {skipped} up to date "
+          f"in {elapsed:.0f}s ===")
     return success, failed
 
 
 def main():
+    parser = argparse.ArgumentParser(description='Batch convert spell and object models to GLB')
+    parser.add_argument('--jobs', '-j', type=int, default=1,
+                        help='Worker processes (default: 1)')
+    parser.add_argument('--force', action='store_true',
+                        help='Reconvert models even if their inputs are unchanged')
+    add_conversion_arguments(parser)
+    args = parser.parse_args()
+    options = conversion_options(args)
+
     print("Loading MPQ archives...")
     mpq_mgr = MPQManager(CLIENT_DATA)
-    print(f"Indexed {len(mpq_mgr.file_index)} files\n")
+    print(f"Indexed {len(mpq_mgr.vfs)} files\n")
 
     convert_batch(mpq_mgr, '/tmp/spell-m2-mapping.json',
-                  '/var/www/aowow/static/models/spell', 'spell')
+                  '/var/www/aowow/static/models/spell', 'spell', args.jobs, args.force, options)
 
     convert_batch(mpq_mgr, '/tmp/object-m2-mapping.json',
-                  '/var/www/aowow/static/models/object', 'object')
+                  '/var/www/aowow/static/models/object', 'object', args.jobs, args.force, options)
 
 
 if __name__ == '__main__':
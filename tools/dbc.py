@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+WDBC (client database) reader for the AoWoW tools.
+
+WDBC layout:
+  Offset | Size | Field
+  =======|======|==========================================
+  0      | 4    | magic 'WDBC'
+  4      | 4    | record count
+  8      | 4    | field count
+  12     | 4    | record size (bytes)
+  16     | 4    | string block size
+  20     | ...  | records (record count * record size)
+  ...    | ...  | string block (NUL-terminated strings, offset 0 = '')
+
+Records are exposed as a NumPy structured view over the raw buffer (no
+per-record unpacking), optionally with named/typed fields. Column projection
+returns a view over just the requested fields, and string fields are decoded
+on first access through an offset -> string cache, with string ends found by
+a binary search over the NUL positions of the string block.
+
+Example:
+  dbc = DBCFile(vfs.read_file('DBFilesClient\\ItemDisplayInfo.dbc'),
+                [('id', 'u'), ('model', 's', 2), ...])
+  for did, model in zip(dbc.column('id'), dbc.column('model')[:, 0]):
+      print(did, dbc.string(model))
+"""
+
+import struct
+
+import numpy as np
+
+DBC_MAGIC = b'WDBC'
+DBC_HEADER_FORMAT = '<4s4I'
+DBC_HEADER_SIZE = struct.calcsize(DBC_HEADER_FORMAT)
+
+# Field kinds: signed/unsigned 32-bit int, float, string block offset
+FIELD_DTYPES = {
+    'i': '<i4',
+    'u': '<u4',
+    'f': '<f4',
+    's': '<u4',
+}
+
+
+class DBCFile:
+    """Read-only structured view of a WDBC file.
+
+    fields is an optional list of (name, kind) or (name, kind, count) tuples
+    in record order, kind being one of FIELD_DTYPES. Fields not described
+    (or all of them, if fields is None) are exposed as unsigned 'f<index>'
+    columns.
+    """
+
+    def __init__(self, data, fields=None):
+        if len(data) < DBC_HEADER_SIZE:
+            raise ValueError("Truncated DBC header")
+        magic, record_count, field_count, record_size, string_block_size = \
+            struct.unpack_from(DBC_HEADER_FORMAT, data, 0)
+        if magic != DBC_MAGIC:
+            raise ValueError(f"Not a WDBC file (magic: {magic})")
+
+        self.record_count = record_count
+        self.field_count = field_count
+        self.record_size = record_size
+        self.string_block_size = string_block_size
+
+        strings_start = DBC_HEADER_SIZE + record_count * record_size
+        if len(data) < strings_start + string_block_size:
+            raise ValueError("Truncated DBC file")
+
+        self.dtype = self._record_dtype(fields)
+        self.records = np.frombuffer(data, dtype=self.dtype, count=record_count,
+                                     offset=DBC_HEADER_SIZE)
+        # Every 32-bit slot of every record, untyped (for diagnostics)
+        self.raw = np.frombuffer(data, dtype='<u4', count=record_count * (record_size // 4),
+                                 offset=DBC_HEADER_SIZE).reshape(record_count, record_size // 4)
+
+        self._string_block = memoryview(data)[strings_start:strings_start + string_block_size]
+        self._nul_positions = None
+        self._strings = {0: ''}
+
+    def _layout(self, fields):
+        """(name, kind, count) for every field slot, filling undescribed fields."""
+        layout = []
+        index = 0
+        for field in fields or []:
+            name, kind = field[0], field[1]
+            count = field[2] if len(field) > 2 else 1
+            layout.append((name, kind, count))
+            index += count
+        for i in range(index, self.field_count):
+            layout.append((f"f{i}", 'u', 1))
+        return layout
+
+    def _record_dtype(self, fields):
+        names, formats, offsets = [], [], []
+        offset = 0
+        for name, kind, count in self._layout(fields):
+            if kind not in FIELD_DTYPES:
+                raise ValueError(f"Unknown DBC field kind {kind!r} for {name}")
+            names.append(name)
+            formats.append((FIELD_DTYPES[kind], count) if count > 1 else FIELD_DTYPES[kind])
+            offsets.append(offset)
+            offset += 4 * count
+        if offset > self.record_size:
+            raise ValueError(f"Fields need {offset} bytes but records are {self.record_size}")
+        return np.dtype({'names': names, 'formats': formats, 'offsets': offsets,
+                         'itemsize': self.record_size})
+
+    def __len__(self):
+        return self.record_count
+
+    @property
+    def fields(self):
+        return self.dtype.names
+
+    def column(self, name):
+        """One field across all records (a view, no copy)."""
+        return self.records[name]
+
+    def select(self, names):
+        """Structured view containing only the named fields (column projection)."""
+        return self.records[list(names)]
+
+    def string(self, offset):
+        """Decode the string at a string block offset (cached)."""
+        offset = int(offset)
+        cached = self._strings.get(offset)
+        if cached is not None:
+            return cached
+        if offset >= self.string_block_size:
+            return ''
+        self._decode([offset])
+        return self._strings[offset]
+
+    def strings(self, offsets):
+        """Decode an array of string offsets (e.g. a column) to nested lists of str.
+
+        Each distinct offset is decoded once, with all string ends located in
+        a single vectorized search.
+        """
+        offsets = np.asarray(offsets, dtype=np.int64)
+        unique, inverse = np.unique(offsets, return_inverse=True)
+        unique = unique.tolist()
+        self._decode([o for o in unique if o not in self._strings])
+        decoded = np.empty(len(unique), dtype=object)
+        decoded[:] = [self._strings.get(o, '') for o in unique]
+        return decoded[inverse].reshape(offsets.shape).tolist()
+
+    def _decode(self, offsets):
+        """Fill the string cache for offsets (out-of-range offsets decode to '')."""
+        offsets = [o for o in offsets if o < self.string_block_size]
+        if not offsets:
+            return
+        if self._nul_positions is None:
+            block = np.frombuffer(self._string_block, dtype=np.uint8)
+            self._nul_positions = np.flatnonzero(block == 0)
+        nuls = self._nul_positions
+        idx = np.searchsorted(nuls, offsets)
+        ends = np.append(nuls, self.string_block_size)[idx].tolist()
+        block = self._string_block
+        for offset, end in zip(offsets, ends):
+            self._strings[offset] = bytes(block[offset:end]).decode('utf-8', 'ignore')
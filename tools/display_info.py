@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Compact binary item display info for the character texture compositor.
+
+export_item_display.py writes item-display-info.json for the web front end
+and, next to it, item-display-info.bin for the compositor. The binary file is
+memory-mapped and looked up with a binary search over the sorted display IDs,
+so a render only touches the handful of records it needs instead of parsing
+the whole JSON export.
+
+Layout (little-endian):
+  Header   | magic 'AOID', version, entry count
+  IDs      | entry count * u32, sorted ascending
+  Records  | entry count * RECORD_FIELDS u32 (same order as the IDs)
+  Strings  | NUL-terminated UTF-8; string fields store offsets, 0 = ''
+
+Entries are returned as dicts shaped like the JSON entries, so the two
+formats are interchangeable for callers.
+"""
+
+import mmap
+import os
+import struct
+
+import numpy as np
+
+DISPLAY_INFO_MAGIC = b'AOID'
+DISPLAY_INFO_VERSION = 1
+HEADER_FORMAT = '<4sII'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+# Body texture regions in record order (Texture[0..7])
+REGIONS = ['armUpper', 'armLower', 'hand', 'torsoUpper', 'torsoLower', 'legUpper', 'legLower', 'foot']
+STRING_KEYS = ['modelL', 'modelR', 'texL', 'texR']
+INT_KEYS = ['geo1', 'geo2', 'helmGeo1', 'helmGeo2', 'flags']
+# tex[8] string offsets, then STRING_KEYS offsets, then INT_KEYS values
+RECORD_FIELDS = len(REGIONS) + len(STRING_KEYS) + len(INT_KEYS)
+
+
+def write_display_info(entries, path):
+    """Write {display id (str or int): JSON-style entry} as a binary index."""
+    ids = sorted(int(did) for did in entries)
+    strings = bytearray(b'\x00')
+    string_offsets = {'': 0}
+
+    def string_offset(value):
+        offset = string_offsets.get(value)
+        if offset is None:
+            offset = string_offsets[value] = len(strings)
+            strings.extend(value.encode('utf-8') + b'\x00')
+        return offset
+
+    records = np.zeros((len(ids), RECORD_FIELDS), dtype='<u4')
+    for row, did in enumerate(ids):
+        entry = entries.get(str(did), entries.get(did))
+        tex = entry.get('tex', {})
+        values = [string_offset(tex.get(region, '')) for region in REGIONS]
+        values += [string_offset(entry.get(key, '')) for key in STRING_KEYS]
+        values += [entry.get(key, 0) for key in INT_KEYS]
+        records[row] = values
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(struct.pack(HEADER_FORMAT, DISPLAY_INFO_MAGIC, DISPLAY_INFO_VERSION, len(ids)))
+        f.write(np.asarray(ids, dtype='<u4').tobytes())
+        f.write(records.tobytes())
+        f.write(strings)
+    os.replace(tmp_path, path)
+
+
+class DisplayInfoIndex:
+    """Memory-mapped display info; supports `did in index` and `index[did]`.
+
+    Display IDs may be given as int or str (like the JSON keys).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, count = struct.unpack_from(HEADER_FORMAT, self._map, 0)
+        if magic != DISPLAY_INFO_MAGIC or version != DISPLAY_INFO_VERSION:
+            raise ValueError(f"Unsupported display info {path} (magic={magic}, version={version})")
+
+        self._count = count
+        self._ids = np.frombuffer(self._map, dtype='<u4', count=count, offset=HEADER_SIZE)
+        records_start = HEADER_SIZE + count * 4
+        self._records = np.frombuffer(self._map, dtype='<u4', count=count * RECORD_FIELDS,
+                                      offset=records_start).reshape(count, RECORD_FIELDS)
+        self._strings_start = records_start + count * RECORD_FIELDS * 4
+
+    def __len__(self):
+        return self._count
+
+    def _row(self, display_id):
+        try:
+            did = int(display_id)
+        except (TypeError, ValueError):
+            return None
+        i = int(np.searchsorted(self._ids, did))
+        if i < self._count and self._ids[i] == did:
+            return i
+        return None
+
+    def __contains__(self, display_id):
+        return self._row(display_id) is not None
+
+    def __getitem__(self, display_id):
+        entry = self.get(display_id)
+        if entry is None:
+            raise KeyError(display_id)
+        return entry
+
+    def _string(self, offset):
+        if offset == 0:
+            return ''
+        start = self._strings_start + offset
+        end = self._map.find(b'\x00', start)
+        return self._map[start:end if end >= 0 else len(self._map)].decode('utf-8', 'ignore')
+
+    def get(self, display_id, default=None):
+        """JSON-style entry for a display ID, or default if it is not present."""
+        i = self._row(display_id)
+        if i is None:
+            return default
+        values = self._records[i].tolist()
+
+        entry = {}
+        tex = {}
+        for region, offset in zip(REGIONS, values):
+            if offset:
+                tex[region] = self._string(offset)
+        if tex:
+            entry['tex'] = tex
+        pos = len(REGIONS)
+        for key, offset in zip(STRING_KEYS, values[pos:]):
+            if offset:
+                entry[key] = self._string(offset)
+        pos += len(STRING_KEYS)
+        for key, value in zip(INT_KEYS, values[pos:]):
+            if value:
+                entry[key] = value
+        return entry
+
+    def close(self):
+        self._ids = self._records = None
+        self._map.close()
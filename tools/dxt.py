@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+DXT block helpers for compositing character textures without a full decode.
+
+Blocks are handled as NumPy arrays of shape (rows, columns, block bytes), with
+the atlas kept as BC3 (DXT5): an 8-byte alpha block followed by an 8-byte BC1
+color block per 4x4 texels.
+
+Block layouts (little-endian):
+  BC1 (DXT1) | 8  | color0, color1 (RGB565), 2-bit indices, texel 0 in the low bits
+  BC2 (DXT3) | 16 | 4-bit explicit alpha per texel, then a BC1 color block
+  BC3 (DXT5) | 16 | alpha0, alpha1, 3-bit alpha indices (48 bits), then a BC1 color block
+
+BC1 blocks decode fully opaque in this pipeline (texture2ddecoder gives the
+3-color mode's index 3 alpha 255), matching what the decode path composites.
+A BC1 block is only copied into BC3 as-is when it is in 4-color mode (or
+never uses indices 2/3), since BC3 color blocks are 4-color on D3D10+ GPUs;
+other blocks are decoded and re-encoded.
+
+encode_bc3() is a small vectorized encoder (principal axis endpoints, nearest
+palette index) for the blocks that had to be blended.
+"""
+
+import struct
+from collections import namedtuple
+
+import numpy as np
+
+from blp import _decode_bc2, read_blp_header
+
+try:
+    import texture2ddecoder
+except ImportError:
+    texture2ddecoder = None
+
+# format is 'bc1', 'bc2' or 'bc3'; blocks is (rows, columns, 8 or 16) uint8
+DXTLevel = namedtuple('DXTLevel', ['format', 'blocks'])
+
+BLOCK_BYTES = {'bc1': 8, 'bc2': 16, 'bc3': 16}
+
+# BC3 alpha half of a fully opaque block (alpha0 = alpha1 = 255, all indices 0)
+OPAQUE_ALPHA_BLOCK = np.array([255, 255, 0, 0, 0, 0, 0, 0], dtype=np.uint8)
+
+DDS_HEADER_FORMAT = '<4s7I44x2I4s5I5I'
+DDSD_CAPS_HEIGHT_WIDTH_PIXELFORMAT_LINEARSIZE = 0x1 | 0x2 | 0x4 | 0x1000 | 0x80000
+DDPF_FOURCC = 0x4
+DDSCAPS_TEXTURE = 0x1000
+
+
+def blp_dxt_level(blp_data, size):
+    """The DXT mip of a BLP2 whose dimensions equal size, or None.
+
+    Returns None when the BLP is not DXT encoded, has no mip of that size,
+    or the size is not a multiple of 4 texels.
+    """
+    header = read_blp_header(blp_data)
+    if header is None or header.encoding != 2:
+        return None
+    width, height = size
+    if width % 4 or height % 4:
+        return None
+    fmt = {1: 'bc2', 7: 'bc3'}.get(header.alpha_encoding, 'bc1')
+    block_bytes = BLOCK_BYTES[fmt]
+    nbytes = (width // 4) * (height // 4) * block_bytes
+
+    for i in range(16):
+        if (max(1, header.width >> i), max(1, header.height >> i)) != (width, height):
+            continue
+        offset, mip_size = header.mip_offsets[i], header.mip_sizes[i]
+        if offset == 0 or mip_size < nbytes or offset + nbytes > len(blp_data):
+            return None
+        blocks = np.frombuffer(blp_data, dtype=np.uint8, count=nbytes, offset=offset)
+        return DXTLevel(fmt, blocks.reshape(height // 4, width // 4, block_bytes))
+    return None
+
+
+def _indices(packed, bits, count=16):
+    """Unpack count little-endian bit fields of a uint64 array into (..., count)."""
+    shifts = np.arange(count, dtype=np.uint64) * np.uint64(bits)
+    return ((packed[..., None] >> shifts) & np.uint64((1 << bits) - 1)).astype(np.uint8)
+
+
+def _bc3_alpha_palette(a0, a1):
+    """(..., 8) alpha palettes of BC3 alpha blocks."""
+    a0 = a0.astype(np.int32)[..., None]
+    a1 = a1.astype(np.int32)[..., None]
+    i = np.arange(1, 7, dtype=np.int32)
+    eight = (a0 * (7 - i) + a1 * i + 3) // 7
+    six = (a0 * (5 - i[:4]) + a1 * i[:4] + 2) // 5
+    six = np.concatenate([six, np.zeros_like(a0), np.full_like(a0, 255)], axis=-1)
+    interpolated = np.where(a0 > a1, eight, six)
+    return np.concatenate([a0, a1, interpolated], axis=-1)
+
+
+def block_alpha_range(level):
+    """Per-block (min alpha, max alpha) arrays for a DXTLevel."""
+    blocks = level.blocks
+    if level.format == 'bc1':
+        full = np.full(blocks.shape[:2], 255, dtype=np.uint8)
+        return full, full
+    if level.format == 'bc2':
+        nibbles = np.concatenate([blocks[..., :8] & 0x0F, blocks[..., :8] >> 4], axis=-1)
+        return nibbles.min(axis=-1) * 17, nibbles.max(axis=-1) * 17
+    packed = np.zeros(blocks.shape[:2], dtype=np.uint64)
+    for byte in range(6):
+        packed |= blocks[..., 2 + byte].astype(np.uint64) << np.uint64(8 * byte)
+    palette = _bc3_alpha_palette(blocks[..., 0], blocks[..., 1])
+    alpha = np.take_along_axis(palette, _indices(packed, 3).astype(np.intp), axis=-1)
+    return alpha.min(axis=-1).astype(np.uint8), alpha.max(axis=-1).astype(np.uint8)
+
+
+def to_bc3(level, opaque):
+    """BC3 blocks for the blocks of level that are fully opaque.
+
+    Returns (blocks, exact) where exact marks the blocks whose BC3 version
+    decodes to the same texels (others must be decoded and re-encoded).
+    Only opaque blocks of BC1/BC2 sources are converted, with an opaque
+    alpha half; BC3 sources are returned unchanged.
+    """
+    blocks = level.blocks
+    if level.format == 'bc3':
+        return blocks, np.ones(blocks.shape[:2], dtype=bool)
+    color = blocks[..., -8:]
+    out = np.empty(blocks.shape[:2] + (16,), dtype=np.uint8)
+    out[..., :8] = OPAQUE_ALPHA_BLOCK
+    out[..., 8:] = color
+    exact = opaque.copy()
+    if level.format == 'bc1':
+        c0 = color[..., 0].astype(np.uint16) | (color[..., 1].astype(np.uint16) << 8)
+        c1 = color[..., 2].astype(np.uint16) | (color[..., 3].astype(np.uint16) << 8)
+        # 3-color mode blocks are only exact if they never use the midpoint/black entries
+        high_bits = np.bitwise_or.reduce(color[..., 4:] & 0xAA, axis=-1)
+        exact &= (c0 > c1) | (high_bits == 0)
+    return out, exact
+
+
+def decode_blocks(fmt, blocks):
+    """Decode (N, block bytes) blocks to (N, 16, 4) RGBA texels."""
+    if texture2ddecoder is None:
+        raise RuntimeError('texture2ddecoder not installed')
+    n = len(blocks)
+    if n == 0:
+        return np.empty((0, 16, 4), dtype=np.uint8)
+    # Decode the blocks as one 4-texel-high strip
+    if fmt == 'bc2':
+        bgra = _decode_bc2(np.ascontiguousarray(blocks).tobytes(), n * 4, 4)
+    else:
+        decoder = texture2ddecoder.decode_bc3 if fmt == 'bc3' else texture2ddecoder.decode_bc1
+        bgra = decoder(np.ascontiguousarray(blocks).tobytes(), n * 4, 4)
+    texels = np.frombuffer(bgra, dtype=np.uint8).reshape(4, n, 4, 4).transpose(1, 0, 2, 3)
+    return texels.reshape(n, 16, 4)[..., [2, 1, 0, 3]]
+
+
+def _to_565(rgb):
+    rgb = np.clip(np.rint(rgb), 0, 255).astype(np.uint16)
+    return ((rgb[..., 0] * 31 + 127) // 255 << 11) | ((rgb[..., 1] * 63 + 127) // 255 << 5) | \
+        ((rgb[..., 2] * 31 + 127) // 255)
+
+
+def _from_565(c):
+    r = (c >> 11) & 31
+    g = (c >> 5) & 63
+    b = c & 31
+    return np.stack([(r << 3) | (r >> 2), (g << 2) | (g >> 4), (b << 3) | (b >> 2)],
+                    axis=-1).astype(np.int32)
+
+
+def _encode_color(rgb):
+    """(N, 16, 3) float texels -> (N, 8) BC1 4-color blocks."""
+    mean = rgb.mean(axis=1, keepdims=True)
+    centered = rgb - mean
+    covariance = np.einsum('nki,nkj->nij', centered, centered)
+    axis = np.ones((len(rgb), 3), dtype=np.float64)
+    for _ in range(8):
+        axis = np.einsum('nij,nj->ni', covariance, axis)
+        axis /= np.maximum(np.linalg.norm(axis, axis=1, keepdims=True), 1e-12)
+    t = np.einsum('nki,ni->nk', centered, axis)
+    high = mean[:, 0] + axis * t.max(axis=1, keepdims=True)
+    low = mean[:, 0] + axis * t.min(axis=1, keepdims=True)
+
+    c0 = _to_565(high)
+    c1 = _to_565(low)
+    swap = c0 < c1
+    c0, c1 = np.where(swap, c1, c0), np.where(swap, c0, c1)
+
+    e0 = _from_565(c0)
+    e1 = _from_565(c1)
+    palette = np.stack([e0, e1, (2 * e0 + e1) // 3, (e0 + 2 * e1) // 3], axis=1)
+    distance = ((rgb[:, :, None, :] - palette[:, None, :, :]) ** 2).sum(axis=-1)
+    indices = distance.argmin(axis=-1).astype(np.uint32)
+    # Equal endpoints decode in 3-color mode; index 0 is the only safe choice
+    indices[c0 == c1] = 0
+
+    packed = (indices << (2 * np.arange(16, dtype=np.uint32))).sum(axis=1, dtype=np.uint32)
+    out = np.empty((len(rgb), 8), dtype=np.uint8)
+    out[:, 0:2] = c0.astype('<u2').view(np.uint8).reshape(-1, 2)
+    out[:, 2:4] = c1.astype('<u2').view(np.uint8).reshape(-1, 2)
+    out[:, 4:8] = packed.astype('<u4').view(np.uint8).reshape(-1, 4)
+    return out
+
+
+def _encode_alpha(alpha):
+    """(N, 16) uint8 alpha -> (N, 8) BC3 alpha blocks (8-value mode)."""
+    a0 = alpha.max(axis=1)
+    a1 = alpha.min(axis=1)
+    palette = _bc3_alpha_palette(a0, a1)
+    indices = np.abs(alpha[:, :, None].astype(np.int32) - palette[:, None, :]).argmin(axis=-1)
+    indices[a0 == a1] = 0
+    packed = (indices.astype(np.uint64) << (3 * np.arange(16, dtype=np.uint64))).sum(
+        axis=1, dtype=np.uint64)
+    out = np.empty((len(alpha), 8), dtype=np.uint8)
+    out[:, 0] = a0
+    out[:, 1] = a1
+    out[:, 2:8] = packed.astype('<u8').view(np.uint8).reshape(-1, 8)[:, :6]
+    return out
+
+
+def encode_bc3(texels):
+    """Encode (N, 16, 4) RGBA texels to (N, 16) BC3 blocks."""
+    out = np.empty((len(texels), 16), dtype=np.uint8)
+    if len(texels):
+        out[:, :8] = _encode_alpha(texels[..., 3])
+        out[:, 8:] = _encode_color(texels[..., :3].astype(np.float64))
+    return out
+
+
+def bc3_to_rgba(blocks):
+    """Decode a (rows, columns, 16) BC3 block array to an HxWx4 RGBA array."""
+    rows, columns = blocks.shape[:2]
+    bgra = texture2ddecoder.decode_bc3(np.ascontiguousarray(blocks).tobytes(), columns * 4, rows * 4)
+    return np.frombuffer(bgra, dtype=np.uint8).reshape(rows * 4, columns * 4, 4)[..., [2, 1, 0, 3]]
+
+
+def rgba_to_bc3(rgba):
+    """Encode an HxWx4 RGBA array (dimensions multiples of 4) to BC3 blocks."""
+    height, width = rgba.shape[:2]
+    texels = rgba.reshape(height // 4, 4, width // 4, 4, 4).transpose(0, 2, 1, 3, 4)
+    return encode_bc3(texels.reshape(-1, 16, 4)).reshape(height // 4, width // 4, 16)
+
+
+def dds_bytes(blocks):
+    """A single-level DXT5 DDS file for a (rows, columns, 16) BC3 block array."""
+    rows, columns = blocks.shape[:2]
+    data = np.ascontiguousarray(blocks).tobytes()
+    header = struct.pack(DDS_HEADER_FORMAT, b'DDS ', 124,
+                         DDSD_CAPS_HEIGHT_WIDTH_PIXELFORMAT_LINEARSIZE, rows * 4, columns * 4,
+                         len(data), 0, 0,
+                         32, DDPF_FOURCC, b'DXT5', 0, 0, 0, 0, 0,
+                         DDSCAPS_TEXTURE, 0, 0, 0, 0)
+    return header + data
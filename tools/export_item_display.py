@@ -1,67 +1,53 @@
 #!/usr/bin/env python3
 """Parse ItemDisplayInfo.dbc properly and export to JSON."""
-import struct
 import json
 import os
 import sys
-import mpyq
+
+import numpy as np
+
+from dbc import DBCFile
+from display_info import REGIONS, write_display_info
+from mpq_vfs import get_vfs
+
+DBC_PATH = 'DBFilesClient\\ItemDisplayInfo.dbc'
 
 def extract_dbc():
     """Extract ItemDisplayInfo.dbc from MPQ archives."""
-    data_path = '/var/www/clientdata/Data/enUS'
-    mpq_files = ['patch-enUS-3.MPQ', 'patch-enUS-2.MPQ', 'patch-enUS.MPQ', 'locale-enUS.MPQ']
-    
-    for mpq_name in mpq_files:
-        path = os.path.join(data_path, mpq_name)
-        if not os.path.exists(path):
-            continue
-        try:
-            archive = mpyq.MPQArchive(path)
-            for f in archive.files:
-                name = f.decode('utf-8', 'ignore') if isinstance(f, bytes) else f
-                if 'itemdisplayinfo.dbc' in name.lower():
-                    data = archive.read_file(name)
-                    if data:
-                        print(f"Found in {mpq_name}: {name} ({len(data)} bytes)", file=sys.stderr)
-                        return data
-        except Exception as e:
-            print(f"Error with {mpq_name}: {e}", file=sys.stderr)
-    
-    return None
+    vfs = get_vfs()
+    try:
+        data = vfs.read_file(DBC_PATH)
+    except Exception as e:
+        print(f"Error reading {DBC_PATH}: {e}", file=sys.stderr)
+        return None
+    if data:
+        print(f"Found in {vfs.archive_of(DBC_PATH)}: {DBC_PATH} ({len(data)} bytes)", file=sys.stderr)
+    return data
+
+# ItemDisplayInfo.dbc fields as this exporter interprets them (see main)
+ITEM_DISPLAY_INFO_FIELDS = [
+    ('id', 'u'),
+    ('modelName', 's', 2),
+    ('modelTexture', 's', 2),
+    ('inventoryIcon', 's', 2),
+    ('geosetGroup', 'u', 2),
+    ('flags', 'u'),
+    ('spellVisualId', 'u'),
+    ('groupSoundIndex', 'u'),
+    ('helmetGeosetVis', 'u', 2),
+    ('unknown14', 'u'),
+    ('texture', 's', 8),
+]
 
 def parse_dbc(data):
     """Parse DBC file format."""
-    # Header: magic(4), record_count(4), field_count(4), record_size(4), string_block_size(4)
-    magic = data[:4]
-    if magic != b'WDBC':
-        print(f"ERROR: Not a WDBC file (magic: {magic})", file=sys.stderr)
+    try:
+        dbc = DBCFile(data, ITEM_DISPLAY_INFO_FIELDS)
+    except ValueError as e:
+        print(f"ERROR: {e}", file=sys.stderr)
         return None
-    
-    record_count, field_count, record_size, string_block_size = struct.unpack('<4I', data[4:20])
-    print(f"DBC: {record_count} records, {field_count} fields, {record_size} bytes/record, {string_block_size} string block", file=sys.stderr)
-    
-    header_size = 20
-    records_start = header_size
-    string_block_start = records_start + (record_count * record_size)
-    string_block = data[string_block_start:]
-    
-    def get_string(offset):
-        """Get null-terminated string from string block."""
-        if offset == 0:
-            return ''
-        if offset >= len(string_block):
-            return ''
-        end = string_block.index(b'\x00', offset) if b'\x00' in string_block[offset:] else len(string_block)
-        return string_block[offset:end].decode('utf-8', 'ignore')
-    
-    # Parse all records - read raw uint32 values first
-    records = []
-    for i in range(record_count):
-        offset = records_start + (i * record_size)
-        fields = struct.unpack(f'<{field_count}I', data[offset:offset + record_size])
-        records.append(fields)
-    
-    return records, get_string, field_count, record_count
+    print(f"DBC: {dbc.record_count} records, {dbc.field_count} fields, {dbc.record_size} bytes/record, {dbc.string_block_size} string block", file=sys.stderr)
+    return dbc
 
 def main():
     data = extract_dbc()
@@ -69,11 +55,10 @@ def main():
         print("ERROR: Could not find ItemDisplayInfo.dbc", file=sys.stderr)
         sys.exit(1)
     
-    result = parse_dbc(data)
-    if not result:
+    dbc = parse_dbc(data)
+    if dbc is None:
         sys.exit(1)
-    
-    records, get_string, field_count, record_count = result
+    field_count = dbc.field_count
     
     # Show first few records to verify field layout
     # According to dbc definition:
@@ -96,18 +81,18 @@ def main():
     print(f"\nField count: {field_count}", file=sys.stderr)
     print(f"\n--- Examining sample records ---", file=sys.stderr)
     
-    for rec in records:
-        if rec[0] in [233, 687, 976, 977, 1511, 220]:
-            did = rec[0]
-            print(f"\n=== DisplayId {did} ===", file=sys.stderr)
-            for i in range(field_count):
-                val = rec[i]
-                # Try to interpret as string
-                s = get_string(val) if val > 0 and val < 1000000 else ''
-                if s and len(s) > 2:
-                    print(f"  Field {i:2d}: {val:8d} -> '{s}'", file=sys.stderr)
-                else:
-                    print(f"  Field {i:2d}: {val:8d}", file=sys.stderr)
+    sample = np.isin(dbc.column('id'), [233, 687, 976, 977, 1511, 220])
+    for rec in dbc.raw[sample].tolist():
+        did = rec[0]
+        print(f"\n=== DisplayId {did} ===", file=sys.stderr)
+        for i in range(field_count):
+            val = rec[i]
+            # Try to interpret as string
+            s = dbc.string(val) if val > 0 and val < 1000000 else ''
+            if s and len(s) > 2:
+                print(f"  Field {i:2d}: {val:8d} -> '{s}'", file=sys.stderr)
+            else:
+                print(f"  Field {i:2d}: {val:8d}", file=sys.stderr)
     
     # Now build the JSON with CORRECT field mapping
     # After examining sample records, we'll determine the right mapping
@@ -126,46 +111,34 @@ def main():
     #   Field 21 = Texture[6] → LegLower  (suffix _LL)
     #   Field 22 = Texture[7] → Foot      (suffix _FO)
     # After textures: Field 23 = ItemVisual, Field 24 = ParticleColorID
-    region_names = ['armUpper', 'armLower', 'hand', 'torsoUpper', 'torsoLower', 'legUpper', 'legLower', 'foot']
-    TEXTURE_START = 15  # First texture field index
+    region_names = REGIONS
+    
+    # Only the exported columns are read; string columns are decoded in bulk
+    columns = [dbc.column(name).tolist() for name in
+               ('id', 'geosetGroup', 'flags', 'helmetGeosetVis')]
+    columns += [dbc.strings(dbc.column(name)) for name in
+                ('modelName', 'modelTexture', 'texture')]
     
     output = {}
-    for rec in records:
-        did = rec[0]
+    for did, geosets, flags, helms, models, model_textures, body_textures in zip(*columns):
         if did == 0:
             continue
         
         entry = {}
         
-        # Model names (fields 1-2)
-        model_l = get_string(rec[1]) if rec[1] > 0 else ''
-        model_r = get_string(rec[2]) if rec[2] > 0 else ''
+        # Model names (fields 1-2) and model textures (fields 3-4)
+        model_l, model_r = models
+        tex_l, tex_r = model_textures
         
-        # Model textures (fields 3-4)
-        tex_l = get_string(rec[3]) if rec[3] > 0 else ''
-        tex_r = get_string(rec[4]) if rec[4] > 0 else ''
-        
-        # Inventory icons (fields 5-6)
-        icon_l = get_string(rec[5]) if rec[5] > 0 else ''
-        icon_r = get_string(rec[6]) if rec[6] > 0 else ''
-        
-        # Geoset groups (fields 7-8)
-        geo1, geo2 = rec[7], rec[8]
-        
-        # Flags (field 9)
-        flags = rec[9]
-        
-        # Helmet geoset vis (fields 12-13)
-        helm1, helm2 = rec[12], rec[13]
+        # Geoset groups (fields 7-8), flags (field 9), helmet geoset vis (fields 12-13)
+        geo1, geo2 = geosets
+        helm1, helm2 = helms
         
         # Body textures (fields 15-22, 8 regions)
         textures = {}
-        for i in range(8):
-            field_idx = TEXTURE_START + i
-            if field_idx < field_count:
-                tex = get_string(rec[field_idx]) if rec[field_idx] > 0 else ''
-                if tex:
-                    textures[region_names[i]] = tex
+        for region, tex in zip(region_names, body_textures):
+            if tex:
+                textures[region] = tex
         
         # Only include entries with useful data
         if textures:
@@ -200,6 +173,11 @@ def main():
     print(f"\nExported {len(output)} entries to {output_path}", file=sys.stderr)
     print(f"File size: {os.path.getsize(output_path)} bytes", file=sys.stderr)
     
+    # Indexed binary copy for the character texture compositor
+    bin_path = os.path.splitext(output_path)[0] + '.bin'
+    write_display_info(output, bin_path)
+    print(f"Binary index: {bin_path} ({os.path.getsize(bin_path)} bytes)", file=sys.stderr)
+    
     # Stats
     with_tex = sum(1 for v in output.values() if 'tex' in v)
     with_model = sum(1 for v in output.values() if 'modelL' in v)
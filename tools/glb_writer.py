@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+GLB (binary glTF 2.0) writer for the AoWoW model pipeline.
+
+Buffer views are registered up front (any buffer-protocol object: bytes,
+bytearray, NumPy arrays) and receive 4-byte aligned offsets into the single
+BIN chunk as they are added. finish() then serializes the glTF JSON and lays
+out header, JSON chunk and every buffer view in one preallocated bytearray,
+so no intermediate concatenation or per-element packing takes place.
+
+Example:
+    writer = GLBWriter()
+    view = writer.add_buffer_view(positions, target=ARRAY_BUFFER, byte_stride=12)
+    acc = writer.add_accessor(view, FLOAT, len(positions), 'VEC3')
+    gltf = {..., "buffers": [], "bufferViews": writer.buffer_views,
+            "accessors": writer.accessors, ...}
+    glb = writer.finish(gltf)
+"""
+
+import json
+import struct
+
+GLB_MAGIC = 0x46546C67     # 'glTF'
+GLB_VERSION = 2
+CHUNK_JSON = 0x4E4F534A    # 'JSON'
+CHUNK_BIN = 0x004E4942     # 'BIN\0'
+
+# bufferView targets
+ARRAY_BUFFER = 34962
+ELEMENT_ARRAY_BUFFER = 34963
+
+# accessor component types
+BYTE = 5120
+UNSIGNED_BYTE = 5121
+SHORT = 5122
+UNSIGNED_SHORT = 5123
+UNSIGNED_INT = 5125
+FLOAT = 5126
+
+
+def align4(n):
+    """Round n up to the next multiple of 4 (glTF chunk/view alignment)."""
+    return (n + 3) & ~3
+
+
+class GLBWriter:
+    """Collects buffer views and accessors and encodes them as one GLB."""
+
+    def __init__(self):
+        self.buffer_views = []
+        self.accessors = []
+        self._chunks = []   # (offset in BIN chunk, memoryview)
+        self._bin_length = 0
+
+    @property
+    def bin_length(self):
+        return self._bin_length
+
+    def add_buffer_view(self, data, target=None, byte_stride=None):
+        """Register binary data as a new bufferView; returns its index."""
+        view = memoryview(data).cast('B')
+        offset = self._bin_length
+        self._chunks.append((offset, view))
+        self._bin_length = align4(offset + view.nbytes)
+
+        buffer_view = {
+            "buffer": 0,
+            "byteOffset": offset,
+            "byteLength": view.nbytes,
+        }
+        if target is not None:
+            buffer_view["target"] = target
+        if byte_stride is not None:
+            buffer_view["byteStride"] = byte_stride
+        self.buffer_views.append(buffer_view)
+        return len(self.buffer_views) - 1
+
+    def add_accessor(self, buffer_view, component_type, count, accessor_type,
+                     min_values=None, max_values=None, normalized=False, byte_offset=0):
+        """Add an accessor over a bufferView; returns its index."""
+        accessor = {
+            "bufferView": buffer_view,
+            "byteOffset": byte_offset,
+            "componentType": component_type,
+            "count": count,
+            "type": accessor_type,
+        }
+        if normalized:
+            accessor["normalized"] = True
+        if max_values is not None:
+            accessor["max"] = max_values
+        if min_values is not None:
+            accessor["min"] = min_values
+        self.accessors.append(accessor)
+        return len(self.accessors) - 1
+
+    def finish(self, gltf):
+        """Encode gltf plus all registered buffer views; returns a bytearray."""
+        gltf["buffers"] = [{"byteLength": self._bin_length}]
+
+        json_bytes = json.dumps(gltf, separators=(',', ':')).encode('utf-8')
+        json_length = align4(len(json_bytes))
+        bin_start = 12 + 8 + json_length
+        total_length = bin_start + 8 + self._bin_length
+
+        # Zero-filled, so BIN padding needs no extra writes
+        glb = bytearray(total_length)
+        struct.pack_into('<III', glb, 0, GLB_MAGIC, GLB_VERSION, total_length)
+        struct.pack_into('<II', glb, 12, json_length, CHUNK_JSON)
+        glb[20:20 + len(json_bytes)] = json_bytes
+        # JSON chunk is padded with spaces
+        glb[20 + len(json_bytes):bin_start] = b' ' * (json_length - len(json_bytes))
+        struct.pack_into('<II', glb, bin_start, self._bin_length, CHUNK_BIN)
+
+        base = bin_start + 8
+        for offset, view in self._chunks:
+            glb[base + offset:base + offset + view.nbytes] = view
+        return glb
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Image encoders for the textures written by the AoWoW tools.
+
+An encoder is named by a short spec that is also part of encoded texture
+cache variants (see png_cache), so every setting keeps its own cache entries:
+
+  Spec          | Output
+  ==============|=====================================================
+  png-optimize  | PNG, Pillow optimize=True: tries several zlib strategies;
+                | smallest and by far the slowest (the default)
+  png-level<N>  | PNG at zlib level N (0-9), single pass; png-fast = png-level1
+  webp-lossless | Lossless WebP
+  webp-q<N>     | Lossy WebP at quality N (1-100); webp = webp-q90
+
+Callers pick per use: offline GLB conversion keeps png-optimize, while the
+character texture endpoint answers with png-fast and re-encodes afterwards.
+"""
+
+import argparse
+import io
+import re
+
+from PIL import features
+
+DEFAULT_ENCODER = 'png-optimize'
+FAST_ENCODER = 'png-level1'
+
+ALIASES = {
+    'png': 'png-optimize',
+    'png-fast': 'png-level1',
+    'webp': 'webp-q90',
+}
+
+_SPEC_RE = re.compile(r'^(?:png-optimize|png-level[0-9]|webp-lossless|webp-q([0-9]{1,3}))$')
+
+
+def parse_encoder(spec):
+    """Canonical encoder spec for spec (aliases resolved); raises ValueError."""
+    spec = ALIASES.get(spec, spec)
+    match = _SPEC_RE.match(spec or '')
+    if not match or (match.group(1) and not 1 <= int(match.group(1)) <= 100):
+        raise ValueError(f"unknown image encoder {spec!r} "
+                         "(png-optimize, png-level0..9, webp-lossless, webp-q1..100)")
+    if spec.startswith('webp') and not features.check('webp'):
+        raise ValueError('Pillow was built without WebP support')
+    return spec
+
+
+def encoder_argument(value):
+    """argparse type for encoder specs."""
+    try:
+        return parse_encoder(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def encoder_extension(encoder):
+    """File extension of an encoder's output ('png' or 'webp')."""
+    return 'webp' if parse_encoder(encoder).startswith('webp') else 'png'
+
+
+def encode_image(image, encoder=DEFAULT_ENCODER):
+    """Encode a PIL image with the given encoder spec."""
+    encoder = parse_encoder(encoder)
+    buf = io.BytesIO()
+    if encoder == 'png-optimize':
+        image.save(buf, format='PNG', optimize=True)
+    elif encoder.startswith('png-level'):
+        image.save(buf, format='PNG', compress_level=int(encoder[len('png-level'):]))
+    elif encoder == 'webp-lossless':
+        image.save(buf, format='WEBP', lossless=True)
+    else:
+        image.save(buf, format='WEBP', quality=int(encoder[len('webp-q'):]))
+    return buf.getvalue()
+
+
+def is_webp(data):
+    return bytes(data[:4]) == b'RIFF' and bytes(data[8:12]) == b'WEBP'
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+KTX2 containers for DXT-compressed BLP textures.
+
+DXT BLPs already hold GPU block-compressed data (BC1/BC2/BC3) with a full mip
+chain, so a KTX2 texture is built by copying those blocks into a KTX2
+container instead of decoding to RGBA and re-encoding as PNG. A browser with
+S3TC support can then upload the blocks as-is (4-8x less GPU memory than RGBA).
+
+These are plain BCn KTX2 files, not Basis Universal (ETC1S/UASTC) payloads,
+so they cannot be referenced through KHR_texture_basisu, and glTF has no
+extension for plain BCn images. The converter writes them next to the GLB as
+an offline artifact (<name>.tex<N>.ktx2, see m2_to_glb.prepare_textures);
+the GLB does not reference them and keeps its PNG/WebP textures.
+
+Texture atlases have no BLP blocks to reuse; rgba_to_ktx2() encodes them as
+BC3 with a box-filtered mip chain (see dxt.rgba_to_bc3).
+
+KTX2 layout (little-endian):
+  Offset | Size       | Field
+  =======|============|==========================================
+  0      | 12         | identifier «KTX 20»\\r\\n\\x1A\\n
+  12     | 36         | vkFormat, typeSize, pixelWidth, pixelHeight, pixelDepth,
+         |            | layerCount, faceCount, levelCount, supercompressionScheme
+  48     | 32         | DFD offset/length, KVD offset/length, SGD offset/length (u64)
+  80     | 24 * levels| level index: byteOffset, byteLength, uncompressedByteLength (u64)
+  ...    | ...        | data format descriptor, key/value data
+  ...    | ...        | mip data, smallest level first, block-size aligned
+
+Only block data is written (no Basis Universal supercompression); palette and
+ARGB BLPs have no block data to reuse and are left to the PNG path.
+"""
+
+import struct
+
+import numpy as np
+from PIL import Image
+
+from blp import read_blp_header
+from dxt import rgba_to_bc3
+
+KTX2_IDENTIFIER = b'\xabKTX 20\xbb\r\n\x1a\n'
+KTX2_HEADER_FORMAT = '<9I'
+KTX2_INDEX_FORMAT = '<4I2Q'
+KTX2_LEVEL_FORMAT = '<3Q'
+KTX2_WRITER = 'AoWoW M2 Converter'
+
+# Khronos data format descriptor values
+KHR_DF_MODEL_BC1A = 128
+KHR_DF_MODEL_BC2 = 129
+KHR_DF_MODEL_BC3 = 130
+KHR_DF_CHANNEL_COLOR = 0
+KHR_DF_CHANNEL_BC1A_ALPHAPRESENT = 1
+KHR_DF_CHANNEL_ALPHA = 15
+KHR_DF_SAMPLE_DATATYPE_LINEAR = 0x10
+KHR_DF_PRIMARIES_BT709 = 1
+KHR_DF_TRANSFER_SRGB = 2
+
+# BLP alpha encoding -> (vkFormat, DFD color model, block bytes, [(channel, bit offset)])
+# Base color textures are sRGB; alpha samples are always linear.
+BC1_RGB = (132, KHR_DF_MODEL_BC1A, 8, [(KHR_DF_CHANNEL_COLOR, 0)])            # BC1_RGB_SRGB_BLOCK
+BC1_RGBA = (134, KHR_DF_MODEL_BC1A, 8, [(KHR_DF_CHANNEL_BC1A_ALPHAPRESENT, 0)])  # BC1_RGBA_SRGB_BLOCK
+BC2 = (136, KHR_DF_MODEL_BC2, 16, [(KHR_DF_CHANNEL_ALPHA, 0), (KHR_DF_CHANNEL_COLOR, 64)])
+BC3 = (138, KHR_DF_MODEL_BC3, 16, [(KHR_DF_CHANNEL_ALPHA, 0), (KHR_DF_CHANNEL_COLOR, 64)])
+
+
+def is_ktx2(data):
+    return bytes(data[:12]) == KTX2_IDENTIFIER
+
+
+def _block_format(header):
+    if header.alpha_encoding == 1:
+        return BC2
+    if header.alpha_encoding == 7:
+        return BC3
+    if header.alpha_encoding == 0:
+        return BC1_RGBA if header.alpha_depth else BC1_RGB
+    return None
+
+
+def _data_format_descriptor(color_model, block_bytes, samples):
+    """Basic DFD block for a 4x4 block-compressed sRGB format."""
+    block_size = 24 + 16 * len(samples)
+    words = [
+        0,                                                   # vendorId, descriptorType
+        2 | (block_size << 16),                              # versionNumber, descriptorBlockSize
+        color_model | (KHR_DF_PRIMARIES_BT709 << 8) | (KHR_DF_TRANSFER_SRGB << 16),
+        3 | (3 << 8),                                        # texelBlockDimension 4x4
+        block_bytes,                                         # bytesPlane0
+        0,
+    ]
+    for channel, bit_offset in samples:
+        if channel == KHR_DF_CHANNEL_ALPHA:
+            channel |= KHR_DF_SAMPLE_DATATYPE_LINEAR
+        words += [bit_offset | (63 << 16) | (channel << 24), 0, 0, 0xFFFFFFFF]
+    return struct.pack(f'<{1 + len(words)}I', 4 + block_size, *words)
+
+
+def _key_value_data(key, value):
+    entry = key.encode('utf-8') + b'\x00' + value.encode('utf-8') + b'\x00'
+    data = struct.pack('<I', len(entry)) + entry
+    return data + b'\x00' * (-len(data) % 4)
+
+
+def blp_to_ktx2(blp_data, max_size=None):
+    """Repackage the DXT mips of a BLP2 as KTX2 bytes.
+
+    Mips larger than max_size in either dimension are dropped, so the base
+    level is the first BLP mip that fits. Returns None if the BLP is not DXT
+    encoded, the base level is not a multiple of 4 texels, or the mip chain
+    is incomplete (WebGL cannot sample partial chains).
+    """
+    header = read_blp_header(blp_data)
+    if header is None or header.encoding != 2:
+        return None
+    block_format = _block_format(header)
+    if block_format is None:
+        return None
+    block_bytes = block_format[2]
+
+    levels = []
+    for i in range(16):
+        width, height = max(1, header.width >> i), max(1, header.height >> i)
+        offset, size = header.mip_offsets[i], header.mip_sizes[i]
+        level_bytes = ((width + 3) // 4) * ((height + 3) // 4) * block_bytes
+        if offset == 0 or size < level_bytes or offset + level_bytes > len(blp_data):
+            break
+        if max_size is None or (width <= max_size and height <= max_size):
+            levels.append((width, height, blp_data[offset:offset + level_bytes]))
+        if width == 1 and height == 1:
+            break
+
+    if not levels or levels[-1][:2] != (1, 1):
+        return None
+    if levels[0][0] % 4 or levels[0][1] % 4:
+        return None
+    return _ktx2_bytes(block_format, levels)
+
+
+def rgba_to_ktx2(image):
+    """BC3 KTX2 bytes with a full mip chain for a PIL image.
+
+    Mips are box-filtered and levels smaller than a block are edge-padded to
+    4x4 texels before encoding. Returns None unless both dimensions of the
+    image are multiples of 4.
+    """
+    width, height = image.size
+    if width % 4 or height % 4:
+        return None
+    image = image.convert('RGBA')
+    levels = []
+    while True:
+        pixels = np.asarray(image)
+        pixels = np.pad(pixels, ((0, -height % 4), (0, -width % 4), (0, 0)), mode='edge')
+        levels.append((width, height, rgba_to_bc3(pixels).tobytes()))
+        if width == 1 and height == 1:
+            break
+        width, height = max(1, width // 2), max(1, height // 2)
+        image = image.resize((width, height), Image.BOX)
+    return _ktx2_bytes(BC3, levels)
+
+
+def _ktx2_bytes(block_format, levels):
+    """KTX2 file for [(width, height, block data)] mip levels, largest first."""
+    vk_format, color_model, block_bytes, samples = block_format
+    base_width, base_height = levels[0][0], levels[0][1]
+    dfd = _data_format_descriptor(color_model, block_bytes, samples)
+    kvd = _key_value_data('KTXwriter', KTX2_WRITER)
+    level_index_start = len(KTX2_IDENTIFIER) + struct.calcsize(KTX2_HEADER_FORMAT) + \
+        struct.calcsize(KTX2_INDEX_FORMAT)
+    dfd_offset = level_index_start + len(levels) * struct.calcsize(KTX2_LEVEL_FORMAT)
+    kvd_offset = dfd_offset + len(dfd)
+
+    # Mip data is stored smallest level first, each level aligned to the block size
+    position = kvd_offset + len(kvd)
+    level_offsets = [0] * len(levels)
+    for i in reversed(range(len(levels))):
+        position += -position % block_bytes
+        level_offsets[i] = position
+        position += len(levels[i][2])
+
+    out = bytearray(position)
+    struct.pack_into('12s', out, 0, KTX2_IDENTIFIER)
+    struct.pack_into(KTX2_HEADER_FORMAT, out, 12, vk_format, 1, base_width, base_height,
+                     0, 0, 1, len(levels), 0)
+    struct.pack_into(KTX2_INDEX_FORMAT, out, 48, dfd_offset, len(dfd), kvd_offset, len(kvd), 0, 0)
+    for i, (_, _, data) in enumerate(levels):
+        struct.pack_into(KTX2_LEVEL_FORMAT, out, level_index_start + i * 24,
+                         level_offsets[i], len(data), len(data))
+        out[level_offsets[i]:level_offsets[i] + len(data)] = data
+    out[dfd_offset:dfd_offset + len(dfd)] = dfd
+    out[kvd_offset:kvd_offset + len(kvd)] = kvd
+    return bytes(out)
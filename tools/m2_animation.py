@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+"""
+Skeleton and animation export for M2 models.
+
+load_skeleton() reads the bone hierarchy of a parsed M2Model and the key
+tracks of a chosen subset of its animation sequences (by AnimationData name,
+e.g. Stand, Walk, Run), reading keys from the external .anim file for
+sequences that do not keep them in the .m2. Keys that linear interpolation
+of their neighbours reproduces within a tolerance are dropped, so tracks
+baked at a fixed rate shrink to their actual motion.
+
+add_skeleton() then writes the skeleton into a glTF document as one joint
+node per bone, a skin and one glTF animation per sequence, all in the same
+GLB as the mesh.
+
+Bones are placed at their pivots: an M2 bone transform
+  parent * T(pivot) * T(t) * R(r) * S(s) * T(-pivot)
+becomes a joint node with translation (pivot - parent pivot + t), rotation r
+and scale s, and an inverse bind matrix of T(-pivot).
+
+Example:
+    skeleton = load_skeleton(mpq_mgr, model, model_path, ['Stand', 'Walk'])
+    skin = add_skeleton(writer, gltf, skeleton)
+"""
+
+import struct
+from collections import namedtuple
+
+import numpy as np
+
+from build_manifest import content_hash
+from dbc import DBCFile
+from glb_writer import FLOAT
+
+ANIMATION_DBC_PATH = 'DBFilesClient\\AnimationData.dbc'
+
+# Fallback names for the most common sequences (AnimationData IDs) if the
+# DBC cannot be read
+ANIMATION_NAMES = {
+    0: 'Stand', 1: 'Death', 2: 'Spell', 3: 'Stop', 4: 'Walk', 5: 'Run', 6: 'Dead',
+    7: 'Rise', 8: 'StandWound', 9: 'CombatWound', 10: 'CombatCritical',
+    11: 'ShuffleLeft', 12: 'ShuffleRight', 13: 'Walkbackwards', 14: 'Stun',
+    15: 'HandsClosed', 16: 'AttackUnarmed', 17: 'Attack1H', 18: 'Attack2H',
+    19: 'Attack2HL', 20: 'ParryUnarmed', 21: 'Parry1H', 22: 'Parry2H', 23: 'Parry2HL',
+    24: 'ShieldBlock', 25: 'ReadyUnarmed', 26: 'Ready1H', 27: 'Ready2H', 28: 'Ready2HL',
+    29: 'ReadyBow', 30: 'Dodge', 31: 'SpellPrecast', 32: 'SpellCast',
+    33: 'SpellCastArea', 34: 'NPCWelcome', 35: 'NPCGoodbye', 36: 'Block',
+    37: 'JumpStart', 38: 'Jump', 39: 'JumpEnd', 40: 'Fall', 41: 'SwimIdle', 42: 'Swim',
+    43: 'SwimLeft', 44: 'SwimRight', 45: 'SwimBackwards',
+}
+
+# Sequences exported when none are named explicitly
+DEFAULT_ANIMATIONS = ['Stand', 'Walk', 'Run']
+
+# Decimation tolerances (model units; quaternion components; scale factor)
+TRANSLATION_TOLERANCE = 1e-3
+ROTATION_TOLERANCE = 1e-3
+SCALE_TOLERANCE = 1e-3
+
+SEQUENCE_EMBEDDED = 0x20
+SEQUENCE_ALIAS = 0x40
+
+# interpolation type 0 (none) holds values until the next key
+GLTF_INTERPOLATION = {0: 'STEP', 1: 'LINEAR', 2: 'LINEAR', 3: 'LINEAR'}
+
+Bone = namedtuple('Bone', ['parent', 'pivot'])
+# One bone property over one sequence: path is 'translation', 'rotation' or
+# 'scale'; times in seconds; values in M2 space (translation relative to pivot)
+Channel = namedtuple('Channel', ['bone', 'path', 'interpolation', 'times', 'values'])
+Animation = namedtuple('Animation', ['name', 'duration', 'channels'])
+Skeleton = namedtuple('Skeleton', ['bones', 'animations'])
+
+# M2Track value layouts: (dtype, components, rest value, tolerance)
+TRACK_FORMATS = {
+    'translation': ('<f4', 3, (0.0, 0.0, 0.0), TRANSLATION_TOLERANCE),
+    'rotation': ('<i2', 4, (0.0, 0.0, 0.0, 1.0), ROTATION_TOLERANCE),
+    'scale': ('<f4', 3, (1.0, 1.0, 1.0), SCALE_TOLERANCE),
+}
+
+
+def read_animation_names(mpq_mgr):
+    """{AnimationData ID: name} from the client DBC, or ANIMATION_NAMES."""
+    data = mpq_mgr.read_file(ANIMATION_DBC_PATH)
+    if data:
+        try:
+            dbc = DBCFile(data, [('id', 'u'), ('name', 's')])
+            return dict(zip(dbc.column('id').tolist(), dbc.strings(dbc.column('name'))))
+        except ValueError as e:
+            print(f"    Warning: {ANIMATION_DBC_PATH}: {e}")
+    return dict(ANIMATION_NAMES)
+
+
+def select_sequences(model, names, animation_names):
+    """[(sequence index, name)] for the first variation of each named animation.
+
+    Names are matched case-insensitively; names the model lacks are skipped.
+    """
+    wanted = {name.lower(): name for name in names}
+    selected = {}
+    for index, sequence in enumerate(model.sequences):
+        name = animation_names.get(sequence['id'], f"Anim{sequence['id']}")
+        if name.lower() in wanted and name.lower() not in selected:
+            selected[name.lower()] = (index, name)
+    return [selected[key] for key in wanted if key in selected]
+
+
+def _decode_rotations(values):
+    """M2CompQuat int16 (x, y, z, w) -> float quaternions."""
+    values = values.astype(np.float32)
+    return np.where(values < 0, values + 32768, values - 32767) / 32767
+
+
+def decimate_keys(times, values, tolerance):
+    """Drop keys reproduced by linearly interpolating the kept neighbours.
+
+    Returns (times, values); constant tracks reduce to a single key.
+    """
+    if len(times) > 1 and np.abs(values - values[0]).max() <= tolerance:
+        return times[:1], values[:1]
+    if len(times) <= 2:
+        return times, values
+
+    keep = [0]
+    anchor = 0
+    for i in range(1, len(times) - 1):
+        # Can the segment anchor -> i + 1 replace every key in between?
+        span = times[i + 1] - times[anchor]
+        fraction = (times[anchor + 1:i + 1] - times[anchor]) / span
+        interpolated = values[anchor] + (values[i + 1] - values[anchor]) * fraction[:, None]
+        if np.abs(interpolated - values[anchor + 1:i + 1]).max() > tolerance:
+            keep.append(i)
+            anchor = i
+    keep.append(len(times) - 1)
+    return times[keep], values[keep]
+
+
+def _track_keys(model, anim_data, track, sequence_index, path):
+    """(times in seconds, values) of one bone track for one sequence, or None."""
+    if track['globalSequence'] >= 0:
+        # Global loops run independently of sequences; left at the bind pose
+        return None
+    dtype, components, _, tolerance = TRACK_FORMATS[path]
+    m2_data = model.m2_data
+    source = anim_data if anim_data is not None else m2_data
+
+    ts_count, ts_ofs = track['timestamps']
+    val_count, val_ofs = track['values']
+    if sequence_index >= ts_count or sequence_index >= val_count:
+        return None
+    n_times, ofs_times = struct.unpack_from('<II', m2_data, ts_ofs + sequence_index * 8)
+    n_values, ofs_values = struct.unpack_from('<II', m2_data, val_ofs + sequence_index * 8)
+    n = min(n_times, n_values)
+    if n == 0:
+        return None
+
+    # Bezier/hermite keys are (value, in tangent, out tangent); tangents are dropped
+    stride = 3 if track['interpolation'] in (2, 3) else 1
+    try:
+        times = np.frombuffer(source, dtype='<u4', count=n, offset=ofs_times)
+        values = np.frombuffer(source, dtype=dtype, count=n * stride * components,
+                               offset=ofs_values).reshape(n, stride, components)[:, 0]
+    except ValueError:
+        return None
+
+    # glTF needs strictly increasing times
+    increasing = np.concatenate(([True], np.diff(times.astype(np.int64)) > 0))
+    times = times[increasing].astype(np.float32) / 1000
+    values = values[increasing]
+    if path == 'rotation':
+        values = _decode_rotations(values)
+        # Keep consecutive quaternions in the same hemisphere
+        flips = np.cumsum(np.einsum('ij,ij->i', values[1:], values[:-1]) < 0) % 2
+        values[1:][flips == 1] *= -1
+    else:
+        values = values.astype(np.float32)
+    return decimate_keys(times, values, tolerance)
+
+
+def load_skeleton(mpq_mgr, model, model_path, names, inputs=None):
+    """Skeleton of model with the named animation sequences (see select_sequences).
+
+    .anim files read are added to inputs ({MPQ path: content hash}) if given.
+    Returns None if the model has no bones.
+    """
+    if not model.bones:
+        return None
+    bones = []
+    for bone in model.bones:
+        parent = bone['parent'] if 0 <= bone['parent'] < len(model.bones) else -1
+        bones.append(Bone(parent, np.array(bone['pivot'], dtype=np.float32)))
+
+    animations = []
+    for index, name in select_sequences(model, names, mpq_mgr.animation_names()):
+        sequence = model.sequences[index]
+        # Aliases share the keys of another sequence
+        source_index = index
+        for _ in range(len(model.sequences)):
+            if not model.sequences[source_index]['flags'] & SEQUENCE_ALIAS:
+                break
+            source_index = model.sequences[source_index]['aliasNext']
+        source = model.sequences[source_index]
+
+        anim_data = None
+        if not source['flags'] & SEQUENCE_EMBEDDED:
+            anim_path = f"{model_path}{source['id']:04d}-{source['variation']:02d}.anim"
+            anim_data = mpq_mgr.read_file(anim_path)
+            if not anim_data:
+                print(f"    Warning: {name}: {anim_path} not found")
+                continue
+            if inputs is not None:
+                inputs[anim_path] = content_hash(anim_data)
+
+        channels = []
+        for bone_index, bone in enumerate(model.bones):
+            for path in ('translation', 'rotation', 'scale'):
+                keys = _track_keys(model, anim_data, bone[path], source_index, path)
+                if keys is None:
+                    continue
+                times, values = keys
+                rest = TRACK_FORMATS[path][2]
+                if len(times) == 1 and np.allclose(values[0], rest, atol=TRACK_FORMATS[path][3]):
+                    continue
+                channels.append(Channel(bone_index, path,
+                                        GLTF_INTERPOLATION.get(bone[path]['interpolation'], 'LINEAR'),
+                                        times, values))
+        animations.append(Animation(name, sequence['duration'] / 1000, channels))
+    return Skeleton(bones, animations)
+
+
+def _to_y_up(values, path):
+    """Rotate M2 (Z-up) vectors/quaternions to glTF Y-up: (x, y, z) -> (x, z, -y)."""
+    if path == 'scale':
+        return values[:, [0, 2, 1]]
+    converted = values.copy()
+    converted[:, 1] = values[:, 2]
+    converted[:, 2] = -values[:, 1]
+    return converted
+
+
+def add_skeleton(writer, gltf, skeleton, z_up_to_y_up=True, mesh_transform=None):
+    """Append joint nodes, a skin and animations for skeleton to gltf.
+
+    Root joints are added to scene 0. mesh_transform is an optional 4x4
+    matrix from stored vertex positions to model space (e.g. quantization),
+    folded into the inverse bind matrices. Returns the skin index.
+    """
+    convert = _to_y_up if z_up_to_y_up else (lambda values, path: values)
+    pivots = convert(np.array([bone.pivot for bone in skeleton.bones], dtype=np.float32),
+                     'translation')
+    parent_pivots = np.array([pivots[bone.parent] if bone.parent >= 0 else (0, 0, 0)
+                              for bone in skeleton.bones], dtype=np.float32)
+    offsets = pivots - parent_pivots
+
+    first_node = len(gltf["nodes"])
+    nodes = [{"name": f"bone{i}"} for i in range(len(skeleton.bones))]
+    for i, (node, offset) in enumerate(zip(nodes, offsets.tolist())):
+        if any(offset):
+            node["translation"] = offset
+        parent = skeleton.bones[i].parent
+        if parent >= 0:
+            nodes[parent].setdefault("children", []).append(first_node + i)
+        else:
+            gltf["scenes"][0]["nodes"].append(first_node + i)
+    gltf["nodes"].extend(nodes)
+
+    # Inverse bind matrices: T(-pivot) (after mesh_transform), column-major
+    bind = np.tile(np.eye(4, dtype=np.float64), (len(pivots), 1, 1))
+    bind[:, :3, 3] = -pivots
+    if mesh_transform is not None:
+        bind = bind @ np.asarray(mesh_transform, dtype=np.float64)
+    ibm = np.ascontiguousarray(bind.transpose(0, 2, 1), dtype='<f4')
+    ibm_view = writer.add_buffer_view(ibm)
+    ibm_acc = writer.add_accessor(ibm_view, FLOAT, len(pivots), "MAT4")
+    gltf.setdefault("skins", []).append({
+        "joints": list(range(first_node, first_node + len(nodes))),
+        "inverseBindMatrices": ibm_acc,
+    })
+
+    # All key data goes into one buffer view; identical time lists share an accessor
+    arrays = []
+    size = 0
+    accessor_specs = []  # (byte offset, count, type, min, max)
+    inputs = {}
+
+    def add_array(array, accessor_type, bounds=False):
+        nonlocal size
+        array = np.ascontiguousarray(array, dtype='<f4')
+        arrays.append(array)
+        offset = size
+        size += array.nbytes
+        flat = array.reshape(len(array), -1)
+        accessor_specs.append((offset, len(array), accessor_type,
+                               flat.min(axis=0).tolist() if bounds else None,
+                               flat.max(axis=0).tolist() if bounds else None))
+        return len(accessor_specs) - 1
+
+    gltf_animations = []
+    for animation in skeleton.animations:
+        samplers = []
+        channels = []
+        for channel in animation.channels:
+            key = channel.times.tobytes()
+            if key not in inputs:
+                inputs[key] = add_array(channel.times, "SCALAR", bounds=True)
+            values = convert(channel.values, channel.path)
+            if channel.path == 'translation':
+                values = values + offsets[channel.bone]
+            output = add_array(values, "VEC4" if channel.path == 'rotation' else "VEC3")
+            samplers.append({"input": inputs[key], "output": output,
+                             "interpolation": channel.interpolation})
+            channels.append({"sampler": len(samplers) - 1,
+                             "target": {"node": first_node + channel.bone, "path": channel.path}})
+        if channels:
+            gltf_animations.append({"name": animation.name, "samplers": samplers,
+                                    "channels": channels})
+
+    if gltf_animations:
+        view = writer.add_buffer_view(np.concatenate([a.ravel() for a in arrays]))
+        accessors = [writer.add_accessor(view, FLOAT, count, accessor_type, min_values=low,
+                                         max_values=high, byte_offset=offset)
+                     for offset, count, accessor_type, low, high in accessor_specs]
+        for animation in gltf_animations:
+            for sampler in animation["samplers"]:
+                sampler["input"] = accessors[sampler["input"]]
+                sampler["output"] = accessors[sampler["output"]]
+        gltf["animations"] = gltf_animations
+    return len(gltf["skins"]) - 1
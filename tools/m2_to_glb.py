@@ -5,47 +5,79 @@ Converts WoW M2 model files + BLP textures from MPQ archives into textured GLB f
 
 Supports:
 - M2 format version 264 (WotLK/3.3.5a)
-- .skin files (LOD 0) for mesh data
+- .skin files (LOD 0) for mesh data, plus the reduced LOD 1-3 skins on request
 - BLP2 textures (palette-based and DXT compressed)
 - Generates GLB with POSITION, NORMAL, TEXCOORD_0, and embedded PNG textures
+  (one primitive per skin submesh, optionally sharing one texture atlas)
+- Optionally writes BCn KTX2 files next to the GLB (<name>.tex<N>.ktx2) as an
+  offline artifact: DXT textures from the BLP's own compressed mips, atlases
+  encoded as BC3; the GLB does not reference them and keeps its PNGs
+- Optionally quantizes vertex attributes (KHR_mesh_quantization) and reorders
+  indices/vertices for vertex cache and fetch locality
+- Optionally exports the skeleton as a glTF skin with a chosen subset of
+  animation sequences (see m2_animation)
+- Selectable image encoder for embedded textures (see image_encoding; WebP
+  textures use EXT_texture_webp)
 
 Usage:
     python3 m2_to_glb.py                        # Convert all character models
     python3 m2_to_glb.py --type items            # Convert item models
     python3 m2_to_glb.py --single "Character\\Human\\Male\\HumanMale"  # Single model
+    python3 m2_to_glb.py --type items --lods     # Also export <name>.lod<N>.glb meshes
+    python3 m2_to_glb.py --type items --atlas    # Pack submesh textures into one atlas
+    python3 m2_to_glb.py --type items --ktx2     # Also write BCn KTX2 textures where possible
+    python3 m2_to_glb.py --type items --quantize # Quantized, cache-optimized meshes
+    python3 m2_to_glb.py --animations Stand,Walk # Skinned characters with two animations
+    python3 m2_to_glb.py --image-encoder png-fast # Quicker, larger PNG textures
 """
 
 import struct
 import json
+import glob
 import os
 import sys
-import io
 import math
 import traceback
 from pathlib import Path
 
 # Third-party
-import mpyq
+import numpy as np
 from PIL import Image
-import texture2ddecoder
+
+from build_manifest import BuildManifest, InputRecorder, content_hash
+from ktx2 import blp_to_ktx2, rgba_to_ktx2
+from image_encoding import DEFAULT_ENCODER, encode_image, encoder_extension, is_webp
+from glb_writer import (
+    GLBWriter, ARRAY_BUFFER, ELEMENT_ARRAY_BUFFER, FLOAT, SHORT, UNSIGNED_BYTE, UNSIGNED_INT,
+    UNSIGNED_SHORT,
+)
+from m2_animation import add_skeleton, load_skeleton, read_animation_names
+from mesh_optimize import optimize_vertex_cache, optimize_vertex_fetch
+from mpq_vfs import CLIENT_DATA, get_vfs
+from png_cache import EncodedTextureCache, format_encoded_stats
+from texture_cache import DecodedTextureCache, format_stats
 
 # ============================================================================
 # Configuration
 # ============================================================================
 
-CLIENT_DATA = '/var/www/clientdata/Data'
 OUTPUT_BASE = '/var/www/aowow/static/models'
 
-# MPQ files in priority order (later = higher priority for overrides)
-MPQ_FILES = [
-    'common.MPQ',
-    'common-2.MPQ',
-    'expansion.MPQ',
-    'lichking.MPQ',
-    'patch.MPQ',
-    'patch-2.MPQ',
-    'patch-3.MPQ',
-]
+# Textures larger than this are downscaled before embedding
+MAX_TEXTURE_SIZE = 512
+
+# Texture atlases (--atlas) are power-of-two sized up to this; textures are
+# downscaled further if they do not fit. Each packed texture is surrounded by
+# ATLAS_PADDING pixels of its own edge colour to keep filtering from bleeding.
+MAX_ATLAS_SIZE = 1024
+ATLAS_PADDING = 4
+
+# Highest .skin LOD exported by --lods (the client ships 00.skin .. 03.skin)
+MAX_LOD = 3
+
+# Bump whenever GLB output changes for identical inputs; recorded in build
+# manifests so incremental runs reconvert everything after a converter change
+CONVERTER_VERSION = 2
 
 # Character race/gender mappings
 CHARACTER_MODELS = {
@@ -77,179 +109,94 @@ CHARACTER_MODELS = {
 # ============================================================================
 
 class MPQManager:
-    """Manages multiple MPQ archives with proper priority/overlay."""
+    """Model conversion view of the shared MPQ filesystem plus texture caches."""
 
-    def __init__(self, data_path):
+    def __init__(self, data_path=CLIENT_DATA):
         self.data_path = data_path
-        self.archives = []
-        self.file_index = {}  # lowercase path -> (archive_idx, original_path)
-
-        for mpq_name in MPQ_FILES:
-            mpq_path = os.path.join(data_path, mpq_name)
-            if os.path.exists(mpq_path):
-                try:
-                    archive = mpyq.MPQArchive(mpq_path)
-                    idx = len(self.archives)
-                    self.archives.append((mpq_name, archive))
-
-                    # Index all files (later archives override earlier ones)
-                    if hasattr(archive, 'files') and archive.files:
-                        for f in archive.files:
-                            if isinstance(f, bytes):
-                                f_str = f.decode('utf-8', 'ignore')
-                            else:
-                                f_str = f
-                            self.file_index[f_str.lower().replace('/', '\\')] = (idx, f_str)
-                    print(f"  Loaded {mpq_name}")
-                except Exception as e:
-                    print(f"  Warning: Could not load {mpq_name}: {e}")
+        # Decoded BLPs shared by every model converted in this process
+        self.texture_cache = DecodedTextureCache()
+        self.png_cache = EncodedTextureCache()
+        self._animation_names = None
+
+        self.vfs = get_vfs(data_path)
+        self.archives = self.vfs.archives
+        for mpq_name, _ in self.archives:
+            print(f"  Loaded {mpq_name}")
 
     def read_file(self, path):
         """Read a file from MPQ archives (highest priority wins)."""
-        key = path.lower().replace('/', '\\')
-        if key in self.file_index:
-            idx, orig_path = self.file_index[key]
-            mpq_name, archive = self.archives[idx]
-            data = archive.read_file(orig_path)
-            return data
-        return None
-
-    def find_files(self, pattern_lower):
-        """Find files matching a lowercase substring pattern."""
-        results = []
-        for key, (idx, orig_path) in self.file_index.items():
-            if pattern_lower in key:
-                results.append(orig_path)
-        return results
-
-
-# ============================================================================
-# BLP Texture Decoder
-# ============================================================================
-
-def decode_blp(blp_data):
-    """Decode a BLP2 texture file to a PIL Image."""
-    if not blp_data or len(blp_data) < 148:
-        return None
-
-    magic = blp_data[:4]
-    if magic != b'BLP2':
-        print(f"    Warning: Not a BLP2 file (magic={magic})")
-        return None
-
-    encoding = blp_data[8]
-    alpha_depth = blp_data[9]
-    alpha_encoding = blp_data[10]
-    width, height = struct.unpack_from('<II', blp_data, 12)
-
-    if width == 0 or height == 0 or width > 4096 or height > 4096:
-        print(f"    Warning: Invalid BLP dimensions {width}x{height}")
-        return None
-
-    mip_offsets = struct.unpack_from('<16I', blp_data, 20)
-    mip_sizes = struct.unpack_from('<16I', blp_data, 84)
-
-    if mip_offsets[0] == 0 or mip_sizes[0] == 0:
-        return None
-
-    mip0_data = blp_data[mip_offsets[0]:mip_offsets[0] + mip_sizes[0]]
+        return self.vfs.read_file(path)
 
-    if encoding == 2:
-        # DXT compressed
-        try:
-            if alpha_encoding == 0:
-                decoded = texture2ddecoder.decode_bc1(mip0_data, width, height)
-            elif alpha_encoding == 1:
-                decoded = texture2ddecoder.decode_bc2(mip0_data, width, height)
-            elif alpha_encoding == 7:
-                decoded = texture2ddecoder.decode_bc3(mip0_data, width, height)
-            else:
-                # Try DXT1 as fallback
-                decoded = texture2ddecoder.decode_bc1(mip0_data, width, height)
+    def load_texture(self, path):
+        """Decoded texture for a BLP path as a CachedTexture, or None if missing."""
+        return self.texture_cache.get(self, path)
 
-            img = Image.frombytes('RGBA', (width, height), decoded, 'raw', 'BGRA')
-            return img
-        except Exception as e:
-            print(f"    Warning: DXT decode failed: {e}")
-            return None
+    def animation_names(self):
+        """{AnimationData ID: name}, read once from the client DBC."""
+        if self._animation_names is None:
+            self._animation_names = read_animation_names(self)
+        return self._animation_names
 
-    elif encoding == 1:
-        # Palette-based (uncompressed)
-        try:
-            palette = struct.unpack_from('<256I', blp_data, 148)
-            pixels = bytearray(width * height * 4)
-            pixel_count = width * height
-
-            for i in range(pixel_count):
-                if i < len(mip0_data):
-                    idx = mip0_data[i]
-                    color = palette[idx]
-                    b = (color >> 0) & 0xFF
-                    g = (color >> 8) & 0xFF
-                    r = (color >> 16) & 0xFF
-
-                    if alpha_depth == 0:
-                        a = 255
-                    elif alpha_depth == 1:
-                        alpha_offset = pixel_count + (i // 8)
-                        if alpha_offset < len(mip0_data):
-                            a = 255 if (mip0_data[alpha_offset] >> (i % 8)) & 1 else 0
-                        else:
-                            a = 255
-                    elif alpha_depth == 4:
-                        alpha_offset = pixel_count + (i // 2)
-                        if alpha_offset < len(mip0_data):
-                            if i % 2 == 0:
-                                a = (mip0_data[alpha_offset] & 0x0F) * 17
-                            else:
-                                a = ((mip0_data[alpha_offset] >> 4) & 0x0F) * 17
-                        else:
-                            a = 255
-                    elif alpha_depth == 8:
-                        alpha_offset = pixel_count + i
-                        if alpha_offset < len(mip0_data):
-                            a = mip0_data[alpha_offset]
-                        else:
-                            a = 255
-                    else:
-                        a = 255
-
-                    pixels[i * 4:i * 4 + 4] = bytes([r, g, b, a])
-
-            img = Image.frombytes('RGBA', (width, height), bytes(pixels))
-            return img
-        except Exception as e:
-            print(f"    Warning: Palette decode failed: {e}")
-            return None
+    def find_files(self, directory, prefix='', extension=None, recursive=False):
+        """Files in directory whose name starts with prefix (case-insensitive).
 
-    elif encoding == 3:
-        # Uncompressed ARGB
-        try:
-            img = Image.frombytes('RGBA', (width, height), mip0_data)
-            return img
-        except Exception as e:
-            print(f"    Warning: ARGB decode failed: {e}")
-            return None
-
-    return None
+        Answered from the sorted MPQ index, so only the matching range is read.
+        """
+        return self.vfs.list_dir(directory, prefix, extension, recursive)
 
 
 # ============================================================================
 # M2 Parser
 # ============================================================================
 
+# M2 vertex, 48 bytes:
+# pos(12) + boneWeights(4) + boneIndices(4) + normal(12) + uv1(8) + uv2(8)
+M2_VERTEX_DTYPE = np.dtype([
+    ('pos', '<f4', 3),
+    ('bone_weights', 'u1', 4),
+    ('bone_indices', 'u1', 4),
+    ('normal', '<f4', 3),
+    ('uv', '<f4', 2),
+    ('uv2', '<f4', 2),
+])
+
+
+# M2Sequence, 64 bytes:
+# id, variationIndex, duration, moveSpeed, flags, frequency, padding, replay min/max,
+# blendTime, bounds (6f) + radius, variationNext, aliasNext
+M2_SEQUENCE_FORMAT = '<HHIfIhHIII7fhH'
+
+# M2CompBone, 88 bytes:
+# keyBoneId, flags, parentBone, submeshId, boneNameCRC,
+# translation/rotation/scale M2Tracks (interpolation, globalSequence,
+# timestamps count/offset, values count/offset), pivot
+M2_BONE_FORMAT = '<iIhHI' + 'Hh4I' * 3 + '3f'
+
+
+def _parse_track(vals):
+    """M2Track header fields as a dict (arrays hold one sub-array per sequence)."""
+    return {
+        'interpolation': vals[0],   # 0 = none (step), 1 = linear, 2 = bezier, 3 = hermite
+        'globalSequence': vals[1],  # -1 unless driven by a global loop
+        'timestamps': (vals[2], vals[3]),
+        'values': (vals[4], vals[5]),
+    }
+
+
 class M2Model:
     """Parser for WotLK M2 model files."""
 
     def __init__(self, m2_data, skin_data):
         self.m2_data = m2_data
         self.skin_data = skin_data
-        self.vertices = []
-        self.indices = []
+        self.vertices = np.zeros(0, dtype=M2_VERTEX_DTYPE)
+        self.indices = np.zeros(0, dtype=np.uint16)
         self.submeshes = []
         self.textures = []  # M2 texture definitions
         self.texture_lookups = []
         self.tex_units = []
+        self.sequences = []
+        self.bones = []
 
         self._parse_m2()
         self._parse_skin()
@@ -265,24 +212,10 @@ class M2Model:
             print(f"    Warning: M2 version {version} (expected 264)")
 
         # Vertices: offset 60
+        # Zero-copy structured view over the M2 data (see M2_VERTEX_DTYPE)
         n_vertices, ofs_vertices = struct.unpack_from('<II', data, 60)
-
-        # Each vertex is 48 bytes:
-        # pos(12) + boneWeights(4) + boneIndices(4) + normal(12) + uv1(8) + uv2(8)
-        for i in range(n_vertices):
-            off = ofs_vertices + i * 48
-            px, py, pz = struct.unpack_from('<3f', data, off)
-            # Skip bone weights (4 bytes) and bone indices (4 bytes)
-            nx, ny, nz = struct.unpack_from('<3f', data, off + 20)
-            u1, v1 = struct.unpack_from('<2f', data, off + 32)
-            u2, v2 = struct.unpack_from('<2f', data, off + 40)
-
-            self.vertices.append({
-                'pos': (px, py, pz),
-                'normal': (nx, ny, nz),
-                'uv': (u1, v1),
-                'uv2': (u2, v2),
-            })
+        self.vertices = np.frombuffer(data, dtype=M2_VERTEX_DTYPE, count=n_vertices,
+                                      offset=ofs_vertices)
 
         # Textures: offset 80
         n_textures, ofs_textures = struct.unpack_from('<II', data, 80)
@@ -298,10 +231,50 @@ class M2Model:
                 'filename': name,
             })
 
-        # Texture lookups: offset 88
-        n_tex_lookup, ofs_tex_lookup = struct.unpack_from('<II', data, 88)
+        # Texture lookups: offset 128 (88 is the texture weights table)
+        n_tex_lookup, ofs_tex_lookup = struct.unpack_from('<II', data, 128)
         self.texture_lookups = list(struct.unpack_from(f'<{n_tex_lookup}H', data, ofs_tex_lookup))
 
+        # Skeleton data is optional for static export; a damaged block leaves
+        # the model unskinned instead of failing the conversion
+        try:
+            self._parse_skeleton()
+        except struct.error as e:
+            print(f"    Warning: Ignoring bones/sequences: {e}")
+            self.sequences = []
+            self.bones = []
+
+    def _parse_skeleton(self):
+        data = self.m2_data
+
+        # Sequences: offset 28 (64 bytes each)
+        n_sequences, ofs_sequences = struct.unpack_from('<II', data, 28)
+        for i in range(n_sequences):
+            vals = struct.unpack_from(M2_SEQUENCE_FORMAT, data, ofs_sequences + i * 64)
+            self.sequences.append({
+                'id': vals[0],
+                'variation': vals[1],
+                'duration': vals[2],  # ms
+                'flags': vals[4],     # 0x20 = keys stored in the .m2, 0x40 = alias of aliasNext
+                'variationNext': vals[-2],
+                'aliasNext': vals[-1],
+            })
+
+        # Bones: offset 44 (88 bytes each)
+        n_bones, ofs_bones = struct.unpack_from('<II', data, 44)
+        for i in range(n_bones):
+            vals = struct.unpack_from(M2_BONE_FORMAT, data, ofs_bones + i * 88)
+            self.bones.append({
+                'keyBoneId': vals[0],
+                'flags': vals[1],
+                'parent': vals[2],
+                'submeshId': vals[3],
+                'translation': _parse_track(vals[5:11]),
+                'rotation': _parse_track(vals[11:17]),
+                'scale': _parse_track(vals[17:23]),
+                'pivot': vals[23:26],
+            })
+
     def _parse_skin(self):
         data = self.skin_data
         magic = data[:4]
@@ -317,14 +290,14 @@ class M2Model:
         bones = struct.unpack_from('<I', data, 44)[0]
 
         # Vertex index remap table (16-bit, maps skin vertex index to M2 vertex index)
-        vertex_remap = list(struct.unpack_from(f'<{n_indices}H', data, ofs_indices))
+        vertex_remap = np.frombuffer(data, dtype='<u2', count=n_indices, offset=ofs_indices)
 
         # Triangle indices (16-bit, refers to skin vertex indices)
-        triangles = list(struct.unpack_from(f'<{n_triangles}H', data, ofs_triangles))
+        triangles = np.frombuffer(data, dtype='<u2', count=n_triangles, offset=ofs_triangles)
 
         # Store the global index list using M2 vertex indices
         # triangles[i] is an index into vertex_remap, which gives the M2 vertex index
-        self.indices = [vertex_remap[t] for t in triangles]
+        self.indices = vertex_remap[triangles]
 
         # Submeshes (48 bytes each)
         for i in range(n_submeshes):
@@ -332,7 +305,7 @@ class M2Model:
             vals = struct.unpack_from('<HH HH HH HH HH 3f 3f', data, off)
             self.submeshes.append({
                 'meshPartId': vals[0],
-                'padding': vals[1],
+                'level': vals[1],  # triStart overflow: indices start at triStart + (level << 16)
                 'vertStart': vals[2],
                 'vertCount': vals[3],
                 'triStart': vals[4],
@@ -376,291 +349,404 @@ class M2Model:
         return 0  # Default to first texture
 
 
+    def submesh_index_ranges(self):
+        """(first index, index count) into self.indices for every submesh.
+
+        Skins without submeshes get one range over all indices.
+        """
+        n_indices = len(self.indices)
+        if not self.submeshes:
+            return [(0, n_indices)]
+        ranges = []
+        for sm in self.submeshes:
+            start = min(sm['triStart'] + (sm['level'] << 16), n_indices)
+            ranges.append((start, min(sm['triCount'], n_indices - start)))
+        return ranges
+
+
 # ============================================================================
 # GLB Generator
 # ============================================================================
 
-def generate_glb(model, texture_image=None, z_up_to_y_up=True):
-    """Generate a GLB (binary glTF) file from parsed M2 model data."""
+def texture_target_size(texture_image):
+    """Size a texture is embedded at (large textures are resized for web delivery)."""
+    return (min(texture_image.width, MAX_TEXTURE_SIZE),
+            min(texture_image.height, MAX_TEXTURE_SIZE))
+
+
+def encode_texture(texture_image, encoder=DEFAULT_ENCODER):
+    """Resize (if needed) and encode a texture as the image payload embedded in GLBs."""
+    size = texture_target_size(texture_image)
+    if size != texture_image.size:
+        texture_image = texture_image.resize(size, Image.LANCZOS)
+    return encode_image(texture_image, encoder)
+
+
+def _next_power_of_two(n):
+    return 1 << max(0, int(n) - 1).bit_length()
+
+
+def pack_atlas(sizes, padding=ATLAS_PADDING):
+    """Shelf-pack (width, height) sizes, tallest first.
+
+    Returns (atlas width, atlas height, [(x, y)] per size); the atlas is
+    power-of-two sized and positions leave padding pixels around every size.
+    """
+    padded = [(w + 2 * padding, h + 2 * padding) for w, h in sizes]
+    area = sum(w * h for w, h in padded)
+    width = _next_power_of_two(max(max(w for w, _ in padded), math.sqrt(area)))
+
+    positions = [None] * len(sizes)
+    x = y = shelf_height = 0
+    for i in sorted(range(len(sizes)), key=lambda i: (-padded[i][1], -padded[i][0])):
+        w, h = padded[i]
+        if x + w > width:
+            x, y, shelf_height = 0, y + shelf_height, 0
+        positions[i] = (x + padding, y + padding)
+        x += w
+        shelf_height = max(shelf_height, h)
+    return width, _next_power_of_two(y + shelf_height), positions
+
+
+def atlas_layout(images):
+    """Placement of decoded textures in a texture atlas.
+
+    Returns (atlas width, atlas height, [(x, y, width, height)] per image).
+    Textures are placed at their embed size (see texture_target_size), halved
+    until the atlas fits in MAX_ATLAS_SIZE.
+    """
+    sizes = [texture_target_size(img) for img in images]
+    while True:
+        width, height, positions = pack_atlas(sizes)
+        if max(width, height) <= MAX_ATLAS_SIZE or max(max(size) for size in sizes) <= 1:
+            break
+        sizes = [(max(1, w // 2), max(1, h // 2)) for w, h in sizes]
+    return width, height, [(x, y, w, h) for (x, y), (w, h) in zip(positions, sizes)]
+
+
+def atlas_uv_rects(layout):
+    """(u0, v0, u_scale, v_scale) per atlas placement.
 
-    # Collect all unique vertex indices we actually use
-    used_vertices = set(model.indices)
-    if not used_vertices:
+    A UV (u, v) of a packed texture maps to (u0 + u * u_scale, v0 + v * v_scale).
+    """
+    width, height, placements = layout
+    return [(x / width, y / height, w / width, h / height) for x, y, w, h in placements]
+
+
+def compose_atlas(images, layout):
+    """Draw decoded textures into an RGBA atlas image at their layout placements."""
+    width, height, placements = layout
+    atlas = np.zeros((height, width, 4), dtype=np.uint8)
+    p = ATLAS_PADDING
+    for img, (x, y, w, h) in zip(images, placements):
+        if img.size != (w, h):
+            img = img.resize((w, h), Image.LANCZOS)
+        pixels = np.asarray(img.convert('RGBA'))
+        atlas[y - p:y + h + p, x - p:x + w + p] = np.pad(pixels, ((p, p), (p, p), (0, 0)), mode='edge')
+    return Image.fromarray(atlas, 'RGBA')
+
+
+def generate_glb(model, texture_image=None, z_up_to_y_up=True, texture_png=None,
+                 textures=None, submesh_textures=None, uv_rects=None, quantize=False,
+                 skeleton=None):
+    """Generate a GLB (binary glTF) file from parsed M2 model data.
+
+    Every skin submesh (see M2Model.submesh_index_ranges) becomes one
+    primitive; all primitives share the vertex attributes and one index
+    buffer view, and submeshes sampling the same texture share a material.
+
+    Textures are given either as a list of PNG or WebP payloads (textures;
+    WebP images are referenced through EXT_texture_webp) with, per
+    submesh, the index of the payload it samples (submesh_textures, None for
+    untextured) and an optional atlas UV rect (uv_rects, see
+    atlas_uv_rects), or as a single texture for every submesh: an
+    already encoded PNG payload (texture_png, e.g. from the encoded texture
+    cache) or an image to encode (texture_image).
+
+    With quantize, each primitive's triangles are reordered for vertex cache
+    locality, vertices are renumbered in order of first use, and attributes
+    are stored with KHR_mesh_quantization: int16 positions dequantized by the
+    node's translation/scale, normalized int16 normals and normalized uint16
+    UVs (with KHR_texture_transform restoring UVs outside [0, 1]).
+
+    With a skeleton (see m2_animation.load_skeleton), vertices get JOINTS_0 /
+    WEIGHTS_0 from the M2 bone indices/weights and the skeleton's joints,
+    skin and animations are added.
+    """
+    ranges = model.submesh_index_ranges()
+    if textures is None:
+        if texture_png is None and texture_image is not None:
+            texture_png = encode_texture(texture_image)
+        textures = [texture_png] if texture_png is not None else []
+    if submesh_textures is None:
+        submesh_textures = [0 if textures else None] * len(ranges)
+    if uv_rects is None:
+        uv_rects = [None] * len(ranges)
+
+    # Vertices are keyed by (M2 vertex, UV rect): a vertex shared by submeshes
+    # mapped into different atlas rects is duplicated, otherwise shared
+    group_rects = [None]
+    groups = np.zeros(len(model.indices), dtype=np.int64)
+    drawn = np.zeros(len(model.indices), dtype=bool)
+    for (start, count), rect in zip(ranges, uv_rects):
+        if rect not in group_rects:
+            group_rects.append(rect)
+        groups[start:start + count] = group_rects.index(rect)
+        drawn[start:start + count] = True
+    n_groups = len(group_rects)
+
+    indices = model.indices.astype(np.int64)
+    valid = indices < len(model.vertices)
+    keys = indices * n_groups + groups
+
+    # Collect all unique vertex keys we actually use (sorted)
+    used_keys = np.unique(keys[valid & drawn])
+    if len(used_keys) == 0:
         print("    Warning: No indices found!")
         return None
 
     # Create compact vertex arrays
     # We remap M2 vertex indices to sequential 0..N
-    index_remap = {}
-    positions = []
-    normals = []
-    uvs = []
-
-    for m2_idx in sorted(used_vertices):
-        if m2_idx >= len(model.vertices):
-            continue
-        v = model.vertices[m2_idx]
-        index_remap[m2_idx] = len(positions)
-
-        px, py, pz = v['pos']
-        nx, ny, nz = v['normal']
-        u, vtex = v['uv']
-
-        if z_up_to_y_up:
-            # WoW uses Z-up, rotate to Y-up: (x, y, z) -> (x, z, -y)
-            px, py, pz = px, pz, -py
-            nx, ny, nz = nx, nz, -ny
-
-        positions.append((px, py, pz))
-        normals.append((nx, ny, nz))
-        uvs.append((u, vtex))
-
-    # Remap triangle indices
-    remapped_indices = []
-    for idx in model.indices:
-        if idx in index_remap:
-            remapped_indices.append(index_remap[idx])
-        else:
-            remapped_indices.append(0)  # fallback
-
+    verts = model.vertices[used_keys // n_groups]
+    positions = verts['pos']
+    normals = verts['normal']
+    uvs = verts['uv']
+    if skeleton:
+        # Bone indices refer to the M2 bone list; weights are normalized to sum to 255
+        joints = np.minimum(verts['bone_indices'], len(skeleton.bones) - 1)
+        weights = verts['bone_weights'].astype(np.int32)
+        weights[weights.sum(axis=1) == 0, 0] = 255
+        weights = weights * 255 // weights.sum(axis=1, keepdims=True)
+        weights[np.arange(len(weights)), weights.argmax(axis=1)] += 255 - weights.sum(axis=1)
+        joints = joints.astype('<u2' if len(skeleton.bones) > 256 else 'u1')
+        weights = weights.astype('u1')
+    vertex_groups = used_keys % n_groups
+    for group, rect in enumerate(group_rects):
+        if rect is not None:
+            u0, v0, u_scale, v_scale = rect
+            in_group = vertex_groups == group
+            uvs[in_group] = uvs[in_group] * (u_scale, v_scale) + (u0, v0)
+
+    if z_up_to_y_up:
+        # WoW uses Z-up, rotate to Y-up: (x, y, z) -> (x, z, -y)
+        positions = np.stack([positions[:, 0], positions[:, 2], -positions[:, 1]], axis=1)
+        normals = np.stack([normals[:, 0], normals[:, 2], -normals[:, 1]], axis=1)
+
+    # Remap triangle indices (indices past the vertex table fall back to 0)
     n_vertices = len(positions)
-    n_indices = len(remapped_indices)
+    index_dtype, index_type = ('<u2', UNSIGNED_SHORT) if n_vertices <= 0xFFFF else ('<u4', UNSIGNED_INT)
+    remapped_indices = np.searchsorted(used_keys, keys).astype(index_dtype)
+    remapped_indices[~valid] = 0
+
+    # One index list per primitive, concatenated into a single buffer view
+    primitive_ranges = []
+    index_parts = []
+    n_indices = 0
+    for submesh, (start, count) in enumerate(ranges):
+        if count <= 0:
+            continue
+        primitive_ranges.append((submesh, n_indices, count))
+        index_parts.append(remapped_indices[start:start + count])
+        n_indices += count
 
     if n_vertices == 0 or n_indices == 0:
         print("    Warning: Empty mesh!")
         return None
+    all_indices = np.concatenate(index_parts)
+
+    node = {"mesh": 0, "name": "model"}
+    extensions = []
+    uv_transform = None
+    if quantize:
+        for _, offset, count in primitive_ranges:
+            all_indices[offset:offset + count] = optimize_vertex_cache(
+                all_indices[offset:offset + count], n_vertices)
+        all_indices, order = optimize_vertex_fetch(all_indices, n_vertices)
+        positions, normals, uvs = positions[order], normals[order], uvs[order]
+        if skeleton:
+            joints, weights = joints[order], weights[order]
 
     # Calculate bounding box
-    min_pos = [min(p[i] for p in positions) for i in range(3)]
-    max_pos = [max(p[i] for p in positions) for i in range(3)]
-
-    # ---- Binary buffer construction ----
-    buffer_parts = []
-
-    # Part 0: Indices (unsigned short = 2 bytes each)
-    indices_data = struct.pack(f'<{n_indices}H', *remapped_indices)
-    # Pad to 4-byte alignment
-    while len(indices_data) % 4 != 0:
-        indices_data += b'\x00'
-    indices_offset = 0
-    indices_length = n_indices * 2
-    buffer_parts.append(indices_data)
-
-    # Part 1: Positions (3 floats = 12 bytes each)
-    pos_data = b''
-    for p in positions:
-        pos_data += struct.pack('<3f', *p)
-    pos_offset = len(b''.join(buffer_parts))
-    pos_length = len(pos_data)
-    buffer_parts.append(pos_data)
-
-    # Part 2: Normals (3 floats = 12 bytes each)
-    normal_data = b''
-    for n in normals:
-        normal_data += struct.pack('<3f', *n)
-    normal_offset = len(b''.join(buffer_parts))
-    normal_length = len(normal_data)
-    buffer_parts.append(normal_data)
-
-    # Part 3: UVs (2 floats = 8 bytes each)
-    uv_data = b''
-    for uv in uvs:
-        uv_data += struct.pack('<2f', *uv)
-    uv_offset = len(b''.join(buffer_parts))
-    uv_length = len(uv_data)
-    buffer_parts.append(uv_data)
-
-    # Combine all buffer data
-    binary_buffer = b''.join(buffer_parts)
-    buffer_byte_length = len(binary_buffer)
+    min_pos = positions.min(axis=0).tolist()
+    max_pos = positions.max(axis=0).tolist()
+
+    # ---- Binary buffer layout ----
+    # Offsets are assigned as views are added; bytes are copied once in finish()
+    writer = GLBWriter()
+    indices_view = writer.add_buffer_view(all_indices, target=ELEMENT_ARRAY_BUFFER)
+    if quantize:
+        # Positions: int16 around the bounding box center, one uniform step so
+        # normals are unaffected by the node scale
+        center = (positions.min(axis=0) + positions.max(axis=0)) / 2
+        step = max(float((positions.max(axis=0) - positions.min(axis=0)).max()) / 2, 1e-6) / 32767
+        node["translation"] = center.tolist()
+        node["scale"] = [step] * 3
+        # 3-component int16 attributes are padded to 8 bytes (4-byte aligned stride)
+        pos_q = np.zeros((n_vertices, 4), dtype='<i2')
+        pos_q[:, :3] = np.clip(np.round((positions - center) / step), -32767, 32767)
+        normal_q = np.zeros((n_vertices, 4), dtype='<i2')
+        normal_q[:, :3] = np.clip(np.round(normals * 32767), -32767, 32767)
+
+        # UVs: normalized uint16 over [0, 1], or over their own range plus a
+        # texture transform when they wrap
+        uv_min, uv_max = uvs.min(axis=0), uvs.max(axis=0)
+        if uv_min.min() < 0 or uv_max.max() > 1:
+            uv_scale = np.maximum(uv_max - uv_min, 1e-6)
+            uv_transform = {"offset": uv_min.tolist(), "scale": uv_scale.tolist()}
+            uvs = (uvs - uv_min) / uv_scale
+        uv_q = np.round(np.clip(uvs, 0, 1) * 65535).astype('<u2')
+
+        min_pos = pos_q[:, :3].min(axis=0).tolist()
+        max_pos = pos_q[:, :3].max(axis=0).tolist()
+        pos_view = writer.add_buffer_view(pos_q, target=ARRAY_BUFFER, byte_stride=8)
+        normal_view = writer.add_buffer_view(normal_q, target=ARRAY_BUFFER, byte_stride=8)
+        uv_view = writer.add_buffer_view(uv_q, target=ARRAY_BUFFER, byte_stride=4)
+        extensions.append("KHR_mesh_quantization")
+    else:
+        pos_view = writer.add_buffer_view(np.ascontiguousarray(positions, dtype='<f4'),
+                                          target=ARRAY_BUFFER, byte_stride=12)
+        normal_view = writer.add_buffer_view(np.ascontiguousarray(normals, dtype='<f4'),
+                                             target=ARRAY_BUFFER, byte_stride=12)
+        uv_view = writer.add_buffer_view(np.ascontiguousarray(uvs, dtype='<f4'),
+                                         target=ARRAY_BUFFER, byte_stride=8)
+    if skeleton:
+        joints_view = writer.add_buffer_view(np.ascontiguousarray(joints), target=ARRAY_BUFFER,
+                                             byte_stride=joints.itemsize * 4)
+        weights_view = writer.add_buffer_view(np.ascontiguousarray(weights), target=ARRAY_BUFFER,
+                                              byte_stride=4)
+
+    indices_accs = []
+    for submesh, offset, count in primitive_ranges:
+        part = all_indices[offset:offset + count]
+        indices_accs.append(writer.add_accessor(indices_view, index_type, count, "SCALAR",
+                                                min_values=[int(part.min())],
+                                                max_values=[int(part.max())],
+                                                byte_offset=offset * all_indices.itemsize))
+    if quantize:
+        pos_acc = writer.add_accessor(pos_view, SHORT, n_vertices, "VEC3",
+                                      min_values=min_pos, max_values=max_pos)
+        normal_acc = writer.add_accessor(normal_view, SHORT, n_vertices, "VEC3", normalized=True)
+        uv_acc = writer.add_accessor(uv_view, UNSIGNED_SHORT, n_vertices, "VEC2", normalized=True)
+    else:
+        pos_acc = writer.add_accessor(pos_view, FLOAT, n_vertices, "VEC3",
+                                      min_values=min_pos, max_values=max_pos)
+        normal_acc = writer.add_accessor(normal_view, FLOAT, n_vertices, "VEC3")
+        uv_acc = writer.add_accessor(uv_view, FLOAT, n_vertices, "VEC2")
+    attributes = {
+        "POSITION": pos_acc,
+        "NORMAL": normal_acc,
+        "TEXCOORD_0": uv_acc,
+    }
+    if skeleton:
+        attributes["JOINTS_0"] = writer.add_accessor(
+            joints_view, UNSIGNED_SHORT if joints.itemsize == 2 else UNSIGNED_BYTE,
+            n_vertices, "VEC4")
+        attributes["WEIGHTS_0"] = writer.add_accessor(weights_view, UNSIGNED_BYTE, n_vertices,
+                                                      "VEC4", normalized=True)
+
+    # Submeshes sampling the same texture share a material
+    materials = {}  # texture payload index (None = untextured) -> material index
+    primitives = []
+    for (submesh, _, _), indices_acc in zip(primitive_ranges, indices_accs):
+        texture = submesh_textures[submesh]
+        primitives.append({
+            "attributes": dict(attributes),
+            "indices": indices_acc,
+            "material": materials.setdefault(texture, len(materials)),
+        })
 
     # ---- Build glTF JSON ----
     gltf = {
         "asset": {"version": "2.0", "generator": "AoWoW M2 Converter"},
         "scene": 0,
         "scenes": [{"nodes": [0]}],
-        "nodes": [{"mesh": 0, "name": "model"}],
-        "buffers": [{"byteLength": buffer_byte_length}],
-        "bufferViews": [
-            # 0: Indices
-            {
-                "buffer": 0,
-                "byteOffset": indices_offset,
-                "byteLength": indices_length,
-                "target": 34963,  # ELEMENT_ARRAY_BUFFER
-            },
-            # 1: Positions
-            {
-                "buffer": 0,
-                "byteOffset": pos_offset,
-                "byteLength": pos_length,
-                "target": 34962,  # ARRAY_BUFFER
-                "byteStride": 12,
-            },
-            # 2: Normals
-            {
-                "buffer": 0,
-                "byteOffset": normal_offset,
-                "byteLength": normal_length,
-                "target": 34962,
-                "byteStride": 12,
-            },
-            # 3: UVs
-            {
-                "buffer": 0,
-                "byteOffset": uv_offset,
-                "byteLength": uv_length,
-                "target": 34962,
-                "byteStride": 8,
-            },
-        ],
-        "accessors": [
-            # 0: Indices
-            {
-                "bufferView": 0,
-                "byteOffset": 0,
-                "componentType": 5123,  # UNSIGNED_SHORT
-                "count": n_indices,
-                "type": "SCALAR",
-                "max": [max(remapped_indices)],
-                "min": [min(remapped_indices)],
-            },
-            # 1: Positions
-            {
-                "bufferView": 1,
-                "byteOffset": 0,
-                "componentType": 5126,  # FLOAT
-                "count": n_vertices,
-                "type": "VEC3",
-                "max": max_pos,
-                "min": min_pos,
-            },
-            # 2: Normals
-            {
-                "bufferView": 2,
-                "byteOffset": 0,
-                "componentType": 5126,
-                "count": n_vertices,
-                "type": "VEC3",
-            },
-            # 3: UVs
-            {
-                "bufferView": 3,
-                "byteOffset": 0,
-                "componentType": 5126,
-                "count": n_vertices,
-                "type": "VEC2",
-            },
-        ],
-        "meshes": [{
-            "primitives": [{
-                "attributes": {
-                    "POSITION": 1,
-                    "NORMAL": 2,
-                    "TEXCOORD_0": 3,
-                },
-                "indices": 0,
-                "material": 0,
-            }],
-        }],
+        "nodes": [node],
+        "buffers": [],  # filled in by GLBWriter.finish()
+        "bufferViews": writer.buffer_views,
+        "accessors": writer.accessors,
+        "meshes": [{"primitives": primitives}],
     }
 
-    # ---- Handle texture ----
-    if texture_image is not None:
-        # Encode texture to PNG in memory
-        png_buffer = io.BytesIO()
-        # Resize large textures for web delivery
-        max_tex_size = 512
-        if texture_image.width > max_tex_size or texture_image.height > max_tex_size:
-            texture_image = texture_image.resize(
-                (min(texture_image.width, max_tex_size),
-                 min(texture_image.height, max_tex_size)),
-                Image.LANCZOS
-            )
-        texture_image.save(png_buffer, format='PNG', optimize=True)
-        png_data = png_buffer.getvalue()
-
-        # Pad PNG data to 4-byte alignment
-        padded_png = png_data
-        while len(padded_png) % 4 != 0:
-            padded_png += b'\x00'
-
-        # Add PNG data to binary buffer
-        texture_offset = buffer_byte_length
-        texture_length = len(png_data)
-        binary_buffer += padded_png
-        buffer_byte_length = len(binary_buffer)
-
-        # Update buffer length
-        gltf["buffers"][0]["byteLength"] = buffer_byte_length
-
-        # Add bufferView for texture
-        tex_bv_idx = len(gltf["bufferViews"])
-        gltf["bufferViews"].append({
-            "buffer": 0,
-            "byteOffset": texture_offset,
-            "byteLength": texture_length,
+    # ---- Handle textures ----
+    gltf_materials = []
+    images = []
+    gltf_textures = []
+    for texture in materials:
+        if texture is None:
+            # No texture - use a default material
+            gltf_materials.append({
+                "pbrMetallicRoughness": {
+                    "baseColorFactor": [0.8, 0.7, 0.6, 1.0],
+                    "metallicFactor": 0.0,
+                    "roughnessFactor": 0.7,
+                },
+                "doubleSided": True,
+            })
+            continue
+
+        # Add image data to binary buffer (no target: image data)
+        payload = textures[texture]
+        tex_bv_idx = writer.add_buffer_view(payload)
+        if is_webp(payload):
+            images.append({
+                "bufferView": tex_bv_idx,
+                "mimeType": "image/webp",
+            })
+            gltf_textures.append({
+                "sampler": 0,
+                "extensions": {"EXT_texture_webp": {"source": len(images) - 1}},
+            })
+        else:
+            images.append({
+                "bufferView": tex_bv_idx,
+                "mimeType": "image/png",
+            })
+            gltf_textures.append({"sampler": 0, "source": len(images) - 1})
+        texture_info = {"index": len(gltf_textures) - 1}
+        if uv_transform:
+            texture_info["extensions"] = {"KHR_texture_transform": uv_transform}
+        gltf_materials.append({
+            "pbrMetallicRoughness": {
+                "baseColorTexture": texture_info,
+                "metallicFactor": 0.0,
+                "roughnessFactor": 0.8,
+            },
+            "doubleSided": True,
         })
 
-        # Add image, sampler, texture, material
-        gltf["images"] = [{
-            "bufferView": tex_bv_idx,
-            "mimeType": "image/png",
-        }]
+    if images:
+        # Add images, sampler, textures
+        gltf["images"] = images
         gltf["samplers"] = [{
             "magFilter": 9729,  # LINEAR
             "minFilter": 9987,  # LINEAR_MIPMAP_LINEAR
             "wrapS": 10497,     # REPEAT
             "wrapT": 10497,
         }]
-        gltf["textures"] = [{
-            "sampler": 0,
-            "source": 0,
-        }]
-        gltf["materials"] = [{
-            "pbrMetallicRoughness": {
-                "baseColorTexture": {"index": 0},
-                "metallicFactor": 0.0,
-                "roughnessFactor": 0.8,
-            },
-            "doubleSided": True,
-        }]
-    else:
-        # No texture - use a default material
-        gltf["materials"] = [{
-            "pbrMetallicRoughness": {
-                "baseColorFactor": [0.8, 0.7, 0.6, 1.0],
-                "metallicFactor": 0.0,
-                "roughnessFactor": 0.7,
-            },
-            "doubleSided": True,
-        }]
+        gltf["textures"] = gltf_textures
+    gltf["materials"] = gltf_materials
+    # No PNG fallback is embedded, so viewers must support WebP
+    extensions.extend(sorted({name for texture in gltf_textures
+                              for name in texture.get("extensions", {})}))
+    if uv_transform and images:
+        extensions.append("KHR_texture_transform")
+    if skeleton:
+        # Skinned meshes ignore their node's transform, so quantization is
+        # undone by the inverse bind matrices instead
+        mesh_transform = None
+        if quantize:
+            mesh_transform = np.diag([step, step, step, 1.0])
+            mesh_transform[:3, 3] = center
+            del node["translation"], node["scale"]
+        node["skin"] = add_skeleton(writer, gltf, skeleton, z_up_to_y_up, mesh_transform)
+
+    if extensions:
+        # Every extension used changes how data must be read
+        gltf["extensionsUsed"] = extensions
+        gltf["extensionsRequired"] = extensions
 
     # ---- Encode to GLB ----
-    json_str = json.dumps(gltf, separators=(',', ':'))
-    json_bytes = json_str.encode('utf-8')
-    # Pad JSON to 4-byte alignment with spaces
-    while len(json_bytes) % 4 != 0:
-        json_bytes += b' '
-
-    # GLB header: magic(4) + version(4) + length(4)
-    # JSON chunk: length(4) + type(4) + data
-    # BIN chunk: length(4) + type(4) + data
-    json_chunk_length = len(json_bytes)
-    bin_chunk_length = len(binary_buffer)
-    total_length = 12 + 8 + json_chunk_length + 8 + bin_chunk_length
-
-    glb = bytearray()
-    # GLB header
-    glb += struct.pack('<III', 0x46546C67, 2, total_length)  # glTF magic, version 2
-    # JSON chunk
-    glb += struct.pack('<II', json_chunk_length, 0x4E4F534A)  # JSON type
-    glb += json_bytes
-    # BIN chunk
-    glb += struct.pack('<II', bin_chunk_length, 0x004E4942)  # BIN type
-    glb += binary_buffer
-
-    return bytes(glb)
+    return writer.finish(gltf)
 
 
 # ============================================================================
@@ -674,6 +760,8 @@ def find_skin_texture(mpq_mgr, model_path, skin_color=0):
     The pattern is: <ModelPath>Skin<SkinColor>_<ExtraSuffix>.blp
 
     For example: Character\\Human\\Male\\HumanMaleSkin00_00.blp
+
+    Returns (CachedTexture, path) or (None, None), like the other texture finders.
     """
     # Extract the model base name from path
     # e.g., "Character\\Human\\Male\\HumanMale" -> "HumanMale"
@@ -691,20 +779,15 @@ def find_skin_texture(mpq_mgr, model_path, skin_color=0):
     ]
 
     for pattern in patterns:
-        blp_data = mpq_mgr.read_file(pattern)
-        if blp_data:
-            return blp_data, pattern
-
-    # Search for any matching skin texture
-    search_term = (model_dir + '\\' + model_name + 'skin').lower().replace('/', '\\')
-    matches = mpq_mgr.find_files(search_term)
-    if matches:
-        # Pick the first reasonable match
-        for m in sorted(matches):
-            if m.lower().endswith('.blp'):
-                blp_data = mpq_mgr.read_file(m)
-                if blp_data:
-                    return blp_data, m
+        texture = mpq_mgr.load_texture(pattern)
+        if texture:
+            return texture, pattern
+
+    # Search for any matching skin texture (first match in sorted order)
+    for m in sorted(mpq_mgr.find_files(model_dir, prefix=model_name + 'Skin', extension='.blp')):
+        texture = mpq_mgr.load_texture(m)
+        if texture:
+            return texture, m
 
     return None, None
 
@@ -725,19 +808,15 @@ def find_creature_texture(mpq_mgr, model_path):
     ]
 
     for pattern in patterns:
-        blp_data = mpq_mgr.read_file(pattern)
-        if blp_data:
-            return blp_data, pattern
+        texture = mpq_mgr.load_texture(pattern)
+        if texture:
+            return texture, pattern
 
     # Search for any texture in the model directory
-    search_term = (model_dir + '\\' + model_name).lower().replace('/', '\\')
-    matches = mpq_mgr.find_files(search_term)
-    blp_matches = [m for m in matches if m.lower().endswith('.blp')]
-    if blp_matches:
-        for m in sorted(blp_matches):
-            blp_data = mpq_mgr.read_file(m)
-            if blp_data:
-                return blp_data, m
+    for m in sorted(mpq_mgr.find_files(model_dir, prefix=model_name, extension='.blp')):
+        texture = mpq_mgr.load_texture(m)
+        if texture:
+            return texture, m
 
     return None, None
 
@@ -747,14 +826,266 @@ def get_item_texture(mpq_mgr, m2_model):
     for tex_def in m2_model.textures:
         if tex_def['type'] == 0 and tex_def['filename']:
             blp_path = tex_def['filename']
-            blp_data = mpq_mgr.read_file(blp_path)
-            if blp_data:
-                return blp_data, blp_path
+            texture = mpq_mgr.load_texture(blp_path)
+            if texture:
+                return texture, blp_path
 
     return None, None
 
 
-def convert_model(mpq_mgr, model_path, output_path, model_type='character', skin_color=0):
+def resolve_submesh_textures(mpq_mgr, model, fallback_path=None):
+    """Texture path sampled by every submesh (see M2Model.submesh_index_ranges).
+
+    Submeshes whose texture unit points at a hardcoded (type 0) texture that
+    decodes get that texture; submeshes using dynamic textures (character
+    skin, creature skins, ...) get fallback_path, None meaning untextured.
+    """
+    paths = []
+    for submesh in range(len(model.submesh_index_ranges())):
+        path = fallback_path
+        tex_idx = model.get_texture_index_for_submesh(submesh)
+        if tex_idx < len(model.textures):
+            tex_def = model.textures[tex_idx]
+            if tex_def['type'] == 0 and tex_def['filename']:
+                texture = mpq_mgr.load_texture(tex_def['filename'])
+                if texture and texture.image:
+                    path = tex_def['filename']
+        paths.append(path)
+    return paths
+
+
+def _uvs_in_unit_square(model, start, count):
+    """True if a submesh samples its texture without wrapping (UVs within [0, 1])."""
+    indices = model.indices[start:start + count]
+    uvs = model.vertices['uv'][indices[indices < len(model.vertices)]]
+    return len(uvs) == 0 or (uvs.min() >= -1e-3 and uvs.max() <= 1 + 1e-3)
+
+
+def prepare_textures(mpq_mgr, meshes, atlas=False, ktx2=False, encoder=DEFAULT_ENCODER):
+    """Encode the textures sampled by the submeshes of one or more skins of a model.
+
+    meshes lists (M2Model, per-submesh texture paths) for every skin
+    exported (the full model and its LODs), so the slots cover submeshes
+    that only some skins have. Returns (image payloads, {texture path: (payload index, atlas UV rect
+    or None)}, KTX2 payloads). With atlas, the textures of submeshes that do
+    not wrap their UVs are packed into a single atlas payload (when there are
+    at least two); textures any skin wraps keep their own payload. With ktx2,
+    the atlas gets a BC3 KTX2 payload (see ktx2.rgba_to_ktx2) and the other
+    textures one built from their DXT mips (see ktx2.blp_to_ktx2) where
+    possible; the KTX2 list is parallel to the image payloads, with None
+    where there is none. Images are
+    encoded with encoder (an image_encoding spec, also part of the cache
+    variant). Payloads come from the encoded texture cache.
+    """
+    paths = list(dict.fromkeys(path for _, submesh_paths in meshes
+                               for path in submesh_paths if path))
+    textures = {path: mpq_mgr.load_texture(path) for path in paths}
+
+    packed = []
+    if atlas:
+        wrapping = set()
+        for model, submesh_paths in meshes:
+            ranges = model.submesh_index_ranges()
+            wrapping.update(path for path, (start, count) in zip(submesh_paths, ranges)
+                            if path and not _uvs_in_unit_square(model, start, count))
+        packed = [path for path in paths if path not in wrapping]
+        if len(packed) < 2:
+            packed = []
+
+    payloads = []
+    compressed = []
+    slots = {}
+    if packed:
+        images = [textures[path].image for path in packed]
+        layout = atlas_layout(images)
+        # The layout only depends on the packed textures, so their digests
+        # identify the atlas
+        digest = content_hash('\n'.join(textures[path].digest for path in packed).encode())
+        variant = f"{layout[0]}x{layout[1]}:pad{ATLAS_PADDING}:lanczos"
+        payloads.append(mpq_mgr.png_cache.get(
+            digest, f"atlas:{variant}:{encoder}",
+            lambda: encode_image(compose_atlas(images, layout), encoder),
+            extension=encoder_extension(encoder)))
+        compressed.append(mpq_mgr.png_cache.get(
+            digest, f"atlas-ktx2:{variant}:bc3",
+            lambda: rgba_to_ktx2(compose_atlas(images, layout)),
+            extension='ktx2') if ktx2 else None)
+        for path, rect in zip(packed, atlas_uv_rects(layout)):
+            slots[path] = (0, rect)
+
+    for path in paths:
+        if path in slots:
+            continue
+        texture = textures[path]
+        width, height = texture_target_size(texture.image)
+        payload = mpq_mgr.png_cache.get(
+            texture.digest, f"glb:{width}x{height}:lanczos:{encoder}",
+            lambda: encode_texture(texture.image, encoder), extension=encoder_extension(encoder))
+        slots[path] = (len(payloads), None)
+        payloads.append(payload)
+        compressed.append(mpq_mgr.png_cache.get(
+            texture.digest, f"ktx2:max{MAX_TEXTURE_SIZE}",
+            lambda: blp_to_ktx2(mpq_mgr.read_file(path), MAX_TEXTURE_SIZE),
+            extension='ktx2') if ktx2 else None)
+    return payloads, slots, compressed
+
+
+def texture_materials(submesh_paths, payloads, slots):
+    """generate_glb texture arguments for per-submesh texture paths.
+
+    Paths without a prepared payload (see prepare_textures) are untextured.
+    """
+    submesh_slots = [slots.get(path, (None, None)) for path in submesh_paths]
+    return {
+        'textures': payloads,
+        'submesh_textures': [index for index, _ in submesh_slots],
+        'uv_rects': [rect for _, rect in submesh_slots],
+    }
+
+
+def lod_output_path(output_path, lod):
+    """GLB path for a reduced LOD: <name>.glb -> <name>.lod<N>.glb."""
+    return f"{os.path.splitext(output_path)[0]}.lod{lod}.glb"
+
+
+def lod_manifest_path(output_path):
+    """Path of the LOD list written next to <name>.glb: <name>.lod.json."""
+    return f"{os.path.splitext(output_path)[0]}.lod.json"
+
+
+def compressed_texture_path(output_path, index):
+    """KTX2 path for texture payload N of a model: <name>.glb -> <name>.tex<N>.ktx2.
+
+    N numbers the payloads of prepare_textures (the atlas first, when there
+    is one); the GLB's images do not reference the KTX2 files.
+    """
+    return f"{os.path.splitext(output_path)[0]}.tex{index}.ktx2"
+
+
+def write_compressed_textures(output_path, compressed):
+    """Write the KTX2 payloads of prepare_textures next to output_path.
+
+    KTX2 files of earlier runs that are not written now are removed. Returns
+    the file name per payload (None where there is no KTX2).
+    """
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    names = []
+    for index, data in enumerate(compressed):
+        if data is None:
+            names.append(None)
+            continue
+        path = compressed_texture_path(output_path, index)
+        with open(path, 'wb') as f:
+            f.write(data)
+        names.append(os.path.basename(path))
+    pattern = f"{glob.escape(os.path.splitext(output_path)[0])}.tex*.ktx2"
+    for path in glob.glob(pattern):
+        if os.path.basename(path) not in names:
+            os.remove(path)
+            print(f"    Removed stale {os.path.basename(path)}")
+    return names
+
+
+def remove_lod_outputs(output_path, keep=()):
+    """Delete LOD files of output_path left by earlier runs, except the paths in keep."""
+    paths = [lod_output_path(output_path, lod) for lod in range(1, MAX_LOD + 1)]
+    for path in paths + [lod_manifest_path(output_path)]:
+        if path not in keep and os.path.exists(path):
+            os.remove(path)
+            print(f"    Removed stale {os.path.basename(path)}")
+
+
+def read_skin(mpq_mgr, model_path, lod=0):
+    """(skin path, data) of a model's <model>0<lod>.skin, or (path, None) if missing."""
+    skin_path = f"{model_path}{lod:02d}.skin"
+    skin_data = mpq_mgr.read_file(skin_path)
+    if not skin_data:
+        skin_path = skin_path.lower()
+        skin_data = mpq_mgr.read_file(skin_path)
+    return skin_path, skin_data
+
+
+def write_glb(output_path, glb_data):
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    with open(output_path, 'wb') as f:
+        f.write(glb_data)
+
+    size_kb = len(glb_data) / 1024
+    print(f"    Output: {output_path} ({size_kb:.1f} KB)")
+
+
+def read_lod_models(mpq_mgr, m2_data, model_path, model, inputs=None):
+    """The reduced .skin LODs of a model as [(lod, M2Model)].
+
+    Reading stops at the first missing or unparsable .skin, and skins that
+    do not reduce the triangle count of the previous level are skipped.
+    """
+    lod_models = []
+    previous_indices = len(model.indices)
+    for lod in range(1, MAX_LOD + 1):
+        skin_path, skin_data = read_skin(mpq_mgr, model_path, lod)
+        if not skin_data:
+            break
+        if inputs is not None:
+            inputs[skin_path] = content_hash(skin_data)
+
+        try:
+            lod_model = M2Model(m2_data, skin_data)
+        except Exception as e:
+            print(f"    Warning: Failed to parse LOD {lod} skin: {e}")
+            break
+        if len(lod_model.indices) >= previous_indices:
+            print(f"    LOD {lod}: {len(lod_model.indices) // 3} triangles, no reduction - skipped")
+            continue
+        lod_models.append((lod, lod_model))
+        previous_indices = len(lod_model.indices)
+    return lod_models
+
+
+def export_lods(output_path, model, lod_models, glb_arguments):
+    """Write reduced LODs of a model (see read_lod_models) as <name>.lod<N>.glb files.
+
+    LODs share the M2 vertices, textures and skeleton of the full model; only
+    the index list differs. lod_models lists (lod, M2Model, per-submesh
+    texture paths) and glb_arguments(paths) returns the generate_glb keyword
+    arguments for a LOD. LOD files of earlier runs for levels not written
+    now are removed. The levels written are listed in <name>.lod.json:
+
+      {"lods": [{"lod": 0, "file": "1234.glb", "triangles": 812, "bytes": 40960},
+                {"lod": 1, "file": "1234.lod1.glb", "triangles": 402, "bytes": 30720}]}
+    """
+    lods = [{
+        'lod': 0,
+        'file': os.path.basename(output_path),
+        'triangles': len(model.indices) // 3,
+        'bytes': os.path.getsize(output_path),
+    }]
+
+    for lod, lod_model, submesh_paths in lod_models:
+        lod_path = lod_output_path(output_path, lod)
+        glb_data = generate_glb(lod_model, z_up_to_y_up=True, **glb_arguments(submesh_paths))
+        if not glb_data:
+            continue
+        write_glb(lod_path, glb_data)
+        lods.append({
+            'lod': lod,
+            'file': os.path.basename(lod_path),
+            'triangles': len(lod_model.indices) // 3,
+            'bytes': len(glb_data),
+        })
+
+    lod_manifest = lod_manifest_path(output_path)
+    remove_lod_outputs(output_path, keep={lod_manifest} | {
+        lod_output_path(output_path, entry['lod']) for entry in lods})
+    with open(lod_manifest, 'w') as f:
+        json.dump({'lods': lods}, f, separators=(',', ':'))
+    print(f"    LODs: {', '.join(str(entry['triangles']) for entry in lods)} triangles")
+    return lods
+
+
+def convert_model(mpq_mgr, model_path, output_path, model_type='character', skin_color=0,
+                  inputs=None, lods=False, atlas=False, ktx2=False, quantize=False,
+                  animations=None, image_encoder=None, outputs=None):
     """Convert a single M2 model to GLB.
 
     Args:
@@ -763,28 +1094,47 @@ def convert_model(mpq_mgr, model_path, output_path, model_type='character', skin
         output_path: Output GLB file path
         model_type: 'character', 'creature', 'item', 'object'
         skin_color: Skin color index for character models
+        inputs: Optional dict filled with {MPQ path: content hash} of every
+            file the conversion read, plus the lookups that found nothing
+            (for build manifests; see build_manifest.InputRecorder)
+        lods: Also export the reduced LOD skins (see export_lods)
+        atlas: Pack the textures of all submeshes into one atlas image
+            (see prepare_textures)
+        ktx2: Also write DXT textures and atlases as <name>.tex<N>.ktx2 files
+            next to the GLB, which does not reference them (see
+            prepare_textures)
+        quantize: Quantize and reorder the mesh data (see generate_glb)
+        animations: Export the skeleton with these animation sequences by name
+            (e.g. ['Stand', 'Walk']; see m2_animation.load_skeleton)
+        image_encoder: image_encoding spec for embedded textures
+            (default: png-optimize)
+        outputs: Optional list filled with the names of the files written
+            next to output_path (KTX2 textures, .lod.json and LOD GLBs, for
+            build manifests)
     """
+    if inputs is not None:
+        mpq_mgr = InputRecorder(mpq_mgr, inputs)
     m2_path = model_path + '.M2'
-    skin_path = model_path + '00.skin'
 
     print(f"  Loading M2: {m2_path}")
     m2_data = mpq_mgr.read_file(m2_path)
     if not m2_data:
         # Try lowercase
-        m2_path_lower = m2_path.lower()
-        m2_data = mpq_mgr.read_file(m2_path_lower)
+        m2_path = m2_path.lower()
+        m2_data = mpq_mgr.read_file(m2_path)
         if not m2_data:
-            print(f"    ERROR: M2 file not found: {m2_path}")
+            print(f"    ERROR: M2 file not found: {model_path + '.M2'}")
             return False
 
-    print(f"  Loading skin: {skin_path}")
-    skin_data = mpq_mgr.read_file(skin_path)
+    print(f"  Loading skin: {model_path}00.skin")
+    skin_path, skin_data = read_skin(mpq_mgr, model_path)
     if not skin_data:
-        skin_path_lower = skin_path.lower()
-        skin_data = mpq_mgr.read_file(skin_path_lower)
-        if not skin_data:
-            print(f"    ERROR: Skin file not found: {skin_path}")
-            return False
+        print(f"    ERROR: Skin file not found: {model_path + '00.skin'}")
+        return False
+
+    if inputs is not None:
+        inputs[m2_path] = content_hash(m2_data)
+        inputs[skin_path] = content_hash(skin_data)
 
     try:
         model = M2Model(m2_data, skin_data)
@@ -794,23 +1144,25 @@ def convert_model(mpq_mgr, model_path, output_path, model_type='character', skin
         traceback.print_exc()
         return False
 
-    # Find texture
+    # Find the model's main texture (used by submeshes with dynamic textures)
     texture_img = None
     if model_type == 'character':
-        blp_data, blp_path = find_skin_texture(mpq_mgr, model_path, skin_color)
+        texture, blp_path = find_skin_texture(mpq_mgr, model_path, skin_color)
     elif model_type == 'item':
-        blp_data, blp_path = get_item_texture(mpq_mgr, model)
-        if not blp_data:
-            blp_data, blp_path = find_creature_texture(mpq_mgr, model_path)
+        texture, blp_path = get_item_texture(mpq_mgr, model)
+        if not texture:
+            texture, blp_path = find_creature_texture(mpq_mgr, model_path)
     else:
         # Try hardcoded texture first, then creature pattern
-        blp_data, blp_path = get_item_texture(mpq_mgr, model)
-        if not blp_data:
-            blp_data, blp_path = find_creature_texture(mpq_mgr, model_path)
-
-    if blp_data:
-        print(f"    Texture: {blp_path} ({len(blp_data)} bytes)")
-        texture_img = decode_blp(blp_data)
+        texture, blp_path = get_item_texture(mpq_mgr, model)
+        if not texture:
+            texture, blp_path = find_creature_texture(mpq_mgr, model_path)
+
+    if texture:
+        print(f"    Texture: {blp_path} ({texture.file_size} bytes)")
+        if inputs is not None:
+            inputs[blp_path] = texture.digest
+        texture_img = texture.image
         if texture_img:
             print(f"    Decoded: {texture_img.size[0]}x{texture_img.size[1]}")
         else:
@@ -818,19 +1170,54 @@ def convert_model(mpq_mgr, model_path, output_path, model_type='character', skin
     else:
         print(f"    Warning: No texture found")
 
+    # LOD skins are read up front so the texture slots cover submeshes that
+    # only a reduced skin has
+    lod_models = read_lod_models(mpq_mgr, m2_data, model_path, model, inputs) if lods else []
+
+    # Per-submesh textures of every skin; resized/encoded payloads are shared
+    # across models and runs
+    fallback_path = blp_path if texture_img else None
+    meshes = [(m, resolve_submesh_textures(mpq_mgr, m, fallback_path))
+              for m in [model] + [lod_model for _, lod_model in lod_models]]
+    for path in dict.fromkeys(path for _, submesh_paths in meshes for path in submesh_paths):
+        if path and path != fallback_path:
+            print(f"    Submesh texture: {path}")
+            if inputs is not None:
+                inputs[path] = mpq_mgr.load_texture(path).digest
+    payloads, slots, compressed = prepare_textures(mpq_mgr, meshes, atlas, ktx2,
+                                                   image_encoder or DEFAULT_ENCODER)
+    compressed_files = write_compressed_textures(output_path, compressed)
+    if outputs is not None:
+        outputs.extend(name for name in compressed_files if name)
+
+    skeleton = None
+    if animations:
+        skeleton = load_skeleton(mpq_mgr, model, model_path, animations, inputs)
+        if skeleton:
+            names = ', '.join(f"{a.name} ({len(a.channels)} tracks)" for a in skeleton.animations)
+            print(f"    Skeleton: {len(skeleton.bones)} bones, animations: {names or 'none'}")
+
+    def glb_arguments(submesh_paths):
+        return dict(texture_materials(submesh_paths, payloads, slots), quantize=quantize,
+                    skeleton=skeleton)
+
     # Generate GLB
-    glb_data = generate_glb(model, texture_img, z_up_to_y_up=True)
+    glb_data = generate_glb(model, z_up_to_y_up=True, **glb_arguments(meshes[0][1]))
     if not glb_data:
         print(f"    ERROR: Failed to generate GLB")
         return False
 
-    # Write output
-    os.makedirs(os.path.dirname(output_path), exist_ok=True)
-    with open(output_path, 'wb') as f:
-        f.write(glb_data)
+    write_glb(output_path, glb_data)
 
-    size_kb = len(glb_data) / 1024
-    print(f"    Output: {output_path} ({size_kb:.1f} KB)")
+    if lods:
+        written = export_lods(output_path, model,
+                              [(lod, m, submesh_paths) for (lod, _), (m, submesh_paths)
+                               in zip(lod_models, meshes[1:])], glb_arguments)
+        if outputs is not None:
+            outputs.append(os.path.basename(lod_manifest_path(output_path)))
+            outputs.extend(entry['file'] for entry in written[1:])
+    else:
+        remove_lod_outputs(output_path)
     return True
 
 
@@ -838,8 +1225,12 @@ def convert_model(mpq_mgr, model_path, output_path, model_type='character', skin
 # Batch Conversion
 # ============================================================================
 
-def convert_all_characters(mpq_mgr):
-    """Convert all playable character race models."""
+def convert_all_characters(mpq_mgr, options=None):
+    """Convert all playable character race models.
+
+    options are extra convert_model keyword arguments (e.g. {'lods': True}).
+    """
+    options = options or {}
     print("\n=== Converting Character Models ===\n")
     output_dir = os.path.join(OUTPUT_BASE, 'character')
     os.makedirs(output_dir, exist_ok=True)
@@ -850,7 +1241,7 @@ def convert_all_characters(mpq_mgr):
     for name, m2_path in sorted(CHARACTER_MODELS.items()):
         output_path = os.path.join(output_dir, f"{name}.glb")
         print(f"\nConverting: {name}")
-        if convert_model(mpq_mgr, m2_path, output_path, model_type='character'):
+        if convert_model(mpq_mgr, m2_path, output_path, model_type='character', **options):
             success += 1
         else:
             failed += 1
@@ -864,19 +1255,21 @@ def find_all_item_models(mpq_mgr):
     item_paths = set()
 
     # Items are typically in Item\\ObjectComponents\\ or similar
-    search_terms = ['item\\', 'world\\']
-    for term in search_terms:
-        matches = mpq_mgr.find_files(term)
-        for m in matches:
-            if m.lower().endswith('.m2'):
-                # Strip .m2 extension
-                item_paths.add(m[:-3])
+    for directory in ['Item', 'World']:
+        for m in mpq_mgr.find_files(directory, extension='.m2', recursive=True):
+            # Strip .m2 extension
+            item_paths.add(m[:-3])
 
     return sorted(item_paths)
 
 
-def convert_existing_items(mpq_mgr):
-    """Convert item models that we already have GLBs for (update with textures)."""
+def convert_existing_items(mpq_mgr, force=False, options=None):
+    """Convert item models that we already have GLBs for (update with textures).
+
+    Outputs whose recorded M2/skin/texture inputs and options are unchanged
+    since the last run are skipped unless force is set.
+    """
+    options = options or {}
     print("\n=== Converting Existing Item Models ===\n")
 
     item_dir = os.path.join(OUTPUT_BASE, 'item')
@@ -898,9 +1291,11 @@ def convert_existing_items(mpq_mgr):
             item_models = json.load(f)
         print(f"Loaded {len(item_models)} item model mappings")
 
+        manifest = BuildManifest(item_dir)
         success = 0
         failed = 0
         skipped = 0
+        up_to_date = 0
 
         for display_id, info in sorted(item_models.items()):
             glb_name = f"{display_id}.glb"
@@ -927,10 +1322,22 @@ def convert_existing_items(mpq_mgr):
             # Convert backslashes
             m2_path = m2_path.replace('/', '\\')
 
+            if not force and manifest.is_up_to_date(mpq_mgr, output_path, m2_path, 'item',
+                                                    CONVERTER_VERSION, options):
+                manifest.mark_verified(output_path, mpq_mgr.vfs.state)
+                up_to_date += 1
+                continue
+
             print(f"\nConverting item {display_id}: {m2_path}")
-            if convert_model(mpq_mgr, m2_path, output_path, model_type='item'):
+            inputs = {}
+            outputs = []
+            if convert_model(mpq_mgr, m2_path, output_path, model_type='item', inputs=inputs,
+                             outputs=outputs, **options):
+                manifest.record(output_path, m2_path, 'item', CONVERTER_VERSION, inputs, options,
+                                outputs, mpq_mgr.vfs.state)
                 success += 1
             else:
+                manifest.forget(output_path)
                 failed += 1
 
             # Progress update every 100 items
@@ -938,7 +1345,9 @@ def convert_existing_items(mpq_mgr):
             if total_done % 100 == 0:
                 print(f"  ... Progress: {total_done} processed ({success} ok, {failed} fail)")
 
-        print(f"\n=== Items: {success} success, {failed} failed, {skipped} skipped ===\n")
+        manifest.save()
+        print(f"\n=== Items: {success} success, {failed} failed, {skipped} skipped, "
+              f"{up_to_date} up to date ===\n")
         return success, failed
 
     else:
@@ -952,27 +1361,35 @@ def convert_existing_items(mpq_mgr):
 
 def main():
     import argparse
+    from batch_convert import add_conversion_arguments, conversion_options
     parser = argparse.ArgumentParser(description='Convert WoW M2 models to GLB')
     parser.add_argument('--type', choices=['characters', 'items', 'all'], default='characters',
                         help='What to convert')
     parser.add_argument('--single', type=str, help='Convert a single M2 path (without .M2 extension)')
     parser.add_argument('--output', type=str, help='Output GLB path (for --single)')
     parser.add_argument('--skin-color', type=int, default=0, help='Skin color index for characters')
+    parser.add_argument('--force', action='store_true',
+                        help='Reconvert items even if their inputs are unchanged')
+    add_conversion_arguments(parser)
     args = parser.parse_args()
+    options = conversion_options(args)
 
     print("Loading MPQ archives...")
     mpq_mgr = MPQManager(CLIENT_DATA)
-    print(f"Indexed {len(mpq_mgr.file_index)} files across {len(mpq_mgr.archives)} archives\n")
+    print(f"Indexed {len(mpq_mgr.vfs)} files across {len(mpq_mgr.archives)} archives\n")
 
     if args.single:
         output = args.output or '/tmp/test_model.glb'
-        convert_model(mpq_mgr, args.single, output, skin_color=args.skin_color)
+        convert_model(mpq_mgr, args.single, output, skin_color=args.skin_color, **options)
     elif args.type == 'characters' or args.type == 'all':
-        convert_all_characters(mpq_mgr)
+        convert_all_characters(mpq_mgr, options)
         if args.type == 'all':
-            convert_existing_items(mpq_mgr)
+            convert_existing_items(mpq_mgr, args.force, options)
     elif args.type == 'items':
-        convert_existing_items(mpq_mgr)
+        convert_existing_items(mpq_mgr, args.force, options)
+
+    print(format_stats(mpq_mgr.texture_cache.stats()))
+    print(format_encoded_stats(mpq_mgr.png_cache.stats()))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Index and vertex reordering for exported GLB meshes.
+
+optimize_vertex_cache() reorders the triangles of an index list for
+post-transform vertex cache locality, using Tom Forsyth's linear-speed
+algorithm: every vertex is scored by its position in a simulated LRU cache
+and by how many unemitted triangles still use it, and the next triangle is
+the best scoring one among those touching cached vertices.
+optimize_vertex_fetch() then renumbers vertices in order of first use so
+vertex fetches walk the vertex buffers sequentially, which also makes the
+quantized buffers compress better.
+
+Example:
+    indices = optimize_vertex_cache(indices, n_vertices)
+    indices, order = optimize_vertex_fetch(indices, n_vertices)
+    positions = positions[order]
+"""
+
+import numpy as np
+
+# Simulated cache size (matches the cost model of current GPUs' vertex reuse)
+VERTEX_CACHE_SIZE = 16
+
+# Forsyth's scoring constants
+_CACHE_DECAY_POWER = 1.5
+_LAST_TRIANGLE_SCORE = 0.75
+_VALENCE_BOOST_SCALE = 2.0
+_VALENCE_BOOST_POWER = 0.5
+
+
+def _cache_scores(cache_size):
+    """Score of a vertex at each cache position (the last triangle's 3 score flat)."""
+    scores = []
+    for position in range(cache_size):
+        if position < 3:
+            scores.append(_LAST_TRIANGLE_SCORE)
+        else:
+            scores.append((1.0 - (position - 3) / (cache_size - 3)) ** _CACHE_DECAY_POWER)
+    return scores
+
+
+def _valence_score(remaining):
+    return _VALENCE_BOOST_SCALE * remaining ** -_VALENCE_BOOST_POWER
+
+
+def optimize_vertex_cache(indices, n_vertices, cache_size=VERTEX_CACHE_SIZE):
+    """Triangle list indices reordered for vertex cache locality (same dtype).
+
+    Index lists whose length is not a multiple of 3 are returned unchanged.
+    """
+    indices = np.asarray(indices)
+    n_triangles = len(indices) // 3
+    if n_triangles < 2 or len(indices) % 3:
+        return indices.copy()
+
+    triangles = indices.reshape(-1, 3).tolist()
+    flat = indices.astype(np.int64)
+    valence = np.bincount(flat, minlength=n_vertices)
+    # Triangles using vertex v: vertex_triangles[starts[v]:starts[v + 1]]
+    vertex_triangles = (np.argsort(flat, kind='stable') // 3).tolist()
+    starts = np.concatenate(([0], np.cumsum(valence))).tolist()
+
+    cache_scores = _cache_scores(cache_size)
+    remaining = valence.tolist()
+    cache_position = [-1] * len(remaining)
+    score = [_valence_score(r) if r else -1.0 for r in remaining]
+    emitted = [False] * n_triangles
+
+    best = max(range(n_triangles), key=lambda t: sum(score[v] for v in triangles[t]))
+    next_unemitted = 0
+    cache = []
+    out = []
+    while best >= 0:
+        emitted[best] = True
+        triangle = triangles[best]
+        out.extend(triangle)
+        for v in triangle:
+            remaining[v] -= 1
+
+        # Move the triangle's vertices to the front of the LRU cache
+        cache = triangle + [v for v in cache if v not in triangle]
+        evicted = cache[cache_size:]
+        cache = cache[:cache_size]
+        for v in evicted:
+            cache_position[v] = -1
+        for position, v in enumerate(cache):
+            cache_position[v] = position
+
+        for v in cache + evicted:
+            if remaining[v] == 0:
+                score[v] = -1.0
+            else:
+                position = cache_position[v]
+                score[v] = _valence_score(remaining[v]) + \
+                    (cache_scores[position] if position >= 0 else 0.0)
+
+        # Best triangle among those touching the cache
+        best = -1
+        best_score = -1.0
+        for v in cache:
+            for t in vertex_triangles[starts[v]:starts[v + 1]]:
+                if emitted[t]:
+                    continue
+                a, b, c = triangles[t]
+                s = score[a] + score[b] + score[c]
+                if s > best_score:
+                    best, best_score = t, s
+
+        if best < 0:
+            # Cache exhausted: continue with the next triangle in input order
+            while next_unemitted < n_triangles and emitted[next_unemitted]:
+                next_unemitted += 1
+            if next_unemitted < n_triangles:
+                best = next_unemitted
+
+    return np.asarray(out, dtype=indices.dtype)
+
+
+def optimize_vertex_fetch(indices, n_vertices):
+    """Renumber vertices in order of first use.
+
+    Returns (remapped indices, order) where new vertex i is old vertex
+    order[i]; vertices not referenced by indices are moved to the end.
+    """
+    indices = np.asarray(indices)
+    used, first_use = np.unique(indices, return_index=True)
+    order = used[np.argsort(first_use, kind='stable')].astype(np.int64)
+    if len(order) < n_vertices:
+        order = np.concatenate((order, np.setdiff1d(np.arange(n_vertices), order)))
+    remap = np.empty(n_vertices, dtype=np.int64)
+    remap[order] = np.arange(n_vertices)
+    return remap[indices].astype(indices.dtype), order
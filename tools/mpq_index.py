@@ -0,0 +1,572 @@
+#!/usr/bin/env python3
+"""
+Persistent MPQ File Index for AoWoW Tools
+
+Opening the client MPQs means decrypting every hash/block table and reading
+every (listfile) before any real work can start. This module does that once,
+resolves archive priority, and writes the result to a versioned snapshot:
+
+  Header     | magic 'AOMI', version, archive count, entry count, slot count
+  Archives   | path, size, mtime_ns, MPQ header offset, sector size shift
+  Entries    | fixed-width records sorted by normalized path
+  Slots      | open-addressing hash table (CRC-32 of normalized path -> entry)
+  Strings    | original file names referenced by the entries
+
+Each entry records the owning archive, its hash-table and block-table position
+and the block entry itself, so files can be read straight from the archive.
+Snapshots are loaded via mmap; exact lookups go through the hash slots and
+prefix listings through a binary search over the sorted entries. They are
+rebuilt only when an archive's size or mtime changes.
+
+Archives themselves are memory-mapped read-only as well, and sectors are
+decompressed directly from the mapped region. Mappings are made once in the
+parent, so forked batch workers share them (and the page cache) instead of
+each keeping its own buffers.
+
+Usage:
+  python3 mpq_index.py                      # Build/refresh the default index
+  python3 mpq_index.py --lookup "Item\\ObjectComponents\\Weapon\\Sword_1H_Long_A_01.M2"
+"""
+
+import bz2
+import hashlib
+import mmap
+import os
+import struct
+import sys
+import zlib
+from array import array
+from io import BytesIO
+
+# ============================================================================
+# Configuration
+# ============================================================================
+
+INDEX_DIR = '/var/www/aowow/cache/mpq'
+
+INDEX_MAGIC = b'AOMI'
+INDEX_VERSION = 2
+
+HEADER_FORMAT = '<4sIIII'           # magic, version, n_archives, n_entries, n_slots
+ARCHIVE_FORMAT = '<QQQH'            # size, mtime_ns, header_offset, sector_shift
+# name_ofs, name_len, archive, pad, hash_idx, block_idx, offset, csize, size, flags
+ENTRY_FORMAT = '<IHBBIIQIII'
+ENTRY_SIZE = struct.calcsize(ENTRY_FORMAT)
+
+MPQ_HEADER_MAGIC = b'MPQ\x1a'
+MPQ_USER_DATA_MAGIC = b'MPQ\x1b'
+# magic, header size, archive size, format version, sector size shift,
+# hash table offset, block table offset, hash table entries, block table entries
+MPQ_HEADER_FORMAT = '<4sIIHHIIII'
+
+MPQ_FILE_COMPRESS = 0x00000200
+MPQ_FILE_ENCRYPTED = 0x00010000
+MPQ_FILE_FIX_KEY = 0x00020000
+MPQ_FILE_SINGLE_UNIT = 0x01000000
+MPQ_FILE_DELETE_MARKER = 0x02000000
+MPQ_FILE_SECTOR_CRC = 0x04000000
+MPQ_FILE_EXISTS = 0x80000000
+
+HASH_ENTRY_EMPTY = 0xFFFFFFFF
+SLOT_EMPTY = 0xFFFFFFFF
+
+
+def normalize_path(path):
+    """Normalize an MPQ path for lookups (lowercase, backslash separators)."""
+    return path.lower().replace('/', '\\')
+
+
+# ============================================================================
+# MPQ hashing and decryption (tables while building the index, encrypted files on read)
+# ============================================================================
+
+def _prepare_crypt_table():
+    seed = 0x00100001
+    table = [0] * 0x500
+    for i in range(256):
+        index = i
+        for _ in range(5):
+            seed = (seed * 125 + 3) % 0x2AAAAB
+            temp1 = (seed & 0xFFFF) << 0x10
+            seed = (seed * 125 + 3) % 0x2AAAAB
+            temp2 = seed & 0xFFFF
+            table[index] = temp1 | temp2
+            index += 0x100
+    return table
+
+
+_CRYPT_TABLE = _prepare_crypt_table()
+
+
+def _hash_string(name_upper, hash_type):
+    """MPQ string hash of an already-uppercased byte string."""
+    seed1 = 0x7FED7FED
+    seed2 = 0xEEEEEEEE
+    base = hash_type << 8
+    table = _CRYPT_TABLE
+    for ch in name_upper:
+        seed1 = (table[base + ch] ^ (seed1 + seed2)) & 0xFFFFFFFF
+        seed2 = (ch + seed1 + seed2 + (seed2 << 5) + 3) & 0xFFFFFFFF
+    return seed1
+
+
+def _decrypt(data, key):
+    """Decrypt MPQ data (hash/block tables, file sectors) into 32-bit words.
+
+    Only whole words are encrypted; trailing bytes are ignored here.
+    """
+    table = _CRYPT_TABLE
+    values = struct.unpack_from(f'<{len(data) // 4}I', data)
+    out = []
+    seed1 = key
+    seed2 = 0xEEEEEEEE
+    for value in values:
+        seed2 = (seed2 + table[0x400 + (seed1 & 0xFF)]) & 0xFFFFFFFF
+        value = (value ^ (seed1 + seed2)) & 0xFFFFFFFF
+        seed1 = (((~seed1 << 0x15) + 0x11111111) | (seed1 >> 0x0B)) & 0xFFFFFFFF
+        seed2 = (value + seed2 + (seed2 << 5) + 3) & 0xFFFFFFFF
+        out.append(value)
+    return out
+
+
+def _decrypt_bytes(data, key):
+    """Decrypt an encrypted file sector, keeping the unencrypted trailing bytes."""
+    words = len(data) // 4
+    return struct.pack(f'<{words}I', *_decrypt(data, key)) + bytes(data[words * 4:])
+
+
+def _file_key(name, offset, size, flags):
+    """Encryption key of a file: hash of its base name, adjusted for MPQ_FILE_FIX_KEY."""
+    base = name.replace(b'/', b'\\').rsplit(b'\\', 1)[-1].upper()
+    key = _hash_string(base, 3)
+    if flags & MPQ_FILE_FIX_KEY:
+        key = ((key + offset) ^ size) & 0xFFFFFFFF
+    return key
+
+
+def _find_hash_entry(hash_table, name):
+    """Locate a file's hash-table slot by probing from its home position.
+
+    hash_table holds (hash_a, hash_b, locale_platform, block_index) tuples.
+    """
+    upper = name.upper()
+    n_slots = len(hash_table)
+    if n_slots == 0:
+        return None
+    hash_a = _hash_string(upper, 1)
+    hash_b = _hash_string(upper, 2)
+    start = _hash_string(upper, 0) & (n_slots - 1)
+    for step in range(n_slots):
+        slot = (start + step) % n_slots
+        entry_a, entry_b, _, block_index = hash_table[slot]
+        if block_index == HASH_ENTRY_EMPTY:
+            return None
+        if entry_a == hash_a and entry_b == hash_b:
+            return slot
+    return None
+
+
+# ============================================================================
+# Index build
+# ============================================================================
+
+def default_index_path(archive_paths):
+    """Snapshot location for a given archive set (one file per set)."""
+    digest = hashlib.sha1('\n'.join(archive_paths).encode('utf-8')).hexdigest()[:12]
+    return os.path.join(INDEX_DIR, f"mpq-{digest}.idx")
+
+
+def _find_mpq_header(data):
+    """Offset of the MPQ header, following a user data header if present."""
+    for offset in range(0, len(data) - struct.calcsize(MPQ_HEADER_FORMAT) + 1, 0x200):
+        magic = data[offset:offset + 4]
+        if magic == MPQ_HEADER_MAGIC:
+            return offset
+        if magic == MPQ_USER_DATA_MAGIC:
+            header_offset = offset + struct.unpack_from('<I', data, offset + 8)[0]
+            if data[header_offset:header_offset + 4] == MPQ_HEADER_MAGIC:
+                return header_offset
+    raise ValueError("No MPQ header found")
+
+
+def _read_tables(data):
+    """Parse an archive's header, hash table and block table.
+
+    Returns (header_offset, sector_shift, hash_table, block_table) with hash
+    entries as (hash_a, hash_b, locale_platform, block_index) and block
+    entries as (offset, archived_size, size, flags).
+    """
+    header_offset = _find_mpq_header(data)
+    (_, _, _, _, sector_shift, hash_offset, block_offset,
+     hash_entries, block_entries) = struct.unpack_from(MPQ_HEADER_FORMAT, data, header_offset)
+
+    def table(offset, entries, key_name):
+        start = header_offset + offset
+        raw = data[start:start + entries * 16]
+        if len(raw) != entries * 16:
+            raise ValueError(f"Truncated {key_name.decode()}")
+        values = _decrypt(raw, _hash_string(key_name, 3))
+        return [tuple(values[i:i + 4]) for i in range(0, len(values), 4)]
+
+    hash_table = table(hash_offset, hash_entries, b'(HASH TABLE)')
+    block_table = table(block_offset, block_entries, b'(BLOCK TABLE)')
+    return header_offset, sector_shift, hash_table, block_table
+
+
+def _scan_archive(data):
+    """Return (header_offset, sector_shift, [(name, slot, block_idx, block)])."""
+    header_offset, sector_shift, hash_table, block_table = _read_tables(data)
+
+    files = []
+    slot = _find_hash_entry(hash_table, b'(listfile)')
+    if slot is not None and hash_table[slot][3] < len(block_table):
+        offset, csize, size, flags = block_table[hash_table[slot][3]]
+        listfile = _read_block(data, header_offset, sector_shift, offset, csize, size, flags,
+                               b'(listfile)')
+        names = listfile.splitlines() if listfile else []
+    else:
+        names = []
+
+    for name in names:
+        slot = _find_hash_entry(hash_table, name)
+        if slot is None:
+            continue
+        block_idx = hash_table[slot][3]
+        if block_idx >= len(block_table):
+            continue
+        files.append((name, slot, block_idx, block_table[block_idx]))
+    return header_offset, sector_shift, files
+
+
+def _map_archive(path):
+    """Read-only mmap of a whole archive file."""
+    with open(path, 'rb') as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def build_index(archive_paths, index_path):
+    """Scan the archives (lowest priority first) and write a snapshot."""
+    archives = []
+    winners = {}  # normalized key -> entry tuple
+
+    for archive_idx, path in enumerate(archive_paths):
+        st = os.stat(path)
+        try:
+            data = _map_archive(path)
+            try:
+                header_offset, sector_shift, files = _scan_archive(data)
+            finally:
+                data.close()
+        except Exception as e:
+            # Keep the archive in the snapshot so it is not retried on every load
+            print(f"  Warning: Could not load {os.path.basename(path)}: {e}", file=sys.stderr)
+            archives.append((path, st.st_size, st.st_mtime_ns, 0, 0))
+            continue
+        archives.append((path, st.st_size, st.st_mtime_ns, header_offset, sector_shift))
+
+        for name, slot, block_idx, (offset, csize, size, flags) in files:
+            key = name.lower().replace(b'/', b'\\')
+            if flags & MPQ_FILE_DELETE_MARKER:
+                winners.pop(key, None)
+                continue
+            if not flags & MPQ_FILE_EXISTS:
+                continue
+            # Later archives override earlier ones
+            winners[key] = (name, archive_idx, slot, block_idx, offset, csize, size, flags)
+        print(f"  Indexed {os.path.basename(path)}", file=sys.stderr)
+
+    archive_blob = BytesIO()
+    for path, size, mtime_ns, header_offset, sector_shift in archives:
+        encoded = path.encode('utf-8')
+        archive_blob.write(struct.pack('<H', len(encoded)))
+        archive_blob.write(encoded)
+        archive_blob.write(struct.pack(ARCHIVE_FORMAT, size, mtime_ns, header_offset, sector_shift))
+
+    keys = sorted(winners)
+    strings = BytesIO()
+    entries = bytearray(len(keys) * ENTRY_SIZE)
+    for i, key in enumerate(keys):
+        name, archive_idx, slot, block_idx, offset, csize, size, flags = winners[key]
+        struct.pack_into(ENTRY_FORMAT, entries, i * ENTRY_SIZE,
+                         strings.tell(), len(name), archive_idx, 0,
+                         slot, block_idx, offset, csize, size, flags)
+        strings.write(name)
+
+    # Load factor <= 0.5 keeps linear probe chains short
+    n_slots = 1
+    while n_slots < len(keys) * 2:
+        n_slots <<= 1
+    slots = array('I', [SLOT_EMPTY]) * n_slots
+    mask = n_slots - 1
+    for i, key in enumerate(keys):
+        slot = zlib.crc32(key) & mask
+        while slots[slot] != SLOT_EMPTY:
+            slot = (slot + 1) & mask
+        slots[slot] = i
+    if sys.byteorder != 'little':
+        slots.byteswap()
+
+    os.makedirs(os.path.dirname(index_path) or '.', exist_ok=True)
+    tmp_path = f"{index_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(struct.pack(HEADER_FORMAT, INDEX_MAGIC, INDEX_VERSION, len(archives), len(keys),
+                            n_slots))
+        f.write(archive_blob.getvalue())
+        f.write(entries)
+        f.write(slots.tobytes())
+        f.write(strings.getvalue())
+    os.replace(tmp_path, index_path)
+
+    print(f"  Wrote MPQ index: {index_path} ({len(keys)} files)", file=sys.stderr)
+
+
+# ============================================================================
+# Index reader
+# ============================================================================
+
+class MPQIndex:
+    """Memory-mapped, sorted index of every file across a set of MPQ archives."""
+
+    def __init__(self, index_path):
+        self.index_path = index_path
+        with open(index_path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version = struct.unpack_from('<4sI', self._map, 0)
+        if magic != INDEX_MAGIC or version != INDEX_VERSION:
+            raise ValueError(f"Unsupported MPQ index {index_path} (magic={magic}, version={version})")
+        _, _, n_archives, n_entries, n_slots = struct.unpack_from(HEADER_FORMAT, self._map, 0)
+
+        pos = struct.calcsize(HEADER_FORMAT)
+        self.archives = []  # (path, size, mtime_ns, header_offset, sector_shift)
+        for _ in range(n_archives):
+            path_len = struct.unpack_from('<H', self._map, pos)[0]
+            pos += 2
+            path = self._map[pos:pos + path_len].decode('utf-8')
+            pos += path_len
+            size, mtime_ns, header_offset, sector_shift = struct.unpack_from(ARCHIVE_FORMAT, self._map, pos)
+            pos += struct.calcsize(ARCHIVE_FORMAT)
+            self.archives.append((path, size, mtime_ns, header_offset, sector_shift))
+
+        self._entries_start = pos
+        self._slots_start = pos + n_entries * ENTRY_SIZE
+        self._strings_start = self._slots_start + n_slots * 4
+        self._count = n_entries
+        self._slot_mask = n_slots - 1
+
+        # Mapped up front so forked workers inherit (and share) the mappings
+        self._archive_maps = {}
+        for archive_idx, (path, size, _, _, _) in enumerate(self.archives):
+            if size == 0:
+                continue
+            try:
+                self._archive_maps[archive_idx] = _map_archive(path)
+            except (OSError, ValueError) as e:
+                print(f"  Warning: Could not map {os.path.basename(path)}: {e}", file=sys.stderr)
+
+    @classmethod
+    def load_or_build(cls, archive_paths, index_path=None):
+        """Load the snapshot for these archives, rebuilding it if any changed."""
+        archive_paths = [p for p in archive_paths if os.path.exists(p)]
+        index_path = index_path or default_index_path(archive_paths)
+        if os.path.exists(index_path):
+            try:
+                index = cls(index_path)
+                if index.is_current(archive_paths):
+                    return index
+                index.close()
+            except (ValueError, struct.error, OSError) as e:
+                print(f"  Warning: Discarding MPQ index {index_path}: {e}", file=sys.stderr)
+        build_index(archive_paths, index_path)
+        return cls(index_path)
+
+    def is_current(self, archive_paths):
+        """True if the snapshot was built from exactly these, unchanged, archives."""
+        if [a[0] for a in self.archives] != list(archive_paths):
+            return False
+        for path, size, mtime_ns, _, _ in self.archives:
+            try:
+                st = os.stat(path)
+            except OSError:
+                return False
+            if st.st_size != size or st.st_mtime_ns != mtime_ns:
+                return False
+        return True
+
+    def close(self):
+        for archive_map in self._archive_maps.values():
+            archive_map.close()
+        self._archive_maps = {}
+        self._map.close()
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, path):
+        return self._find(normalize_path(path).encode('utf-8', 'ignore')) is not None
+
+    # ---- Entries ----
+
+    def _entry(self, i):
+        return struct.unpack_from(ENTRY_FORMAT, self._map, self._entries_start + i * ENTRY_SIZE)
+
+    def _name_at(self, i):
+        name_ofs, name_len = struct.unpack_from('<IH', self._map, self._entries_start + i * ENTRY_SIZE)
+        start = self._strings_start + name_ofs
+        return self._map[start:start + name_len]
+
+    def _key_at(self, i):
+        return self._name_at(i).lower().replace(b'/', b'\\')
+
+    def _find(self, key):
+        """Entry number for a normalized key via the hash slots, or None."""
+        if not self._count:
+            return None
+        slot = zlib.crc32(key) & self._slot_mask
+        while True:
+            i = struct.unpack_from('<I', self._map, self._slots_start + slot * 4)[0]
+            if i == SLOT_EMPTY:
+                return None
+            if self._key_at(i) == key:
+                return i
+            slot = (slot + 1) & self._slot_mask
+
+    def _lower_bound(self, key):
+        """First entry whose normalized key is >= key (entries are sorted)."""
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key_at(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def names(self):
+        """Iterate over the original names of all indexed files."""
+        for i in range(self._count):
+            yield self._name_at(i).decode('utf-8', 'ignore')
+
+    def names_with_prefix(self, prefix):
+        """Iterate, in sorted order, over names whose normalized path starts with prefix."""
+        key = normalize_path(prefix).encode('utf-8', 'ignore')
+        for i in range(self._lower_bound(key), self._count):
+            if not self._key_at(i).startswith(key):
+                break
+            yield self._name_at(i).decode('utf-8', 'ignore')
+
+    def lookup(self, path):
+        """Return (archive_path, hash_index, block_index) for a file, or None."""
+        i = self._find(normalize_path(path).encode('utf-8', 'ignore'))
+        if i is None:
+            return None
+        _, _, archive_idx, _, hash_idx, block_idx, _, _, _, _ = self._entry(i)
+        return self.archives[archive_idx][0], hash_idx, block_idx
+
+    # ---- File data ----
+
+    def read_file(self, path):
+        """Read a file's contents, or None if it is not in any archive."""
+        i = self._find(normalize_path(path).encode('utf-8', 'ignore'))
+        if i is None:
+            return None
+        _, _, archive_idx, _, _, _, offset, csize, size, flags = self._entry(i)
+        archive_map = self._archive_maps.get(archive_idx)
+        if archive_map is None:
+            return None
+        _, _, _, header_offset, sector_shift = self.archives[archive_idx]
+        return _read_block(archive_map, header_offset, sector_shift, offset, csize, size, flags,
+                           bytes(self._name_at(i)))
+
+
+# ============================================================================
+# File data
+# ============================================================================
+
+def _read_block(data, header_offset, sector_shift, offset, csize, size, flags, name):
+    """Extract one file from a mapped archive given its block table entry.
+
+    name (bytes, as in the listfile) is needed to derive the key of
+    encrypted files.
+    """
+    if csize == 0:
+        return None
+    key = _file_key(name, offset, size, flags) if flags & MPQ_FILE_ENCRYPTED else None
+
+    # A view into the mapping: sectors are sliced and decompressed in place
+    start = header_offset + offset
+    block = memoryview(data)[start:start + csize]
+
+    if flags & MPQ_FILE_SINGLE_UNIT:
+        if key is not None:
+            block = _decrypt_bytes(block, key)
+        if flags & MPQ_FILE_COMPRESS and size > csize:
+            return _decompress(block)
+        return bytes(block)
+
+    sector_size = 512 << sector_shift
+    sectors = size // sector_size + 1
+    crc = bool(flags & MPQ_FILE_SECTOR_CRC)
+    if crc:
+        sectors += 1
+    if key is None:
+        positions = struct.unpack_from(f'<{sectors + 1}I', block, 0)
+    else:
+        # The sector offset table uses key - 1, sector i uses key + i
+        positions = _decrypt(block[:(sectors + 1) * 4], (key - 1) & 0xFFFFFFFF)
+    result = bytearray(size)
+    pos = 0
+    for i in range(len(positions) - (2 if crc else 1)):
+        sector = block[positions[i]:positions[i + 1]]
+        if key is not None:
+            sector = _decrypt_bytes(sector, (key + i) & 0xFFFFFFFF)
+        # Sectors that did not shrink are stored raw, even in compressed files
+        if flags & MPQ_FILE_COMPRESS and len(sector) < min(sector_size, size - pos):
+            sector = _decompress(sector)
+        result[pos:pos + len(sector)] = sector
+        pos += len(sector)
+    del result[pos:]
+    return bytes(result)
+
+
+def _decompress(data):
+    """Decompress an MPQ sector according to its leading compression byte."""
+    compression_type = data[0]
+    if compression_type == 0:
+        return bytes(data)
+    if compression_type == 2:
+        return zlib.decompress(data[1:], 15)
+    if compression_type == 16:
+        return bz2.decompress(data[1:])
+    raise RuntimeError("Unsupported compression type.")
+
+
+# ============================================================================
+# Main
+# ============================================================================
+
+def main():
+    import argparse
+    from mpq_vfs import CLIENT_DATA, LOCALE, archive_paths
+
+    parser = argparse.ArgumentParser(description='Build or query the persistent MPQ file index')
+    parser.add_argument('--data', default=CLIENT_DATA, help='Client Data directory')
+    parser.add_argument('--locale', default=LOCALE, help='Client locale (e.g. enUS)')
+    parser.add_argument('--lookup', type=str, help='Show where a file lives')
+    args = parser.parse_args()
+
+    paths = archive_paths(args.data, args.locale)
+    index = MPQIndex.load_or_build(paths)
+    print(f"{len(index)} files across {len(index.archives)} archives ({index.index_path})")
+
+    if args.lookup:
+        found = index.lookup(args.lookup)
+        if found:
+            archive_path, hash_idx, block_idx = found
+            print(f"{args.lookup}: {os.path.basename(archive_path)} hash={hash_idx} block={block_idx}")
+        else:
+            print(f"{args.lookup}: not found")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Unified MPQ virtual filesystem for the AoWoW tools.
+
+Every tool reads client files through one view of the MPQ archives, with the
+client's own priority order: base archives, then locale archives under
+Data/<locale>, then patches, with locale patches on top. The view is backed by
+the persistent MPQ index (mpq_index.py), which gives hash lookups of
+normalized paths and sorted prefix listings without opening the archives.
+
+get_vfs() returns one shared instance per data path and locale, so tools and
+forked batch workers reuse the same index and archive mappings.
+
+Usage:
+  from mpq_vfs import get_vfs
+  vfs = get_vfs()
+  data = vfs.read_file('DBFilesClient\\ItemDisplayInfo.dbc')
+  blps = vfs.list_dir('Item\\TextureComponents\\ArmUpperTexture', extension='.blp')
+"""
+
+import hashlib
+import os
+
+from mpq_index import MPQIndex, normalize_path
+
+# ============================================================================
+# Configuration
+# ============================================================================
+
+CLIENT_DATA = '/var/www/clientdata/Data'
+LOCALE = 'enUS'
+
+# Archives lowest priority first (later archives override earlier ones),
+# relative to the Data directory; {locale} is substituted per instance.
+# Missing archives are skipped.
+ARCHIVES = [
+    'common.MPQ',
+    'common-2.MPQ',
+    'expansion.MPQ',
+    'lichking.MPQ',
+    '{locale}/locale-{locale}.MPQ',
+    '{locale}/expansion-locale-{locale}.MPQ',
+    '{locale}/lichking-locale-{locale}.MPQ',
+    'patch.MPQ',
+    'patch-2.MPQ',
+    'patch-3.MPQ',
+    '{locale}/patch-{locale}.MPQ',
+    '{locale}/patch-{locale}-2.MPQ',
+    '{locale}/patch-{locale}-3.MPQ',
+]
+
+
+def archive_paths(data_path=CLIENT_DATA, locale=LOCALE):
+    """Full paths of all configured archives, lowest priority first."""
+    return [os.path.join(data_path, name.format(locale=locale)) for name in ARCHIVES]
+
+
+# ============================================================================
+# Virtual filesystem
+# ============================================================================
+
+class MPQFileSystem:
+    """Read-only view of a client's MPQ archives (highest priority wins)."""
+
+    def __init__(self, data_path=CLIENT_DATA, locale=LOCALE):
+        self.data_path = data_path
+        self.locale = locale
+        self.index = MPQIndex.load_or_build(archive_paths(data_path, locale))
+        # (name relative to data_path, full path), lowest priority first
+        self.archives = [(os.path.relpath(a[0], data_path), a[0]) for a in self.index.archives]
+        # Fingerprint of the archive set; changes when any archive is added,
+        # removed or rewritten (size or mtime), as checked by the index itself
+        stamps = [(name, size, mtime_ns) for (name, _), (_, size, mtime_ns, _, _)
+                  in zip(self.archives, self.index.archives)]
+        self.state = hashlib.sha1(repr(stamps).encode('utf-8')).hexdigest()
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, path):
+        return path in self.index
+
+    def read_file(self, path):
+        """Contents of a file, or None if no archive has it."""
+        return self.index.read_file(path)
+
+    def archive_of(self, path):
+        """Archive name (relative to data_path) a file is read from, or None."""
+        found = self.index.lookup(path)
+        if found is None:
+            return None
+        return os.path.relpath(found[0], self.data_path)
+
+    def names(self):
+        """Iterate over all file names."""
+        return self.index.names()
+
+    def list_prefix(self, prefix):
+        """All file names whose normalized path starts with prefix, sorted."""
+        return list(self.index.names_with_prefix(prefix))
+
+    def list_dir(self, directory, prefix='', extension=None, recursive=False):
+        """Files in directory whose base name starts with prefix.
+
+        Matching is case-insensitive. extension (e.g. '.blp') filters by
+        suffix; recursive also includes files in subdirectories.
+        """
+        directory = normalize_path(directory).rstrip('\\')
+        base = f"{directory}\\" if directory else ''
+        extension = extension.lower() if extension else None
+        results = []
+        for name in self.index.names_with_prefix(base + prefix):
+            rest = normalize_path(name)[len(base):]
+            if not recursive and '\\' in rest:
+                continue
+            if extension and not rest.endswith(extension):
+                continue
+            results.append(name)
+        return results
+
+
+_instances = {}
+
+
+def get_vfs(data_path=CLIENT_DATA, locale=LOCALE):
+    """Shared MPQFileSystem for data_path/locale (created on first use)."""
+    key = (os.path.abspath(data_path), locale)
+    vfs = _instances.get(key)
+    if vfs is None:
+        vfs = _instances[key] = MPQFileSystem(data_path, locale)
+    return vfs
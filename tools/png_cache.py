@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Persistent on-disk cache of encoded texture payloads.
+
+Resizing with LANCZOS and PNG-encoding with optimize=True is the slowest
+step of a GLB conversion, and the same BLP is embedded by many models and
+re-encoded on every run. Encoded payloads are stored under CACHE_DIR keyed by
+the source BLP content hash plus a variant string that names the target size
+and encoder settings, so a payload is only ever produced once per variant.
+
+Layout: CACHE_DIR/<key[:2]>/<key>.<extension> with key = sha1("<blp sha1>:<variant>");
+the extension names the payload format (png by default, ktx2 for GPU-compressed
+textures).
+Bump ENCODER_VERSION when encoding changes for an unchanged variant string.
+"""
+
+import hashlib
+import os
+import sys
+import threading
+
+CACHE_DIR = '/var/www/aowow/cache/textures'
+ENCODER_VERSION = 1
+
+
+class EncodedTextureCache:
+    """Encoded texture bytes by (BLP content hash, variant)."""
+
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir or CACHE_DIR
+        self.hits = 0
+        self.misses = 0
+        self._writable = True
+        self._lock = threading.Lock()
+
+    def _path(self, digest, variant, extension):
+        key = hashlib.sha1(f"{digest}:{variant}:v{ENCODER_VERSION}".encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, key[:2], f"{key}.{extension}")
+
+    def get(self, digest, variant, encode, extension='png'):
+        """Cached payload for digest/variant, calling encode() to produce it on a miss.
+
+        encode() may return None if the variant cannot be produced; nothing is
+        cached then and None is returned.
+        """
+        path = self._path(digest, variant, extension)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            if data:
+                with self._lock:
+                    self.hits += 1
+                return data
+        except OSError:
+            pass
+
+        data = encode()
+        with self._lock:
+            self.misses += 1
+        if data and self._writable:
+            self._store(path, data)
+        return data
+
+    def _store(self, path, data):
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            # Keep working uncached (e.g. cache dir not writable by this user)
+            print(f"  Warning: Encoded texture cache disabled: {e}", file=sys.stderr)
+            self._writable = False
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses}
+
+
+def format_encoded_stats(stats):
+    """One-line summary of cache counters."""
+    lookups = stats['hits'] + stats['misses']
+    rate = 100.0 * stats['hits'] / lookups if lookups else 0.0
+    return f"Encoded texture cache: {stats['hits']} hits, {stats['misses']} misses ({rate:.1f}% hit rate)"
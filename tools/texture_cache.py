@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+In-memory cache of decoded BLP textures for the AoWoW tools.
+
+Batch conversions and the compositor read the same BLPs over and over
+(shared item textures, creature skins, TextureComponents pieces). The cache
+keeps decoded images keyed by normalized MPQ path, bounded by decoded size
+(width * height * 4 bytes) and evicting least recently used entries first.
+
+Cached images are shared between callers and must not be modified in place;
+every consumer resizes/copies before compositing or encoding.
+
+ImageCache is the same size-bounded LRU for derived images (resized texture
+components, partially composited atlas regions; PIL images or NumPy arrays)
+under caller-chosen keys.
+"""
+
+import threading
+from collections import OrderedDict, namedtuple
+
+from blp import decode_blp
+from build_manifest import content_hash
+from mpq_index import normalize_path
+
+# Default budget for decoded textures per process
+TEXTURE_CACHE_MB = 256
+
+# image is None if the file exists but could not be decoded; digest and
+# file_size describe the BLP bytes (for build manifests and logging);
+# nbytes is the decoded size counted against the cache budget
+CachedTexture = namedtuple('CachedTexture', ['image', 'digest', 'file_size', 'nbytes'])
+
+
+class DecodedTextureCache:
+    """Size-bounded LRU of decoded textures with hit/miss/eviction counters."""
+
+    def __init__(self, max_bytes=TEXTURE_CACHE_MB * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, mpq, path):
+        """Decoded texture for an MPQ path, reading it via mpq on a miss.
+
+        Returns a CachedTexture, or None if the file does not exist.
+        """
+        key = normalize_path(path)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+
+        blp_data = mpq.read_file(path)
+        if not blp_data:
+            return None
+        image = decode_blp(blp_data)
+        nbytes = image.width * image.height * 4 if image else 0
+        entry = CachedTexture(image, content_hash(blp_data), len(blp_data), nbytes)
+
+        with self._lock:
+            self.misses += 1
+            if nbytes > self.max_bytes:
+                return entry
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.current_bytes -= previous.nbytes
+            self._entries[key] = entry
+            self.current_bytes += nbytes
+            while self.current_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.current_bytes -= evicted.nbytes
+                self.evictions += 1
+        return entry
+
+    def stats(self):
+        """Counters as a dict (summable across worker processes)."""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self.current_bytes,
+            }
+
+
+class ImageCache:
+    """Size-bounded LRU of derived images under arbitrary hashable keys."""
+
+    def __init__(self, max_bytes=TEXTURE_CACHE_MB * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Cached value for key (counted as a hit), or default."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def get_or_create(self, key, create):
+        """Cached value for key, calling create() on a miss.
+
+        create may return None (cached too, so lookups of missing textures
+        stay cheap), a PIL image or NumPy array, or a tuple whose first
+        element is one; the image's decoded size counts against the budget.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+        value = create()
+        self.put(key, value, count_miss=True)
+        return value
+
+    def put(self, key, value, count_miss=False):
+        image = value[0] if isinstance(value, tuple) else value
+        if image is None:
+            nbytes = 0
+        elif hasattr(image, 'nbytes'):
+            nbytes = image.nbytes
+        else:
+            nbytes = image.width * image.height * 4
+        with self._lock:
+            if count_miss:
+                self.misses += 1
+            if nbytes > self.max_bytes:
+                return
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.current_bytes -= previous[1]
+            self._entries[key] = (value, nbytes)
+            self.current_bytes += nbytes
+            while self.current_bytes > self.max_bytes:
+                _, (_, evicted_bytes) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_bytes
+                self.evictions += 1
+
+    def stats(self):
+        """Counters as a dict (summable across worker processes)."""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self.current_bytes,
+            }
+
+
+def format_stats(stats, label='Texture cache'):
+    """One-line summary of cache counters."""
+    lookups = stats['hits'] + stats['misses']
+    rate = 100.0 * stats['hits'] / lookups if lookups else 0.0
+    return (f"{label}: {stats['hits']} hits, {stats['misses']} misses ({rate:.1f}% hit rate), "
+            f"{stats['evictions']} evictions, {stats['entries']} cached "
+            f"({stats['bytes'] / (1024 * 1024):.1f} MB)")
@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+"""
+Resident Character Texture Compositor for AoWoW
+
+Keeps the MPQ index, parsed item display info and recently decoded BLP
+textures warm in one long-lived process, so api/character-texture.php no
+longer pays interpreter startup, imports and index loading per cache miss.
+
+Renders run on a fixed pool of --workers threads behind a bounded queue.
+Requests for a combination that is already queued or rendering wait for
+that render instead of starting another one, so a popular profile opened by
+many visitors at once costs one render. When the queue is full the server
+replies busy and the endpoint asks the client to retry.
+
+Requests may name the image encoder for the reply ("encoder", e.g. png-fast
+for a quick first response) and a "reencode" encoder; the saved file is then
+re-encoded with it on a background thread once the reply has been sent
+(kept only if smaller).
+
+Protocol (Unix stream socket, one JSON object per line):
+  request:  {"race": "bloodelf", "sex": "female", "skin": 0,
+             "items": [220, 229], "output": "/var/www/aowow/cache/chartex/<key>.png",
+             "encoder": "png-fast", "reencode": "png-optimize"}   (last two optional)
+  response: {"ok": true, "output": "...", "ms": 42, "coalesced": false}
+            {"ok": false, "error": "..."}
+            {"ok": false, "busy": true, "error": "render queue full"}
+
+Usage:
+  python3 texture_server.py                           # Listen on the default socket
+  python3 texture_server.py --socket /tmp/chartex.sock
+  python3 texture_server.py --socket-group www-data    # Socket is 0660; let PHP connect
+  python3 texture_server.py --workers 4 --max-queued 64
+  python3 texture_server.py --dxt --dds                # Block compositing + .dds copies
+"""
+
+import argparse
+import contextlib
+import grp
+import json
+import re
+import os
+import socketserver
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from composite_texture import (
+    MPQ_DATA_PATH, DISPLAY_INFO_PATH, DISPLAY_INFO_BIN_PATH, SOCKET_PATH,
+    MPQTextureReader, composite_to_file, load_display_info, reencode_file,
+)
+from image_encoding import DEFAULT_ENCODER, encoder_argument, parse_encoder
+from texture_cache import DecodedTextureCache, format_stats
+
+# Renders may only be written to this directory (the PHP endpoint's cache),
+# under the endpoint's <md5 key>.<ext> names
+OUTPUT_DIR = '/var/www/aowow/cache/chartex'
+OUTPUT_NAME_RE = re.compile(r'^[0-9a-f]{32}\.(png|webp|dds)$')
+
+# Decoded textures kept in memory (base skins + TextureComponents pieces)
+DECODED_CACHE_MB = 512
+
+# Renders running at once; at most MAX_QUEUED further distinct renders wait
+RENDER_WORKERS = max(1, (os.cpu_count() or 2) // 2)
+MAX_QUEUED = 64
+
+
+# ============================================================================
+# Warm state
+# ============================================================================
+
+class DisplayInfoCache:
+    """Loaded item display info (binary index or JSON), reloaded when the export changes.
+
+    A replaced binary index is closed (unmapped) once no render uses it.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._data = None
+        self._users = {}  # id(data) -> renders using it
+
+    @contextlib.contextmanager
+    def use(self):
+        """Current display info (or None) for the duration of a render."""
+        mtime = tuple(os.path.getmtime(p) if os.path.exists(p) else None
+                      for p in (DISPLAY_INFO_PATH, DISPLAY_INFO_BIN_PATH))
+        with self._lock:
+            if mtime != self._mtime:
+                previous = self._data
+                self._data = load_display_info() if mtime != (None, None) else None
+                self._mtime = mtime
+                if id(previous) not in self._users:
+                    _close_display_info(previous)
+            data = self._data
+            self._users[id(data)] = self._users.get(id(data), 0) + 1
+        try:
+            yield data
+        finally:
+            with self._lock:
+                self._users[id(data)] -= 1
+                if not self._users[id(data)]:
+                    del self._users[id(data)]
+                    if data is not self._data:
+                        _close_display_info(data)
+
+
+def _close_display_info(data):
+    """Unmap a binary DisplayInfoIndex; parsed JSON needs nothing."""
+    if hasattr(data, 'close'):
+        data.close()
+
+
+class RenderQueue:
+    """Bounded render pool that coalesces identical in-flight requests."""
+
+    def __init__(self, render, workers=RENDER_WORKERS, max_queued=MAX_QUEUED):
+        self._render = render
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix='render')
+        self._lock = threading.Lock()
+        self._in_flight = {}
+        self.max_in_flight = workers + max_queued
+        self.rendered = 0
+        self.coalesced = 0
+        self.rejected = 0
+
+    def submit(self, key, *args):
+        """Future for render(*args), shared by every request for key while it runs.
+
+        Returns (future, coalesced), or (None, False) if the queue is full.
+        """
+        with self._lock:
+            future = self._in_flight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return future, True
+            if len(self._in_flight) >= self.max_in_flight:
+                self.rejected += 1
+                return None, False
+            future = self._executor.submit(self._run, key, args)
+            self._in_flight[key] = future
+            return future, False
+
+    def _run(self, key, args):
+        try:
+            return self._render(*args)
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+                self.rendered += 1
+
+    def stats(self):
+        with self._lock:
+            return {'rendered': self.rendered, 'coalesced': self.coalesced,
+                    'rejected': self.rejected, 'in_flight': len(self._in_flight)}
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+
+# ============================================================================
+# Server
+# ============================================================================
+
+def parse_request(line, output_dir, default_encoder=DEFAULT_ENCODER):
+    """Validate a request line into (race, sex, skin, display_ids, output, encoder, reencode).
+
+    reencode is None unless the request asks for a background re-encode.
+    """
+    req = json.loads(line)
+    race = ''.join(c for c in str(req.get('race', 'human')) if c.isalpha())
+    sex = 'female' if str(req.get('sex', 'male')).lower() == 'female' else 'male'
+    skin = int(req.get('skin', 0))
+    display_ids = [int(d) for d in req.get('items', [])]
+    output = req.get('output')
+    if not output:
+        raise ValueError('missing output path')
+    output = os.path.realpath(output)
+    if os.path.dirname(output) != os.path.realpath(output_dir):
+        raise ValueError(f"output must be inside {output_dir}")
+    if not OUTPUT_NAME_RE.match(os.path.basename(output)):
+        raise ValueError('output must be named <md5 key>.png/.webp/.dds')
+    encoder = parse_encoder(req.get('encoder') or default_encoder)
+    reencode = parse_encoder(req['reencode']) if req.get('reencode') else None
+    return race, sex, skin, display_ids, output, encoder, reencode
+
+
+class CompositeHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            return
+        start = time.time()
+        try:
+            race, sex, skin, display_ids, output, encoder, reencode = parse_request(
+                line, self.server.output_dir, self.server.encoder)
+            # Item order is part of the key: it decides which layer ends up on top
+            key = (race, sex, skin, tuple(display_ids), output, encoder)
+            future, coalesced = self.server.renders.submit(key, race, sex, skin, display_ids,
+                                                           output, encoder)
+            if future is None:
+                reply = {'ok': False, 'busy': True, 'error': 'render queue full'}
+            else:
+                future.result()
+                reply = {'ok': True, 'output': output, 'ms': int((time.time() - start) * 1000),
+                         'coalesced': coalesced}
+                if reencode and reencode != encoder:
+                    self.server.schedule_reencode(output, reencode)
+        except Exception as e:
+            print(f"  ERROR: {e}", file=sys.stderr)
+            reply = {'ok': False, 'error': str(e)}
+        self.wfile.write(json.dumps(reply).encode('utf-8') + b'\n')
+
+
+class CompositeServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, mpq_reader, output_dir=OUTPUT_DIR, workers=RENDER_WORKERS,
+                 max_queued=MAX_QUEUED, dxt=False, dds=False, encoder=DEFAULT_ENCODER):
+        self.mpq_reader = mpq_reader
+        self.output_dir = output_dir
+        self.dxt = dxt
+        self.dds = dds
+        self.encoder = encoder
+        self.display_info = DisplayInfoCache()
+        self.renders = RenderQueue(self.render, workers, max_queued)
+        # Background re-encodes run one at a time, after renders have replied
+        self.max_reencodes = max_queued
+        self.reencoded = 0
+        self._reencoder = ThreadPoolExecutor(1, thread_name_prefix='reencode')
+        self._reencode_pending = set()
+        self._reencode_lock = threading.Lock()
+        super().__init__(socket_path, CompositeHandler)
+
+    def render(self, race, sex, skin, display_ids, output, encoder):
+        with self.display_info.use() as display_info:
+            composite_to_file(self.mpq_reader, race, sex, skin, display_ids, output,
+                              display_info, self.dxt, self.dds, encoder)
+
+    def schedule_reencode(self, output, encoder):
+        """Queue a background re-encode of output (dropped if already queued or the queue is full)."""
+        with self._reencode_lock:
+            if output in self._reencode_pending or len(self._reencode_pending) >= self.max_reencodes:
+                return
+            self._reencode_pending.add(output)
+        self._reencoder.submit(self._reencode, output, encoder)
+
+    def _reencode(self, output, encoder):
+        try:
+            if reencode_file(output, encoder) is not None:
+                self.reencoded += 1
+        except Exception as e:
+            print(f"  Warning: Re-encoding {output} failed: {e}", file=sys.stderr)
+        finally:
+            with self._reencode_lock:
+                self._reencode_pending.discard(output)
+
+    def server_close(self):
+        super().server_close()
+        self.renders.shutdown()
+        self._reencoder.shutdown(wait=True, cancel_futures=True)
+
+
+# ============================================================================
+# Main
+# ============================================================================
+
+def main():
+    parser = argparse.ArgumentParser(description='Resident character texture compositor')
+    parser.add_argument('--socket', default=SOCKET_PATH, help='Unix socket to listen on')
+    parser.add_argument('--socket-group', metavar='GROUP',
+                        help="Group given access to the socket (the web server's, e.g. www-data)")
+    parser.add_argument('--output-dir', default=OUTPUT_DIR, help='Directory renders are written to')
+    parser.add_argument('--cache-mb', type=int, default=DECODED_CACHE_MB,
+                        help='Memory budget for decoded BLP textures (MB)')
+    parser.add_argument('--workers', type=int, default=RENDER_WORKERS,
+                        help=f'Renders running at once (default: {RENDER_WORKERS})')
+    parser.add_argument('--max-queued', type=int, default=MAX_QUEUED,
+                        help=f'Distinct renders allowed to wait before replying busy (default: {MAX_QUEUED})')
+    parser.add_argument('--dxt', action='store_true',
+                        help='Composite DXT blocks directly when the BLP mips match the atlas')
+    parser.add_argument('--dds', action='store_true', help='Also write each render as DXT5 <key>.dds')
+    parser.add_argument('--encoder', type=encoder_argument, default=DEFAULT_ENCODER, metavar='SPEC',
+                        help='Image encoder for requests that do not name one (default: png-optimize)')
+    args = parser.parse_args()
+
+    print("Loading MPQ archives...", file=sys.stderr)
+    texture_cache = DecodedTextureCache(args.cache_mb * 1024 * 1024)
+    mpq_reader = MPQTextureReader(MPQ_DATA_PATH, texture_cache)
+
+    if os.path.exists(args.socket):
+        os.unlink(args.socket)
+    server = CompositeServer(args.socket, mpq_reader, args.output_dir, max(1, args.workers),
+                             max(0, args.max_queued), args.dxt, args.dds, args.encoder)
+    # Only the owner and the web server's group may connect: anyone who can
+    # queues renders and writes files into the cache
+    os.chmod(args.socket, 0o660)
+    if args.socket_group:
+        os.chown(args.socket, -1, grp.getgrnam(args.socket_group).gr_gid)
+    with server.display_info.use():
+        pass
+
+    print(f"Listening on {args.socket}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(args.socket)
+        print(format_stats(texture_cache.stats()), file=sys.stderr)
+        print(format_stats(mpq_reader.composite_cache.stats(), 'Composite cache'), file=sys.stderr)
+        stats = server.renders.stats()
+        print(f"Renders: {stats['rendered']} rendered, {stats['coalesced']} coalesced, "
+              f"{stats['rejected']} rejected (queue full), {server.reencoded} re-encoded",
+              file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()